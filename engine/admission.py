@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+# 重い処理（AIコメント・PDF 生成）の同時実行の制御（アドミッション制御）
+# - ゲートごとに同時実行数（slots）を決め、超えた分は待ち行列へ。待ち行列には上限（max_queue）がある
+# - 待ち行列はキー（セッション）ごとに分け、キーを巡回して1件ずつ通す（1セッションの連続送信が他を待たせない）
+# - 入場時に「前に何件いるか × 平均処理時間 ÷ slots」で待ち時間を見積もり、待てる時間を超えるなら待たずに断る（shed）
+#   断られた側は縮退する（AIコメント → 静的コメント、PDF → 軽量版）。待ち切れずに時間切れになるより早く結果を返す
+#   sheddable=False は見積もりでは断らず、通常の待ち行列より先に通す（軽量版 PDF など、断られた側が必ず作る安い処理）。
+#   max_wait を過ぎたら False（打ち切った通常版が枠を持ったままのときなど。呼び出し側は枠の外で作る）
+# - 同時実行数を抑えるのは、ワーカーを増やしても CPU（PDF は GIL）や OpenAI の接続数が頭打ちのため。
+#   全員が同時に走ると全員が遅くなるだけで、処理量（件/秒）はかえって落ちる
+# - 結果画面は position(キー) で「前に N 件」を表示する
+#
+# 使い方（バースト時の処理量・待ち時間の確認。PDF を実際に生成する）:
+#   python -m engine.admission burst --jobs 60 --slots 2 --budget 2.5
+#   python -m engine.admission burst --jobs 60 --ungated
+import argparse, json, math, sys, threading, time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from engine import metrics
+
+DEFAULT_AI_SLOTS = 8       # engine/http_pool.py の OPENAI_MAX_CONNECTIONS と同じ
+DEFAULT_PDF_SLOTS = 1      # PDF 生成は大半が GIL を持つ Python 処理。並べても処理量は増えず、1件ごとが遅くなるだけ
+DEFAULT_MAX_QUEUE = 64
+# 実績が出るまでの平均処理時間の見込み（秒）。バースト直後の全員が「見積もれないので待つ」にならないように
+EXPECTED_SEC = {"ai": 5.0, "pdf": 0.2}
+HOLD_EWMA_ALPHA = 0.2      # 平均処理時間（見積もり用）の指数移動平均の重み
+
+metrics.describe("admission_admitted_total", "ゲートを通った件数")
+metrics.describe("admission_shed_total", "断った件数（reason=queue_full / wait / timeout）")
+metrics.describe("admission_wait_seconds", "ゲートの待ち時間")
+metrics.describe("admission_in_use", "実行中の件数")
+metrics.describe("admission_queued", "待ち行列の件数")
+
+class _Waiter:
+    __slots__ = ("key", "granted", "event")
+
+    def __init__(self, key: str):
+        self.key = key
+        self.granted = False
+        self.event = threading.Event()   # 通す相手だけを起こす（全員を起こすと GIL を取り合い、実行中の処理が遅れる）
+
+class Gate:
+    def __init__(self, name: str, slots: int, max_queue: int = DEFAULT_MAX_QUEUE, expected_sec: float | None = None):
+        self.name = name
+        self.slots = max(1, int(slots))
+        self.max_queue = max(0, int(max_queue))
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._queues: OrderedDict = OrderedDict()   # key -> deque[_Waiter]（先頭のキーから巡回）
+        self._queued = 0
+        self._urgent: deque = deque()   # sheddable=False の待ち（巡回より先に通す）
+        self._hold_sec: float | None = expected_sec
+        self._stats = {"admitted": 0, "shed_queue_full": 0, "shed_wait": 0, "shed_timeout": 0, "wait_sec": 0.0}
+
+    # ========= 待ち行列（ロック内で呼ぶ） =========
+    def _ahead(self, w: _Waiter) -> int:
+        """w より先に通る件数。sheddable=False の待ちは全件、巡回順で w のキーより前のキーは k+1 件、
+        後ろのキーは k 件まで先に通る"""
+        if w in self._urgent:
+            return self._urgent.index(w)
+        k = self._queues[w.key].index(w)
+        n, before = k + len(self._urgent), True
+        for key, q in self._queues.items():
+            if key == w.key:
+                before = False
+                continue
+            n += min(len(q), k + 1 if before else k)
+        return n
+
+    def _remove(self, w: _Waiter):
+        if w in self._urgent:
+            self._urgent.remove(w)
+            self._queued -= 1
+            return
+        q = self._queues.get(w.key)
+        if q is not None and w in q:
+            q.remove(w)
+            self._queued -= 1
+            if not q:
+                del self._queues[w.key]
+
+    def _grant(self):
+        while self._in_use < self.slots and self._queued:
+            if self._urgent:
+                w = self._urgent.popleft()
+            else:
+                key, q = next(iter(self._queues.items()))
+                w = q.popleft()
+                if q:
+                    self._queues.move_to_end(key)
+                else:
+                    del self._queues[key]
+            self._queued -= 1
+            w.granted = True
+            self._in_use += 1
+            w.event.set()
+
+    def _shed(self, reason: str) -> bool:
+        self._stats[f"shed_{reason}"] += 1
+        metrics.inc("admission_shed_total", {"gate": self.name, "reason": reason})
+        return False
+
+    # ========= 入場・退場 =========
+    def acquire(self, key: str, max_wait: float | None = None, sheddable: bool = True) -> bool:
+        """通れたら True（終わったら release）。断ったら False"""
+        t0 = time.perf_counter()
+        w = None
+        with self._lock:
+            if self._in_use < self.slots and not self._queued:
+                self._in_use += 1
+            else:
+                if sheddable and self._queued >= self.max_queue:
+                    return self._shed("queue_full")
+                w = _Waiter(key)
+                if sheddable:
+                    self._queues.setdefault(key, deque()).append(w)
+                else:
+                    self._urgent.append(w)
+                self._queued += 1
+                if sheddable and max_wait is not None:
+                    est = self.estimate_wait(self._ahead(w))
+                    if est is not None and est > max_wait:
+                        self._remove(w)
+                        return self._shed("wait")
+        if w is not None:
+            w.event.wait(max_wait)
+        with self._lock:
+            if w is not None and not w.granted:   # 時間切れ（直前に通された場合は通す）
+                self._remove(w)
+                return self._shed("timeout")
+            self._stats["admitted"] += 1
+            self._stats["wait_sec"] += time.perf_counter() - t0
+        metrics.inc("admission_admitted_total", {"gate": self.name})
+        metrics.observe("admission_wait_seconds", time.perf_counter() - t0, {"gate": self.name})
+        return True
+
+    def release(self, held_sec: float | None = None):
+        with self._lock:
+            self._in_use -= 1
+            if held_sec is not None:
+                self._hold_sec = held_sec if self._hold_sec is None else \
+                    (1 - HOLD_EWMA_ALPHA) * self._hold_sec + HOLD_EWMA_ALPHA * held_sec
+            self._grant()
+
+    @contextmanager
+    def slot(self, key: str, max_wait: float | None = None, sheddable: bool = True):
+        """with gate.slot(key, 2.0) as admitted: ...（admitted が False なら縮退する）"""
+        ok = self.acquire(key, max_wait, sheddable)
+        t0 = time.perf_counter()
+        try:
+            yield ok
+        finally:
+            if ok:
+                # 見積もりに使う平均処理時間は、断るかどうか判断する側の処理（sheddable）だけで測る
+                self.release(time.perf_counter() - t0 if sheddable else None)
+
+    # ========= 参照 =========
+    def estimate_wait(self, ahead: int) -> float | None:
+        """前に ahead 件いるときの待ち時間の見積もり（秒）。実績も見込みもなければ None"""
+        if self._hold_sec is None:
+            return None
+        return math.ceil((ahead + 1) / self.slots) * self._hold_sec
+
+    def position(self, key: str) -> int | None:
+        """key の待ちのうち最も前のものの「前に何件」。待っていなければ None"""
+        with self._lock:
+            mine = [w for w in self._urgent if w.key == key] + list(self._queues.get(key, ()))
+            return min(self._ahead(w) for w in mine) if mine else None
+
+    def in_use(self) -> int:
+        with self._lock:
+            return self._in_use
+
+    def queued(self) -> int:
+        with self._lock:
+            return self._queued
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+            wait_sec = s.pop("wait_sec")
+            return {"gate": self.name, "slots": self.slots, "in_use": self._in_use, "queued": self._queued,
+                    "max_queue": self.max_queue, **s,
+                    "avg_wait_ms": round(wait_sec / s["admitted"] * 1000.0, 1) if s["admitted"] else None,
+                    "avg_hold_ms": round(self._hold_sec * 1000.0, 1) if self._hold_sec is not None else None}
+
+# ========= プロセス共有 =========
+_gates: dict = {}
+_gates_lock = threading.Lock()
+_DEFAULT_SLOTS = {"ai": DEFAULT_AI_SLOTS, "pdf": DEFAULT_PDF_SLOTS}
+
+def gate(name: str) -> Gate:
+    with _gates_lock:
+        g = _gates.get(name)
+        if g is None:
+            g = _gates[name] = Gate(name, _DEFAULT_SLOTS.get(name, 1), expected_sec=EXPECTED_SEC.get(name))
+            if len(_gates) == 1:
+                metrics.register_gauge("admission_in_use",
+                                       lambda: {(("gate", n),): x.in_use() for n, x in list(_gates.items())})
+                metrics.register_gauge("admission_queued",
+                                       lambda: {(("gate", n),): x.queued() for n, x in list(_gates.items())})
+        return g
+
+def configure(name: str, slots=None, max_queue=None) -> Gate:
+    """Secrets の値で上書き（None・空欄は既定のまま）"""
+    g = gate(name)
+    with g._lock:
+        if slots not in (None, ""):
+            g.slots = max(1, int(slots))
+        if max_queue not in (None, ""):
+            g.max_queue = max(0, int(max_queue))
+        g._grant()
+    return g
+
+def stats() -> list[dict]:
+    with _gates_lock:
+        gates = list(_gates.values())
+    return [g.stats() for g in gates]
+
+# ========= バースト試験 =========
+def burst(jobs: int, slots: int, budget: float, ungated: bool = False, max_queue: int = DEFAULT_MAX_QUEUE) -> dict:
+    """jobs 件の PDF 生成を同時に投入し、予算内に通常版・軽量版のどちらで返せたかと処理量を測る"""
+    from engine import report
+    from engine.warmup import synthetic_scores
+    df = synthetic_scores()
+    payload = {"company": "株式会社テスト", "email": "", "dt": "2026-01-01 00:00", "signal": "黄",
+               "main_type": "テスト", "comment": "バースト試験"}
+    report.make_pdf_bytes(payload, df)   # ウォームアップ（フォント・matplotlib）
+    g = Gate("burst", slots, max_queue, expected_sec=EXPECTED_SEC["pdf"])
+    lock = threading.Lock()
+    out = {"full": 0, "lite": 0, "latency": []}
+    start = threading.Event()
+
+    def one(i: int):
+        start.wait()
+        t0 = time.perf_counter()
+        if ungated:
+            report.make_pdf_bytes(payload, df)
+            kind = "full"
+        else:
+            with g.slot(f"s{i}", budget) as admitted:
+                if admitted:
+                    report.make_pdf_bytes(payload, df)
+            if not admitted:
+                with g.slot(f"s{i}", sheddable=False):
+                    report.make_pdf_bytes(payload, df, lite=True)
+            kind = "full" if admitted else "lite"
+        with lock:
+            out[kind] += 1
+            out["latency"].append(time.perf_counter() - t0)
+
+    threads = [threading.Thread(target=one, args=(i,), daemon=True) for i in range(jobs)]
+    for t in threads:
+        t.start()
+    t0 = time.perf_counter()
+    start.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    lat = sorted(out["latency"])
+
+    def pct(p):
+        return round(lat[max(0, math.ceil(p / 100.0 * len(lat)) - 1)] * 1000.0) if lat else None
+    return {"jobs": jobs, "mode": "ungated" if ungated else f"slots={slots}", "elapsed_sec": round(elapsed, 2),
+            "full": out["full"], "lite": out["lite"],
+            "within_budget": sum(1 for x in lat if x <= budget), "full_per_sec": round(out["full"] / elapsed, 2),
+            "p50_ms": pct(50), "p95_ms": pct(95), "max_ms": pct(100), "gate": None if ungated else g.stats()}
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m engine.admission", description="同時実行の制御（バースト試験）")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("burst", help="PDF 生成を一度に投入して処理量・待ち時間を測る")
+    b.add_argument("--jobs", type=int, default=60)
+    b.add_argument("--slots", type=int, default=DEFAULT_PDF_SLOTS)
+    b.add_argument("--budget", type=float, default=2.5, help="1件あたり待てる秒数（超える見込みなら軽量版）")
+    b.add_argument("--max-queue", type=int, default=DEFAULT_MAX_QUEUE)
+    b.add_argument("--ungated", action="store_true", help="制御なし（全件を同時に実行）")
+    args = ap.parse_args(argv)
+    print(json.dumps(burst(args.jobs, args.slots, args.budget, args.ungated, args.max_queue), ensure_ascii=False))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# AIコメント生成（OpenAI）
+# - アプリ本体・バッチ処理から共通利用（Streamlit に依存しない）
+# - openai>=1.0（OpenAI クライアント）と旧 API（openai.ChatCompletion）の両方に対応
+#   クライアントは engine/http_pool.py で API キーごとに1つだけ作り、接続を使い回す
+# - 失敗時は1回だけ待って再試行し、それでも失敗したら (None, エラー文言) を返す
+import time
+
+from engine import http_pool
+
+OPENAI_MODEL = "gpt-4o-mini"
+SYSTEM_PROMPT = "専門的かつ簡潔。日本語。実務に直結する助言を。"
+RETRY_WAIT_SEC = 4
+
+def _openai_client(api_key: str):
+    try:
+        return "new", http_pool.openai_client(api_key)
+    except Exception:
+        import openai
+        openai.api_key = api_key
+        return "old", openai
+
+def complete(api_key: str, user_prompt: str, model: str = OPENAI_MODEL):
+    """(コメント, None) または (None, エラー文言)"""
+    mode, client = _openai_client(api_key)
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt},
+    ]
+    for attempt in range(2):
+        try:
+            if mode == "new":
+                resp = client.chat.completions.create(
+                    model=model, messages=messages, temperature=0.4, max_tokens=420,
+                )
+                return resp.choices[0].message.content.strip(), None
+            resp = client.ChatCompletion.create(
+                model=model, messages=messages, temperature=0.4, max_tokens=420,
+            )
+            return resp.choices[0].message["content"].strip(), None
+        except Exception as e:
+            if attempt == 0:
+                time.sleep(RETRY_WAIT_SEC)
+                continue
+            return None, str(e)
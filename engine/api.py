@@ -0,0 +1,421 @@
+# -*- coding: utf-8 -*-
+# 採点 API（JSON over HTTP。Streamlit から独立、標準ライブラリの asyncio のみ）
+# - パートナーの自社フォームから回答を送ってもらい、スコア・タイプ・信号・レポートリンクを JSON で返す
+# - 採点はアプリと同じテーマの render_questions / evaluate（engine.headless 経由）。1件 1ms 程度なのでイベントループ上で実行
+# - AIコメント・PDF は任意（"ai": true / "pdf": true）。受付時にジョブ ID を返し、スレッド/プロセスプールで非同期に作成
+#   結果は GET /v1/jobs/<id>、PDF は GET /v1/reports/<id>.pdf で取得
+#
+# エンドポイント:
+#   GET  /health                 死活確認
+#   GET  /metrics                Prometheus テキスト形式（engine.metrics と同じ内容）
+#   GET  /v1/themes              テーマ一覧
+#   GET  /v1/themes/<key>        設問カタログ（key / label / options / default）
+#   POST /v1/score               {"theme", "answers", "company", "email", "ai": false, "pdf": false}
+#   GET  /v1/jobs/<id>           AIコメント・PDF の進捗
+#   GET  /v1/reports/<id>.pdf    PDF 本体
+#
+# 設定（環境変数）:
+#   API_KEYS          カンマ区切り。設定時は X-API-Key ヘッダ必須
+#   API_CORS_ORIGIN   設定時は Access-Control-Allow-Origin を付け、OPTIONS（プリフライト）に応答
+#   OPENAI_API_KEY    "ai": true のときに使用（未設定なら静的コメント）
+#   API_AI_RPM        AI 呼び出しの上限（回/分、既定 60）
+#   SHARED_CACHE_PATH 設定時は AIコメント・PDF をワーカー間キャッシュにも保存
+#
+# 使い方:
+#   python -m engine.api serve --port 8080 [--pdf-workers 2]
+#   python -m engine.api bench --requests 5000 --concurrency 32     # 同一プロセスでサーバを立てて負荷計測
+#   python -m engine.api bench --url http://127.0.0.1:8080 ...      # 起動済みサーバを計測
+import argparse, asyncio, json, multiprocessing, os, random, sys, time, uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit
+
+from engine import ai, headless, metrics, results_view, session_mem, shared_cache
+from engine.ratelimit import TokenBucket
+
+JST = timezone(timedelta(hours=9))
+MAX_BODY_BYTES = 64 * 1024
+MAX_HEADER_BYTES = 16 * 1024
+KEEPALIVE_SEC = 15
+MAX_JOBS = 2000
+JOB_TTL_SEC = 3600
+PDF_STORE_BYTES = 64 * 1024 * 1024
+
+REASONS = {200: "OK", 202: "Accepted", 204: "No Content", 400: "Bad Request", 401: "Unauthorized",
+           404: "Not Found", 405: "Method Not Allowed", 411: "Length Required", 413: "Payload Too Large",
+           422: "Unprocessable Entity", 500: "Internal Server Error"}
+
+metrics.describe("api_requests_total", "採点 API のリクエスト数（route, code 別）")
+metrics.describe("api_request_seconds", "採点 API の処理時間（ジョブの待ち時間は含まない）")
+metrics.describe("api_jobs_total", "AIコメント・PDF ジョブの結果")
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status, self.message = status, message
+
+# ========= ジョブ（AIコメント・PDF） =========
+def _pdf_init():
+    from engine import report
+    report.setup_japanese_font()
+
+def _pdf_bytes(payload: dict, key: tuple) -> bytes:
+    from engine import report
+    return report.make_pdf_bytes(payload, results_view.frame(key))
+
+def _pdf_mp_context():
+    """PDF ワーカーの起動方法。fork だとイベントループのプロセスから待受・接続中のソケットを引き継ぎ、
+    子が fd を持ち続けるため Connection: close のクライアントが EOF を受け取れない。forkserver（なければ spawn）で起動する"""
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+class Jobs:
+    """ジョブ状態（プロセス内・件数と TTL で上限）と PDF の置き場"""
+    def __init__(self, pdf_workers: int = 1, ai_workers: int = 4, ai_rpm: float = 60):
+        self._jobs: OrderedDict = OrderedDict()
+        self._tasks: set = set()   # 実行中のジョブ（create_task の戻り値は参照を持たないと途中で回収されうる）
+        self._pdf_pool = ProcessPoolExecutor(max_workers=max(1, pdf_workers), initializer=_pdf_init,
+                                             mp_context=_pdf_mp_context())
+        self._ai_pool = ThreadPoolExecutor(max_workers=max(1, ai_workers), thread_name_prefix="api-ai")
+        self._bucket = TokenBucket.per_minute(ai_rpm)
+        cache = shared_cache.get_default()
+        self.pdfs = cache.namespace("api_pdf", ttl=JOB_TTL_SEC) if cache else session_mem.ArtifactCache(PDF_STORE_BYTES)
+
+    def get(self, job_id: str) -> dict | None:
+        return self._jobs.get(job_id)
+
+    def _trim(self):
+        now = time.time()
+        while self._jobs:
+            jid, job = next(iter(self._jobs.items()))
+            if len(self._jobs) <= MAX_JOBS and now - job["created"] < JOB_TTL_SEC:
+                break
+            self._jobs.popitem(last=False)
+
+    def submit(self, res: dict, want_ai: bool, want_pdf: bool) -> dict:
+        self._trim()
+        jid = uuid.uuid4().hex
+        job = {"id": jid, "status": "pending", "created": time.time(), "ai_comment": None,
+               "comment_source": "static", "report_url": None, "error": None}
+        self._jobs[jid] = job
+        task = asyncio.get_running_loop().create_task(self._run(job, res, want_ai, want_pdf))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    def _ai_comment(self, res: dict, api_key: str):
+        prompt = res["module"].build_ai_prompt(res["company"], res["main_type"], res["df"], res["overall_avg"])
+        key = shared_cache.make_key(ai.OPENAI_MODEL, prompt)
+        cache = shared_cache.get_default()
+        if cache:
+            cached = cache.get("ai_comment", key)
+            if cached is not None:
+                return cached.decode("utf-8"), "cache", None
+        self._bucket.acquire()
+        text, err = ai.complete(api_key, prompt)
+        if text and cache:
+            cache.set("ai_comment", key, text.encode("utf-8"), ttl=7 * 24 * 3600)
+        return text, "ai", err
+
+    async def _run(self, job: dict, res: dict, want_ai: bool, want_pdf: bool):
+        loop = asyncio.get_running_loop()
+        job["status"] = "running"
+        comment = res["module"].TYPE_TEXT[res["main_type"]]
+        try:
+            api_key = os.environ.get("OPENAI_API_KEY")
+            if want_ai and api_key:
+                text, source, err = await loop.run_in_executor(self._ai_pool, self._ai_comment, res, api_key)
+                if text:
+                    comment, job["ai_comment"], job["comment_source"] = text, text, source
+                elif err:
+                    job["error"] = f"AIコメント未生成: {err}"
+            if want_pdf:
+                payload = {"company": res["company"], "email": res["email"],
+                           "dt": datetime.now(JST).strftime("%Y-%m-%d %H:%M"), "signal": res["signal"][0],
+                           "main_type": res["main_type"], "comment": comment}
+                pdf = await loop.run_in_executor(self._pdf_pool, _pdf_bytes, payload,
+                                                 results_view.score_key(res["df"]))
+                self.pdfs.put(job["id"], pdf)
+                job["report_url"] = f"/v1/reports/{job['id']}.pdf"
+            job["status"] = "done"
+        except Exception as e:
+            job["status"], job["error"] = "error", str(e)
+        metrics.inc("api_jobs_total", {"status": job["status"]})
+
+    def close(self):
+        self._ai_pool.shutdown(wait=False, cancel_futures=True)
+        self._pdf_pool.shutdown(wait=False, cancel_futures=True)
+
+# ========= ルーティング =========
+def _theme_list() -> list[dict]:
+    out = []
+    for key in headless.theme_keys():
+        c = headless.catalog(key)
+        out.append({"theme": key, "title": c["title"], "questions": len(c["questions"]),
+                    "url": f"/v1/themes/{key}"})
+    return out
+
+def _score(body: dict, jobs: Jobs) -> tuple[int, dict]:
+    theme_key = str(body.get("theme") or "").strip().lower()
+    if theme_key not in headless.theme_keys():
+        raise ApiError(404, f"未対応のテーマです: {theme_key!r}")
+    answers = body.get("answers") or {}
+    if not isinstance(answers, dict):
+        raise ApiError(422, "answers はオブジェクトで指定してください")
+    try:
+        res = headless.run_theme(theme_key, answers, session_mem.clip(body.get("company") or "", session_mem.MAX_FIELD_CHARS),
+                                 session_mem.clip(body.get("email") or "", session_mem.MAX_FIELD_CHARS))
+    except ValueError as e:
+        raise ApiError(422, str(e))
+    df = res["df"]
+    unknown = sorted(set(map(str, answers)) - {k for q in headless.catalog(theme_key)["questions"]
+                                               for k in (q["id"], q["key"], q["label"]) if k})
+    out = {
+        "theme": theme_key,
+        "overall_avg": round(res["overall_avg"], 2),
+        "signal": res["signal"][0],
+        "main_type": res["main_type"],
+        "type_text": res["module"].TYPE_TEXT[res["main_type"]],
+        "categories": [{"category": c, "score": round(float(v), 2)} for c, v in zip(df["カテゴリ"], df["平均スコア"])],
+    }
+    if unknown:
+        out["ignored_answers"] = unknown
+    want_ai, want_pdf = bool(body.get("ai")), bool(body.get("pdf"))
+    if not (want_ai or want_pdf):
+        return 200, out
+    job = jobs.submit(res, want_ai, want_pdf)
+    out["job"] = {"id": job["id"], "status": job["status"], "url": f"/v1/jobs/{job['id']}"}
+    if want_pdf:
+        out["report_url"] = f"/v1/reports/{job['id']}.pdf"
+    return 202, out
+
+def _job_view(job: dict) -> dict:
+    return {k: job[k] for k in ("id", "status", "ai_comment", "comment_source", "report_url", "error")}
+
+def route(method: str, path: str, headers: dict, body: bytes, jobs: Jobs) -> tuple[int, bytes, str, str]:
+    """戻り値: (ステータス, 本文, Content-Type, メトリクス用 route 名)"""
+    if path == "/health":
+        return 200, b'{"ok": true}', "application/json", "health"
+    if path == "/metrics":
+        return 200, metrics.render_text().encode("utf-8"), "text/plain; version=0.0.4", "metrics"
+    keys = [k.strip() for k in os.environ.get("API_KEYS", "").split(",") if k.strip()]
+    if keys and headers.get("x-api-key") not in keys:
+        raise ApiError(401, "X-API-Key が不正です")
+
+    parts = [p for p in path.split("/") if p]
+    if parts[:1] != ["v1"] or len(parts) < 2:
+        raise ApiError(404, "not found")
+    name = parts[1]
+    if name == "score" and len(parts) == 2:
+        if method != "POST":
+            raise ApiError(405, "POST で送信してください")
+        try:
+            payload = json.loads(body.decode("utf-8") or "{}")
+        except (UnicodeDecodeError, ValueError) as e:
+            raise ApiError(400, f"JSON エラー: {e}")
+        if not isinstance(payload, dict):
+            raise ApiError(400, "JSON オブジェクトで送信してください")
+        status, out = _score(payload, jobs)
+        return status, _json(out), "application/json", "score"
+    if method != "GET":
+        raise ApiError(405, "GET で取得してください")
+    if name == "themes" and len(parts) == 2:
+        return 200, _json({"themes": _theme_list()}), "application/json", "themes"
+    if name == "themes" and len(parts) == 3:
+        if parts[2] not in headless.theme_keys():
+            raise ApiError(404, f"未対応のテーマです: {parts[2]!r}")
+        return 200, _json(headless.catalog(parts[2])), "application/json", "theme"
+    if name == "jobs" and len(parts) == 3:
+        job = jobs.get(parts[2])
+        if job is None:
+            raise ApiError(404, "ジョブが見つかりません（期限切れの可能性）")
+        return 200, _json(_job_view(job)), "application/json", "job"
+    if name == "reports" and len(parts) == 3 and parts[2].endswith(".pdf"):
+        pdf = jobs.pdfs.get(parts[2][:-4])
+        if pdf is None:
+            raise ApiError(404, "レポートが見つかりません（作成中または期限切れ）")
+        return 200, pdf, "application/pdf", "report"
+    raise ApiError(404, "not found")
+
+def _json(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+# ========= HTTP/1.1（keep-alive 対応の最小実装） =========
+async def _read_request(reader: asyncio.StreamReader):
+    """(method, path, headers, body) または None（接続終了）"""
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEPALIVE_SEC)
+    except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+        return None
+    except asyncio.LimitOverrunError:
+        raise ApiError(413, "ヘッダが大きすぎます")
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, _version = lines[0].split(" ", 2)
+    except ValueError:
+        raise ApiError(400, "不正なリクエスト行です")
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            k, v = line.split(":", 1)
+            headers[k.strip().lower()] = v.strip()
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        raise ApiError(411, "Content-Length を指定してください")
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        raise ApiError(400, "Content-Length が不正です")
+    if length < 0:
+        raise ApiError(400, "Content-Length が不正です")
+    if length > MAX_BODY_BYTES:
+        raise ApiError(413, f"本文は {MAX_BODY_BYTES} バイトまでです")
+    body = await reader.readexactly(length) if length else b""
+    headers["_version"] = _version
+    return method.upper(), urlsplit(target).path, headers, body
+
+def _response(status: int, body: bytes, ctype: str, keep_alive: bool, extra: dict | None = None) -> bytes:
+    head = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", f"Content-Type: {ctype}",
+            f"Content-Length: {len(body)}", "Connection: " + ("keep-alive" if keep_alive else "close")]
+    head += [f"{k}: {v}" for k, v in (extra or {}).items()]
+    return ("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body
+
+def make_handler(jobs: Jobs):
+    cors = os.environ.get("API_CORS_ORIGIN", "")
+    cors_headers = {"Access-Control-Allow-Origin": cors} if cors else {}
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                t0 = time.perf_counter()
+                keep_alive, rname = False, "invalid"
+                try:
+                    req = await _read_request(reader)
+                    if req is None:
+                        break
+                    method, path, headers, body = req
+                    conn = headers.get("connection", "").lower()
+                    keep_alive = conn != "close" and (headers["_version"] != "HTTP/1.0" or conn == "keep-alive")
+                    if method == "OPTIONS" and cors:
+                        status, out, ctype, rname = 204, b"", "text/plain", "preflight"
+                        extra = {**cors_headers, "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
+                                 "Access-Control-Allow-Headers": "Content-Type, X-API-Key"}
+                    else:
+                        status, out, ctype, rname = route(method, path, headers, body, jobs)
+                        extra = cors_headers
+                except ApiError as e:
+                    status, out, ctype, extra = e.status, _json({"error": e.message}), "application/json", cors_headers
+                except Exception as e:
+                    print("api error:", e)
+                    status, out, ctype, extra = 500, _json({"error": "internal error"}), "application/json", cors_headers
+                writer.write(_response(status, out, ctype, keep_alive, extra))
+                await writer.drain()
+                metrics.inc("api_requests_total", {"route": rname, "code": str(status)})
+                metrics.observe("api_request_seconds", time.perf_counter() - t0, {"route": rname},
+                                buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0))
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+    return handle
+
+async def start(host: str = "127.0.0.1", port: int = 8080, pdf_workers: int = 1,
+                ai_rpm: float = 60) -> tuple[asyncio.AbstractServer, Jobs]:
+    jobs = Jobs(pdf_workers=pdf_workers, ai_rpm=ai_rpm)
+    server = await asyncio.start_server(make_handler(jobs), host, port, limit=MAX_HEADER_BYTES)
+    return server, jobs
+
+# ========= 負荷計測（ローカルクライアント） =========
+async def _client(host: str, port: int, requests: list[bytes], latencies: list[float], errors: list[int]):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for raw in requests:
+            t0 = time.perf_counter()
+            writer.write(raw)
+            await writer.drain()
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = 0
+            for line in head.split(b"\r\n"):
+                if line.lower().startswith(b"content-length:"):
+                    length = int(line.split(b":", 1)[1])
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - t0)
+            if not head.startswith(b"HTTP/1.1 2"):
+                errors.append(int(head[9:12]))
+    finally:
+        writer.close()
+
+def _score_request(host: str, theme_key: str, rng: random.Random) -> bytes:
+    qs = headless.catalog(theme_key)["questions"]
+    body = _json({"theme": theme_key, "company": "負荷テスト株式会社", "email": "bench@example.com",
+                  "answers": {q["id"]: rng.randrange(len(q["options"])) for q in qs}})
+    return (f"POST /v1/score HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n").encode("latin-1") + body
+
+async def bench(url: str | None, total: int, concurrency: int, seed: int = 0, log=print) -> dict:
+    server = jobs = None
+    if url:
+        u = urlsplit(url)
+        host, port = u.hostname, u.port or 80
+    else:
+        server, jobs = await start("127.0.0.1", 0)
+        host, port = server.sockets[0].getsockname()[:2]
+    rng = random.Random(seed)
+    themes = headless.theme_keys()
+    reqs = [_score_request(host, themes[i % len(themes)], rng) for i in range(total)]
+    per = [reqs[i::concurrency] for i in range(concurrency)]
+    latencies, errors = [], []
+    cpu0, t0 = time.process_time(), time.perf_counter()
+    await asyncio.gather(*(_client(host, port, chunk, latencies, errors) for chunk in per if chunk))
+    wall, cpu = time.perf_counter() - t0, time.process_time() - cpu0
+    if server:
+        server.close()
+        await server.wait_closed()
+        jobs.close()
+    lat = sorted(latencies)
+    q = lambda p: round(lat[min(len(lat) - 1, int(p * len(lat)))] * 1000, 2) if lat else None
+    return {"requests": len(lat), "errors": len(errors), "concurrency": concurrency,
+            "wall_sec": round(wall, 2), "rps": round(len(lat) / wall, 1) if wall else None,
+            "process_cpu_sec": round(cpu, 2), "in_process_server": server is not None,
+            "p50_ms": q(0.50), "p95_ms": q(0.95), "p99_ms": q(0.99), "max_ms": q(1.0)}
+
+# ========= CLI =========
+async def _serve(args):
+    server, jobs = await start(args.host, args.port, args.pdf_workers, args.ai_rpm)
+    print(f"scoring API listening on http://{args.host}:{args.port}", flush=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        jobs.close()
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m engine.api", description="採点 API（JSON over HTTP）")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    s = sub.add_parser("serve")
+    s.add_argument("--host", default="127.0.0.1")
+    s.add_argument("--port", type=int, default=8080)
+    s.add_argument("--pdf-workers", type=int, default=1, help="PDF 生成のプロセス数")
+    s.add_argument("--ai-rpm", type=float, default=float(os.environ.get("API_AI_RPM", 60)))
+    b = sub.add_parser("bench")
+    b.add_argument("--url", default=None, help="未指定なら同一プロセスでサーバを起動")
+    b.add_argument("--requests", type=int, default=5000)
+    b.add_argument("--concurrency", type=int, default=32)
+    b.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args(argv)
+
+    shared_cache.configure(os.environ.get("SHARED_CACHE_PATH", ""), os.environ.get("SHARED_CACHE_MAX_MB"))
+    if args.cmd == "serve":
+        try:
+            asyncio.run(_serve(args))
+        except KeyboardInterrupt:
+            pass
+        return 0
+    result = asyncio.run(bench(args.url, args.requests, args.concurrency, args.seed))
+    print(json.dumps(result, ensure_ascii=False))
+    return 0 if not result["errors"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
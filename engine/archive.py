@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+# 回答アーカイブ（列指向 Parquet、theme / report_date でパーティション分割）
+# - 保存行をミラーし、category_scores(JSON) をテーマ別の float 列（score_<カテゴリ>）に展開
+# - 1送信＝1小ファイルで追記 → compact() でパーティションごとに1ファイルへ統合
+#   統合はパーティションごとのロックファイル（.compact.lock）を取れたものだけ（同時に走らせても行が重複しない）
+# - read() は列・条件のプッシュダウンで必要な部分だけ読む
+# - pyarrow は任意依存（未導入なら ImportError。呼び出し側でフォールバック）
+#
+# 使い方（CLI）:
+#   python -m engine.archive compact --dir archive
+#   python -m engine.archive query --dir archive --theme factory --columns timestamp,total_score --since 2026-01-01
+import argparse, json, os, sys, time, uuid
+
+from engine.schema import COMMON_HEADER_ORDER, SCORE_PREFIX, TIMING_COLUMNS
+
+DEFAULT_DIR = "archive"
+PARTITION_KEYS = ("theme", "report_date")
+_FLOAT_COLS = {"total_score"}
+_INT_COLS = {"ai_comment_len", *TIMING_COLUMNS}
+COMPACT_LOCK = ".compact.lock"   # 先頭が "." のファイルは pyarrow の dataset が読まない
+COMPACT_LOCK_STALE_SEC = 600     # これより古いロックは統合の途中で落ちたものとみなす
+
+def _pa():
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+    return pa, ds, pq
+
+def _partition_schema():
+    pa, ds, _ = _pa()
+    return ds.partitioning(pa.schema([(k, pa.string()) for k in PARTITION_KEYS]), flavor="hive")
+
+# ========= 行 → 型付きレコード =========
+def to_record(row: dict) -> dict:
+    rec = {}
+    for k in COMMON_HEADER_ORDER:
+        if k in PARTITION_KEYS or k == "category_scores":
+            continue
+        v = row.get(k, "")
+        if k in _FLOAT_COLS:
+            try:
+                v = float(v)
+            except (TypeError, ValueError):
+                v = None
+        elif k in _INT_COLS:
+            try:
+                v = int(v)
+            except (TypeError, ValueError):
+                v = None
+        else:
+            v = "" if v is None else str(v)
+        rec[k] = v
+    scores = row.get("category_scores") or {}
+    if isinstance(scores, str):
+        try:
+            scores = json.loads(scores)
+        except Exception:
+            scores = {}
+    for cat, val in scores.items():
+        try:
+            rec[SCORE_PREFIX + str(cat)] = float(val)
+        except (TypeError, ValueError):
+            rec[SCORE_PREFIX + str(cat)] = None
+    return rec
+
+def _partition_dir(base_dir: str, theme: str, report_date: str) -> str:
+    return os.path.join(base_dir, f"theme={theme or '-'}", f"report_date={report_date or '-'}")
+
+def _write_table_atomic(table, path: str):
+    _, _, pq = _pa()
+    tmp = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.tmp")
+    pq.write_table(table, tmp, compression="zstd")
+    os.replace(tmp, path)
+
+# ========= 書き込み =========
+def write_rows(rows: list[dict], base_dir: str = DEFAULT_DIR) -> list[str]:
+    """行をパーティションごとに小ファイルとして追記。戻り値: 書いたファイル"""
+    pa, _, _ = _pa()
+    groups: dict = {}
+    for row in rows:
+        key = (str(row.get("theme") or ""), str(row.get("report_date") or "")[:10])
+        groups.setdefault(key, []).append(to_record(row))
+    written = []
+    for (theme, report_date), recs in groups.items():
+        pdir = _partition_dir(base_dir, theme, report_date)
+        os.makedirs(pdir, exist_ok=True)
+        path = os.path.join(pdir, f"part-{time.time_ns()}-{uuid.uuid4().hex[:8]}.parquet")
+        _write_table_atomic(pa.Table.from_pylist(recs), path)
+        written.append(path)
+    return written
+
+def write_row(row: dict, base_dir: str = DEFAULT_DIR) -> str:
+    return write_rows([row], base_dir)[0]
+
+# ========= コンパクション =========
+def _partition_dirs(base_dir: str):
+    if not os.path.isdir(base_dir):
+        return
+    for tdir in sorted(os.listdir(base_dir)):
+        tpath = os.path.join(base_dir, tdir)
+        if not (tdir.startswith("theme=") and os.path.isdir(tpath)):
+            continue
+        for ddir in sorted(os.listdir(tpath)):
+            dpath = os.path.join(tpath, ddir)
+            if ddir.startswith("report_date=") and os.path.isdir(dpath):
+                yield dpath
+
+def _lock_partition(pdir: str) -> str | None:
+    """パーティションの統合ロックを取る（取れたらロックファイルのパス、他が統合中なら None）"""
+    path = os.path.join(pdir, COMPACT_LOCK)
+    for _ in range(2):
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return path
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path) < COMPACT_LOCK_STALE_SEC:
+                    return None
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    return None
+
+def compact(base_dir: str = DEFAULT_DIR, min_files: int = 2) -> dict:
+    """パーティション内の小ファイルを1つに統合。読み込んだファイルだけを削除（統合中の追記は次回に回る）。
+    他のプロセスが統合中のパーティションは飛ばす（skipped）。"""
+    pa, _, pq = _pa()
+    stats = {"partitions": 0, "files_in": 0, "files_out": 0, "skipped": 0}
+    for pdir in _partition_dirs(base_dir):
+        files = sorted(os.path.join(pdir, f) for f in os.listdir(pdir) if f.endswith(".parquet"))
+        if len(files) < min_files:
+            continue
+        lock = _lock_partition(pdir)
+        if lock is None:
+            stats["skipped"] += 1
+            continue
+        try:
+            # ロックを取る前に他の統合が終わっていれば、読み込む対象が変わっている
+            files = sorted(os.path.join(pdir, f) for f in os.listdir(pdir) if f.endswith(".parquet"))
+            if len(files) < min_files:
+                continue
+            tables = [pq.read_table(f) for f in files]
+            merged = pa.concat_tables(tables, promote_options="default")
+            out = os.path.join(pdir, f"compact-{time.time_ns()}-{uuid.uuid4().hex[:8]}.parquet")
+            _write_table_atomic(merged, out)
+            for f in files:
+                os.remove(f)
+        finally:
+            os.remove(lock)
+        stats["partitions"] += 1
+        stats["files_in"] += len(files)
+        stats["files_out"] += 1
+    return stats
+
+# ========= 読み出し（列・条件プッシュダウン） =========
+def read(base_dir: str = DEFAULT_DIR, columns: list[str] | None = None, filters=None,
+         theme: str | None = None, since: str | None = None, until: str | None = None):
+    """pyarrow.Table を返す。
+    filters: pyarrow.compute の Expression、または [("col", "op", value), ...] 形式（AND）
+    theme / since / until: パーティション単位で枝刈り（ファイルを開かない）
+    """
+    pa, ds, pq = _pa()
+    root = os.path.join(base_dir, f"theme={theme}") if theme else base_dir
+    if not os.path.isdir(root):
+        return pa.table({c: [] for c in (columns or [])})
+    if theme:
+        part = ds.partitioning(pa.schema([("report_date", pa.string())]), flavor="hive")
+    else:
+        part = _partition_schema()
+    dataset = ds.dataset(root, format="parquet", partitioning=part)
+
+    # パーティション条件（期間）で先に枝刈り → 残ったファイルのフッタだけ読む
+    part_expr = None
+    if since:
+        part_expr = ds.field("report_date") >= since
+    if until:
+        e = ds.field("report_date") <= until
+        part_expr = e if part_expr is None else part_expr & e
+    frags = list(dataset.get_fragments(filter=part_expr))
+    if not frags:
+        return pa.table({c: [] for c in (columns or [])})
+    # テーマ間・期間中のカテゴリ変更に備えてスキーマを統合
+    schema = pa.unify_schemas([f.physical_schema for f in frags] + [part.schema])
+    dataset = ds.dataset([f.path for f in frags], format="parquet", partitioning=part,
+                         partition_base_dir=root, schema=schema)
+
+    expr = part_expr
+    if filters is not None:
+        e = filters if isinstance(filters, ds.Expression) else pq.filters_to_expression(filters)
+        expr = e if expr is None else expr & e
+    # theme 指定時はパス側で確定しているので、列としては後から付与
+    scan_cols = [c for c in columns if not (theme and c == "theme")] if columns else None
+    table = dataset.to_table(columns=scan_cols, filter=expr)
+    if theme and (columns is None or "theme" in columns):
+        table = table.append_column("theme", pa.array([theme] * table.num_rows, pa.string()))
+        if columns:
+            table = table.select(columns)
+    return table
+
+# ========= CLI =========
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m engine.archive", description="回答アーカイブ（Parquet）の保守・照会")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    c = sub.add_parser("compact", help="小ファイルをパーティション単位で統合")
+    c.add_argument("--dir", default=DEFAULT_DIR)
+    c.add_argument("--min-files", type=int, default=2)
+    q = sub.add_parser("query", help="列・条件を指定して読み出し（CSVで標準出力）")
+    q.add_argument("--dir", default=DEFAULT_DIR)
+    q.add_argument("--theme")
+    q.add_argument("--columns", help="カンマ区切り")
+    q.add_argument("--since")
+    q.add_argument("--until")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "compact":
+        t0 = time.perf_counter()
+        stats = compact(args.dir, min_files=args.min_files)
+        print(json.dumps({**stats, "elapsed_sec": round(time.perf_counter() - t0, 3)}))
+        return 0
+    cols = [c.strip() for c in args.columns.split(",")] if args.columns else None
+    t0 = time.perf_counter()
+    table = read(args.dir, columns=cols, theme=args.theme, since=args.since, until=args.until)
+    table.to_pandas().to_csv(sys.stdout, index=False)
+    print(f"# rows={table.num_rows} elapsed_ms={(time.perf_counter() - t0) * 1000:.1f}", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+# 一括診断（セミナー・パートナー経由の回答をまとめてレポート化する CLI）
+# - 入力: JSONL（1行1件）。テーマの採点ロジック（render_questions / evaluate）を Streamlit なしで実行
+# - AIコメント（任意）: --ai で生成。トークンバケットで毎分の呼び出し数を制限し、共有キャッシュがあれば再利用
+# - PDF: make_pdf_bytes をプロセスプールで並列実行し、<out>/pdf/ に直接書き出す
+# - 結果: <out>/manifest.csv（保存行と同じ COMMON_HEADER_ORDER ＋ id / pdf_file / error）
+#
+# 入力の例:
+#   {"id": "s-001", "theme": "factory", "company": "株式会社サンプル", "email": "a@example.com",
+#    "answers": {"factory_q1": "Yes", "q2": 0}, "utm_source": "seminar", "utm_campaign": "2026-10"}
+#   answers はウィジェット key・設問文・出現順 "q1".. で指定（値は選択肢の文字列か 0 始まりの番号）。未指定は既定値
+#   id が省略・重複した行は行番号で区別する（"line00012"、"s-001_line00012"）
+#
+# 使い方:
+#   python -m engine.batch answers.jsonl --out reports/ --workers 4
+#   python -m engine.batch answers.jsonl --out reports/ --ai --ai-rpm 30     # OPENAI_API_KEY が必要
+import argparse, csv, json, os, re, sys, time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+
+from engine import ai, headless, results_view, shared_cache
+from engine.ratelimit import TokenBucket
+from engine.schema import COMMON_HEADER_ORDER
+
+JST = timezone(timedelta(hours=9))
+APP_VERSION = "engine-batch"
+# status・ai_source は保存行の列をそのまま使う（PDF まで出力できたら ok、採点・PDF 生成に失敗したら error）
+MANIFEST_COLUMNS = ["id"] + COMMON_HEADER_ORDER + ["pdf_file", "error"]
+
+def risk_level_from_total(total: float) -> str:
+    # アプリ本体の to_risk_level と同じ閾値
+    return "高リスク" if total < 2.0 else ("中リスク" if total < 3.5 else "低リスク")
+
+def _safe_name(s: str) -> str:
+    return re.sub(r'[\\/:*?"<>|\s]+', "_", s).strip("_")[:60] or "record"
+
+# ========= 読み込み・採点 =========
+def load_records(fp):
+    """(行番号, dict | None, エラー文言 | None) を返す"""
+    for n, line in enumerate(fp, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            rec = json.loads(line)
+            if not isinstance(rec, dict):
+                raise ValueError("JSON オブジェクトではありません")
+            yield n, rec, None
+        except ValueError as e:
+            yield n, None, f"JSON エラー: {e}"
+
+def score_record(rec: dict, record_id: str) -> dict:
+    theme_key = str(rec.get("theme") or "").strip().lower()
+    if theme_key not in headless.theme_keys():
+        raise ValueError(f"未対応のテーマです: {theme_key!r}")
+    res = headless.run_theme(theme_key, rec.get("answers") or {}, str(rec.get("company") or ""),
+                             str(rec.get("email") or ""))
+    df = res["df"]
+    now = datetime.now(JST)
+    category_scores = {c: float(v) for c, v in zip(df["カテゴリ"], df["平均スコア"])}
+    row = {
+        "timestamp":   now.isoformat(timespec="seconds"),
+        "company":     res["company"],
+        "email":       res["email"],
+        "category_scores": json.dumps(category_scores, ensure_ascii=False),
+        "total_score": f"{res['overall_avg']:.2f}",
+        "type_label":  res["main_type"],
+        "ai_comment":  "",
+        "utm_source":  str(rec.get("utm_source") or ""),
+        "utm_campaign": str(rec.get("utm_campaign") or ""),
+        "pdf_url":     "",
+        "app_version": APP_VERSION,
+        "status":      "ok",
+        "ai_comment_len": "0",
+        "risk_level":  risk_level_from_total(res["overall_avg"]),
+        "entry_check": "OK",
+        "report_date": now.strftime("%Y-%m-%d"),
+        "theme":       theme_key,
+    }
+    return {"id": record_id, "row": row, "res": res, "key": results_view.score_key(df),
+            "dt": now.strftime("%Y-%m-%d %H:%M"), "comment": None, "ai_source": "static",
+            "pdf_file": "", "error": ""}
+
+# ========= AIコメント =========
+def add_ai_comments(items: list[dict], api_key: str, rpm: float, workers: int, log=print):
+    bucket = TokenBucket.per_minute(rpm)
+    cache = shared_cache.get_default()
+
+    def one(item):  # 戻り値: (item, コメント, 取得元, エラー)
+        res = item["res"]
+        prompt = res["module"].build_ai_prompt(res["company"], res["main_type"], res["df"], res["overall_avg"])
+        key = shared_cache.make_key(ai.OPENAI_MODEL, prompt)
+        if cache:
+            cached = cache.get("ai_comment", key)
+            if cached is not None:
+                return item, cached.decode("utf-8"), "cache", None
+        bucket.acquire()
+        text, err = ai.complete(api_key, prompt)
+        if text and cache:
+            cache.set("ai_comment", key, text.encode("utf-8"), ttl=7 * 24 * 3600)
+        return item, text, "ai", err
+
+    done = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+        for fut in as_completed([ex.submit(one, it) for it in items]):
+            item, text, source, err = fut.result()
+            if text:
+                item["comment"], item["ai_source"] = text, source
+                item["row"]["ai_comment"] = text
+                item["row"]["ai_comment_len"] = str(len(text))
+            elif err:
+                item["error"] = f"AIコメント未生成: {err}"
+            done += 1
+            if done % 20 == 0 or done == len(items):
+                log(f"ai {done}/{len(items)}")
+
+# ========= PDF（プロセスプール） =========
+def _pdf_init():
+    from engine import report
+    report.setup_japanese_font()
+
+def _render_pdf(job: dict):
+    from engine import report
+    try:
+        pdf = report.make_pdf_bytes(job["payload"], results_view.frame(job["key"]))
+        tmp = job["path"] + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(pdf)
+        os.replace(tmp, job["path"])
+        return job["index"], None
+    except Exception as e:
+        return job["index"], str(e)
+
+def render_pdfs(items: list[dict], out_dir: str, workers: int, log=print):
+    pdf_dir = os.path.join(out_dir, "pdf")
+    os.makedirs(pdf_dir, exist_ok=True)
+    jobs, rel_paths, used = [], [], set()
+    for i, it in enumerate(items):
+        res = it["res"]
+        base = f"{_safe_name(it['id'])}_{_safe_name(res['company'] or '匿名')}"
+        fname, n = f"{base}.pdf", 1
+        while fname in used:   # 別の id でも _safe_name 後に同じ名前になりうる（上書きしない）
+            n += 1
+            fname = f"{base}_{n}.pdf"
+        used.add(fname)
+        jobs.append({
+            "index": i, "key": it["key"], "path": os.path.join(pdf_dir, fname),
+            "payload": {"company": res["company"], "email": res["email"], "dt": it["dt"],
+                        "signal": res["signal"][0], "main_type": res["main_type"],
+                        "comment": it["comment"] or res["module"].TYPE_TEXT[res["main_type"]]},
+        })
+        rel_paths.append(os.path.join("pdf", fname))
+    done = 0
+    with ProcessPoolExecutor(max_workers=max(1, workers), initializer=_pdf_init) as ex:
+        for fut in as_completed([ex.submit(_render_pdf, j) for j in jobs]):
+            i, err = fut.result()
+            it, rel = items[i], rel_paths[i]
+            if err:
+                it["error"] = "; ".join(filter(None, [it["error"], f"PDF 生成エラー: {err}"]))
+            else:
+                it["pdf_file"] = rel
+            done += 1
+            if done % 20 == 0 or done == len(jobs):
+                log(f"pdf {done}/{len(jobs)}")
+
+# ========= マニフェスト =========
+def write_manifest(path: str, items: list[dict], failed: list[dict]):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=MANIFEST_COLUMNS, extrasaction="ignore")
+        w.writeheader()
+        for it in items:
+            w.writerow({**it["row"], "id": it["id"], "pdf_file": it["pdf_file"], "ai_source": it["ai_source"],
+                        "status": "error" if it["error"] and not it["pdf_file"] else "ok", "error": it["error"]})
+        for f_ in failed:
+            w.writerow({"id": f_["id"], "status": "error", "error": f_["error"]})
+    os.replace(tmp, path)
+
+def run(fp, out_dir: str, workers: int = 0, with_pdf: bool = True, with_ai: bool = False,
+        api_key: str | None = None, ai_rpm: float = 30, ai_workers: int = 4, log=print) -> dict:
+    t0 = time.perf_counter()
+    os.makedirs(out_dir, exist_ok=True)
+    items, failed, seen = [], [], set()
+    for n, rec, err in load_records(fp):
+        rid = str((rec or {}).get("id") or f"line{n:05d}")
+        if rid in seen:   # 重複した id は行番号を付けて区別（PDF・マニフェストの行が上書きされないように）
+            rid = f"{rid}_line{n:05d}"
+        seen.add(rid)
+        if err:
+            failed.append({"id": rid, "error": err})
+            continue
+        try:
+            items.append(score_record(rec, rid))
+        except Exception as e:
+            failed.append({"id": rid, "error": f"採点エラー: {e}"})
+    log(f"scored {len(items)} records ({len(failed)} failed) in {time.perf_counter() - t0:.1f}s")
+
+    if with_ai and items:
+        if api_key:
+            add_ai_comments(items, api_key, ai_rpm, ai_workers, log)
+        else:
+            log("OPENAI_API_KEY が未設定のため、静的コメントを使います")
+    if with_pdf and items:
+        render_pdfs(items, out_dir, workers or (os.cpu_count() or 1), log)
+
+    manifest = os.path.join(out_dir, "manifest.csv")
+    write_manifest(manifest, items, failed)
+    return {"records": len(items) + len(failed), "scored": len(items), "failed": len(failed),
+            "pdfs": sum(1 for it in items if it["pdf_file"]), "manifest": manifest,
+            "elapsed_sec": round(time.perf_counter() - t0, 1)}
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m engine.batch", description="JSONL の回答を一括採点し、PDF とマニフェストを出力")
+    ap.add_argument("input", help="JSONL ファイル（'-' で標準入力）")
+    ap.add_argument("--out", default="batch_out")
+    ap.add_argument("--workers", type=int, default=0, help="PDF 生成のプロセス数（既定: CPU 数）")
+    ap.add_argument("--no-pdf", action="store_true")
+    ap.add_argument("--ai", action="store_true", help="AIコメントを生成（OPENAI_API_KEY）")
+    ap.add_argument("--ai-rpm", type=float, default=30, help="AI 呼び出しの上限（回/分）")
+    ap.add_argument("--ai-workers", type=int, default=4)
+    args = ap.parse_args(argv)
+
+    shared_cache.configure(os.environ.get("SHARED_CACHE_PATH", ""), os.environ.get("SHARED_CACHE_MAX_MB"))
+    log = lambda msg: print(msg, file=sys.stderr, flush=True)
+    if args.input == "-":
+        result = run(sys.stdin, args.out, args.workers, not args.no_pdf, args.ai,
+                     os.environ.get("OPENAI_API_KEY"), args.ai_rpm, args.ai_workers, log)
+    else:
+        with open(args.input, "r", encoding="utf-8") as fp:
+            result = run(fp, args.out, args.workers, not args.no_pdf, args.ai,
+                         os.environ.get("OPENAI_API_KEY"), args.ai_rpm, args.ai_workers, log)
+    print(json.dumps(result, ensure_ascii=False))
+    return 0 if not result["failed"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+# レポート用グラフの描画（スレッドセーフ）
+# - pyplot（グローバルな図マネージャ）と rcParams を使わず、Figure + FigureCanvasAgg の図ローカル状態だけで描く
+# - フォントは FontProperties(fname=...) を各テキストに直接指定（グローバル設定を変更しない）
+# - Streamlit のセッション（スレッド）から同時に呼んでもロック不要
+#
+# 使い方（並行描画のストレスチェック）:
+#   python -m engine.charts stress --threads 16 --charts 400
+import argparse, hashlib, io, json, sys, time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import pandas as pd
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib import font_manager
+
+XLABEL = "平均スコア（0-5）"
+
+@lru_cache(maxsize=4)
+def _font_props(font_path: str):
+    return font_manager.FontProperties(fname=font_path)
+
+def bar_png(df: pd.DataFrame, font_path: str | None = None) -> bytes:
+    """カテゴリ別平均スコアの横棒グラフ（PNG バイト列）。"""
+    fig = Figure(figsize=(5.0, 2.4), dpi=220)
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+    df_sorted = df.sort_values("平均スコア", ascending=True)
+    ax.barh(df_sorted["カテゴリ"], df_sorted["平均スコア"])
+    ax.set_xlim(0, 5)
+    ax.grid(axis="x", linestyle="--", alpha=0.3)
+    if font_path:
+        fp = _font_props(font_path)
+        ax.set_xlabel(XLABEL, fontproperties=fp)
+        for label in ax.get_yticklabels():
+            label.set_fontproperties(fp)
+        for label in ax.get_xticklabels():
+            label.set_fontproperties(fp)
+    else:
+        ax.set_xlabel(XLABEL)
+    buf = io.BytesIO()
+    fig.tight_layout()
+    fig.savefig(buf, format="png")
+    return buf.getvalue()
+
+# ========= ストレスチェック =========
+def _variants(n: int) -> list[pd.DataFrame]:
+    cats = ["在庫・運搬", "人材・技能承継", "原価意識・改善文化", "生産計画・変動対応", "DX・情報共有"]
+    out = []
+    for i in range(n):
+        out.append(pd.DataFrame({"カテゴリ": cats,
+                                 "平均スコア": [((i + k * 7) % 11) / 2.0 for k in range(len(cats))]}))
+    return out
+
+def stress(threads: int = 16, charts: int = 400, variants: int = 8, font_path: str | None = None) -> dict:
+    """同じ入力を直列と並行で描画し、PNG が完全一致するかを確認する。"""
+    dfs = _variants(variants)
+    expected = [hashlib.sha256(bar_png(df, font_path)).hexdigest() for df in dfs]
+
+    def one(i: int):
+        t0 = time.perf_counter()
+        digest = hashlib.sha256(bar_png(dfs[i % variants], font_path)).hexdigest()
+        return i, digest, (time.perf_counter() - t0) * 1000
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as ex:
+        results = list(ex.map(one, range(charts)))
+    wall = time.perf_counter() - t0
+
+    mismatches = [i for i, d, _ in results if d != expected[i % variants]]
+    lat = sorted(ms for _, _, ms in results)
+    return {
+        "threads": threads, "charts": charts, "mismatches": len(mismatches),
+        "wall_sec": round(wall, 2), "charts_per_sec": round(charts / wall, 1),
+        "p50_ms": round(lat[len(lat) // 2], 1), "p95_ms": round(lat[int(len(lat) * 0.95) - 1], 1),
+        "max_ms": round(lat[-1], 1),
+    }
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m engine.charts", description="レポート用グラフ描画")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    s = sub.add_parser("stress", help="並行描画して出力が直列描画と一致するか確認")
+    s.add_argument("--threads", type=int, default=16)
+    s.add_argument("--charts", type=int, default=400)
+    s.add_argument("--variants", type=int, default=8)
+    s.add_argument("--font", help="日本語TTF（省略時は engine.report のフォント探索結果）")
+    args = ap.parse_args(argv)
+
+    font_path = args.font
+    if not font_path:
+        from engine import report
+        font_path = report.setup_japanese_font()
+    stats = stress(args.threads, args.charts, args.variants, font_path)
+    print(json.dumps(stats, ensure_ascii=False))
+    return 1 if stats["mismatches"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
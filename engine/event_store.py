@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+# イベントログの末尾読み出し（管理者ビュー用）
+# - Sheets: メタデータの行数（rowCount）から末尾を探し、必要な範囲（末尾）だけを A{n}:D{m} で取得
+# - CSV   : ファイル末尾からシークしてブロック単位で逆読み
+# - 取得済みの行はプロセス内に保持し、TTL 内は再読込しない。TTL 経過後も差分（追記分）だけ読む
+# - ページング・level 絞り込みは保持済みの行に対して行う（不足分だけ古い側を追加読込）
+import csv, io, os, threading, time
+
+EVENT_HEADER = ["timestamp", "level", "message", "payload"]
+DEFAULT_TTL_SEC = 10.0
+MAX_SCAN_ROWS = 5000  # 絞り込み時に遡る上限（これ以上は読まない）。保持する行もこの件数まで（古い行から捨てる）
+
+class _EventTail:
+    """共通部分：保持行（古い→新しい）と、ページング/絞り込み。"""
+    def __init__(self, ttl_sec: float = DEFAULT_TTL_SEC):
+        self.ttl_sec = ttl_sec
+        self._rows: list[dict] = []
+        self._pos: list[int] = []   # 各行の位置（CSV はバイト位置、シートは行番号）。捨てたあとの読み直し位置になる
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    # サブクラスで実装
+    def _refresh(self): ...
+    def _load_older(self, min_rows: int) -> bool: ...  # 追加できたら True
+    def _set_start(self, pos: int): ...                # 保持行の先頭の位置を進める
+
+    def _maybe_refresh(self, force: bool = False):
+        now = time.monotonic()
+        if force or now - self._checked_at >= self.ttl_sec:
+            self._refresh()
+            self._trim()
+            self._checked_at = now
+
+    def _trim(self):
+        """追記が続いても保持行は MAX_SCAN_ROWS まで（古い行を捨て、先頭の位置を合わせる）"""
+        over = len(self._rows) - MAX_SCAN_ROWS
+        if over > 0:
+            self._set_start(self._pos[over])
+            del self._rows[:over], self._pos[:over]
+
+    def query(self, page: int = 0, page_size: int = 50, level: str | None = None, force: bool = False):
+        """新しい順で page 番目（0始まり）を返す。戻り値: (rows, has_more)"""
+        need = (page + 1) * page_size
+        with self._lock:
+            self._maybe_refresh(force)
+
+            def _matches():
+                if not level:
+                    return self._rows
+                return [r for r in self._rows if str(r.get("level", "")).upper() == level.upper()]
+
+            matched = _matches()
+            while len(matched) < need + 1 and len(self._rows) < MAX_SCAN_ROWS:
+                if not self._load_older(max(page_size, need - len(matched) + 1)):
+                    break
+                matched = _matches()
+
+            newest_first = matched[::-1]
+            start = page * page_size
+            return newest_first[start:start + page_size], len(newest_first) > start + page_size
+
+    def cached_rows(self) -> int:
+        return len(self._rows)
+
+
+class CsvEventTail(_EventTail):
+    BLOCK = 64 * 1024
+
+    def __init__(self, path: str = "events.csv", ttl_sec: float = DEFAULT_TTL_SEC):
+        super().__init__(ttl_sec)
+        self.path = path
+        self._header: list[str] | None = None
+        self._header_len = 0
+        self._start_off = 0   # 保持行の先頭バイト位置
+        self._end_off = 0     # 保持行の末尾バイト位置（= 読了位置）
+        self._ino = None
+
+    def _reset(self):
+        self._rows, self._pos, self._header, self._header_len = [], [], None, 0
+        self._start_off = self._end_off = 0
+        self._ino = None
+
+    def _parse(self, data: bytes, base_off: int) -> tuple[list[dict], list[int]]:
+        """(行, 各行の先頭バイト位置)。クォート内の改行で複数行にまたがる行も1行として数える"""
+        lines = data.splitlines(keepends=True)
+        starts, off = [], base_off
+        for line in lines:
+            starts.append(off)
+            off += len(line)
+        consumed = 0
+
+        def feed():
+            nonlocal consumed
+            for line in lines:
+                consumed += 1
+                yield line.decode("utf-8", errors="replace")
+
+        rows, offs, first = [], [], 0
+        hdr = self._header or EVENT_HEADER
+        for rec in csv.reader(feed()):
+            if rec:
+                rows.append(dict(zip(hdr, (rec + [""] * len(hdr))[:len(hdr)])))
+                offs.append(starts[first])
+            first = consumed
+        return rows, offs
+
+    def _set_start(self, pos: int):
+        self._start_off = pos
+
+    def _read_header(self, f):
+        f.seek(0)
+        first = f.readline()
+        self._header = next(csv.reader(io.StringIO(first.decode("utf-8", errors="replace"))), EVENT_HEADER)
+        self._header_len = len(first)
+
+    def _refresh(self):
+        try:
+            stt = os.stat(self.path)
+        except FileNotFoundError:
+            self._reset()
+            return
+        if self._ino is not None and (stt.st_ino != self._ino or stt.st_size < self._end_off):
+            self._reset()  # ローテーション/切り詰め
+        if stt.st_size == self._end_off and self._ino is not None:
+            return  # 変化なし
+        with open(self.path, "rb") as f:
+            if self._ino is None:
+                self._ino = stt.st_ino
+                self._read_header(f)
+                self._start_off = self._end_off = max(self._header_len, stt.st_size)
+                return
+            # 追記分だけを前方に読む（行の途中で止まらないよう最後の改行まで）
+            f.seek(self._end_off)
+            data = f.read(stt.st_size - self._end_off)
+            cut = data.rfind(b"\n") + 1
+            if cut:
+                rows, offs = self._parse(data[:cut], self._end_off)
+                self._rows.extend(rows)
+                self._pos.extend(offs)
+                self._end_off += cut
+
+    def _load_older(self, min_rows: int) -> bool:
+        if self._header is None:
+            return False
+        header_len = self._header_len
+        if self._start_off <= header_len:
+            return False
+        with open(self.path, "rb") as f:
+            pos, chunk = self._start_off, b""
+            while pos > header_len and chunk.count(b"\n") <= min_rows:
+                step = min(self.BLOCK, pos - header_len)
+                pos -= step
+                f.seek(pos)
+                chunk = f.read(step) + chunk
+            if pos > header_len:
+                # 先頭の不完全な行は次回に回す
+                nl = chunk.find(b"\n") + 1
+                pos, chunk = pos + nl, chunk[nl:]
+        older, offs = self._parse(chunk, pos)
+        if not older:
+            return False
+        self._rows[:0] = older
+        self._pos[:0] = offs
+        self._start_off = pos
+        return True
+
+
+class SheetEventTail(_EventTail):
+    BATCH = 500
+
+    def __init__(self, ws_factory, ttl_sec: float = DEFAULT_TTL_SEC):
+        super().__init__(ttl_sec)
+        self._ws_factory = ws_factory
+        self._ws = None
+        self._header: list[str] | None = None
+        self._first_row = 0   # 保持行の先頭（シート行番号, 1始まり）
+        self._last_row = 0    # 保持行の末尾
+
+    def _worksheet(self):
+        if self._ws is None:
+            self._ws = self._ws_factory()
+        return self._ws
+
+    def _to_dicts(self, values: list[list], first_row: int) -> tuple[list[dict], list[int]]:
+        """(行, 各行のシート行番号)。空行は飛ばす"""
+        hdr = self._header or EVENT_HEADER
+        rows, nums = [], []
+        for i, v in enumerate(values):
+            if any(v):
+                rows.append(dict(zip(hdr, (list(v) + [""] * len(hdr))[:len(hdr)])))
+                nums.append(first_row + i)
+        return rows, nums
+
+    def _set_start(self, pos: int):
+        self._first_row = pos
+
+    def _range(self, a: int, b: int) -> str:
+        last_col = chr(ord("A") + len(self._header or EVENT_HEADER) - 1)
+        return f"A{a}:{last_col}{b}"
+
+    def _refresh(self):
+        ws = self._worksheet()
+        if self._header is None:
+            self._header = ws.row_values(1) or EVENT_HEADER
+            # 初回はシートのメタデータの行数（gridProperties.rowCount。append で伸びた空行を含む）から
+            # BATCH 行ずつ遡って末尾のデータ行を探す（A 列や全行は読まない）。見つけた窓の行はそのまま保持
+            b = int(getattr(ws, "row_count", 0) or 0)
+            while b >= 2:
+                a = max(2, b - self.BATCH + 1)
+                vals = ws.get(self._range(a, b))   # 末尾の空行は返らない
+                if vals:
+                    self._rows, self._pos = self._to_dicts(vals, a)
+                    self._first_row, self._last_row = a, a + len(vals) - 1
+                    return
+                b = a - 1
+            self._first_row, self._last_row = 2, 1
+            return
+        # 追記分だけ読む
+        while True:
+            vals = ws.get(self._range(self._last_row + 1, self._last_row + self.BATCH))
+            new_rows, nums = self._to_dicts(vals, self._last_row + 1)
+            if not new_rows:
+                break
+            self._rows.extend(new_rows)
+            self._pos.extend(nums)
+            self._last_row += len(vals)
+            if len(vals) < self.BATCH:
+                break
+
+    def _load_older(self, min_rows: int) -> bool:
+        if self._header is None or self._first_row <= 2:
+            return False
+        b = self._first_row - 1
+        a = max(2, b - max(min_rows, 1) + 1)
+        older, nums = self._to_dicts(self._worksheet().get(self._range(a, b)), a)
+        self._first_row = a
+        if not older:
+            return False
+        self._rows[:0] = older
+        self._pos[:0] = nums
+        return True
+
+
+# ========= プロセス内レジストリ（Streamlit 再実行をまたいで再利用） =========
+_registry: dict = {}
+_registry_lock = threading.Lock()
+
+def get_tail(key: str, factory):
+    with _registry_lock:
+        tail = _registry.get(key)
+        if tail is None:
+            tail = _registry[key] = factory()
+        return tail
+
+def drop_tail(key: str):
+    with _registry_lock:
+        _registry.pop(key, None)
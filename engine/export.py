@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+# 回答データの一括エクスポート（CRM 連携用 CLI）
+# - responses_{theme} の各ワークシートを固定サイズの範囲（A{n}:Q{m}）で順に読む（シート全体は保持しない）
+# - 行を COMMON_HEADER_ORDER に正規化し、category_scores を score_<カテゴリ> 列へ展開
+# - 出力: CSV / JSONL / Parquet（Parquet は pyarrow が必要）。"-" で標準出力
+# - 差分エクスポート: ワークシートごとの最終行（ハイウォーターマーク）を状態ファイルに保存
+# - 分割されたシート（responses_factory_2026Q4 など、engine/sheet_shards.py）も対象。
+#   予備のスプレッドシート（SHEET_SHARD_SPREADSHEET_IDS）にあるシャードも読む
+# - --fake-dir で CSV ファイル群をワークシートに見立てたローカル環境で実行可能（テスト用）
+#
+# 使い方:
+#   python -m engine.export --format csv --out responses.csv
+#   python -m engine.export --format jsonl --out - --state export_state.json   # 前回以降の追記分だけ
+#   python -m engine.export --fake-dir ./fake_sheets --format parquet --out all.parquet
+import argparse, base64, csv, io, itertools, json, os, sys
+
+from engine.schema import COMMON_HEADER_ORDER, SCORE_PREFIX, TIMING_COLUMNS
+from engine.sheet_shards import split_title
+
+SHEET_PREFIX = "responses_"
+DEFAULT_PAGE_ROWS = 500
+
+def _col_letter(n: int) -> str:
+    s = ""
+    while n:
+        n, r = divmod(n - 1, 26)
+        s = chr(65 + r) + s
+    return s
+
+# ========= バックエンド =========
+class SheetsBackend:
+    """Google Sheets（gspread）。読み取りは engine/sheets_scheduler.py 経由（クォータ待ち・429 の再試行）"""
+    def __init__(self, service_json_str: str, spreadsheet_id: str, extra_ids=()):
+        from engine import sheets_scheduler
+        self._sched = sheets_scheduler.get()
+        self._books = [self._sched.open(service_json_str, sid).result()
+                       for sid in [spreadsheet_id] + [x for x in extra_ids if x and x != spreadsheet_id]]
+        self._sh = self._books[0]
+        self._ws = {}
+
+    def worksheet_titles(self) -> list[str]:
+        titles = []
+        for sh in self._books:
+            for ws in self._sched.run("read", sh.worksheets):
+                if ws.title not in self._ws:
+                    self._ws[ws.title] = ws
+                    titles.append(ws.title)
+        return titles
+
+    def read_rows(self, title: str, first_row: int, last_row: int, n_cols: int) -> list[list[str]]:
+        ws = self._ws.get(title) or self._sched.run("read", lambda: self._sh.worksheet(title))
+        self._ws[title] = ws
+        return self._sched.run("read", lambda: ws.get(f"A{first_row}:{_col_letter(n_cols)}{last_row}"))
+
+    def read_column(self, title: str, col: int, first_row: int, last_row: int) -> list[list[str]]:
+        ws = self._ws.get(title) or self._sched.run("read", lambda: self._sh.worksheet(title))
+        self._ws[title] = ws
+        c = _col_letter(col)
+        return self._sched.run("read", lambda: ws.get(f"{c}{first_row}:{c}{last_row}"))
+
+class FakeSheetsBackend:
+    """ディレクトリ内の <title>.csv をワークシートとして扱うローカル実装（テスト・検証用）。"""
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def worksheet_titles(self) -> list[str]:
+        return sorted(f[:-4] for f in os.listdir(self.directory) if f.endswith(".csv"))
+
+    def read_rows(self, title: str, first_row: int, last_row: int, n_cols: int) -> list[list[str]]:
+        with open(os.path.join(self.directory, f"{title}.csv"), "r", encoding="utf-8", newline="") as f:
+            rows = itertools.islice(csv.reader(f), first_row - 1, last_row)
+            return [r[:n_cols] for r in rows]
+
+    def read_column(self, title: str, col: int, first_row: int, last_row: int) -> list[list[str]]:
+        return [r[col - 1:col] for r in self.read_rows(title, first_row, last_row, col)]
+
+# ========= 行の正規化 =========
+def _scores(raw) -> dict:
+    if isinstance(raw, dict):
+        return raw
+    try:
+        return json.loads(raw) if raw else {}
+    except Exception:
+        return {}
+
+def normalize(header: list[str], values: list[str]) -> dict:
+    src = dict(zip(header, list(values) + [""] * (len(header) - len(values))))
+    return {k: src.get(k, "") for k in COMMON_HEADER_ORDER}
+
+def expand_scores(row: dict) -> dict:
+    out = dict(row)
+    for cat, v in _scores(row.get("category_scores")).items():
+        try:
+            out[SCORE_PREFIX + str(cat)] = float(v)
+        except (TypeError, ValueError):
+            out[SCORE_PREFIX + str(cat)] = None
+    return out
+
+def read_header(backend, title: str) -> list[str]:
+    header_vals = backend.read_rows(title, 1, 1, 60)
+    if not header_vals or not header_vals[0]:
+        return []
+    return [h.strip() for h in header_vals[0]]
+
+def iter_pages(backend, title: str, start_row: int = 2, page_rows: int = DEFAULT_PAGE_ROWS):
+    """(header, 読んだ最終行, [(行番号, row_dict)...]) をページ単位で返す。行番号は1始まり（1行目=ヘッダー）
+    空行は飛ばすが、行番号はシート上の実際の行のまま"""
+    header = read_header(backend, title)
+    if not header:
+        return
+    n_cols = len(header)
+    row_no = max(2, start_row)
+    while True:
+        vals = backend.read_rows(title, row_no, row_no + page_rows - 1, n_cols)
+        if not vals:
+            return
+        yield header, row_no + len(vals) - 1, [(row_no + i, expand_scores(normalize(header, v)))
+                                               for i, v in enumerate(vals) if any(v)]
+        row_no += len(vals)
+        if len(vals) < page_rows:
+            return
+
+def scan_score_columns(backend, title: str, start_row: int = 2, page_rows: int = DEFAULT_PAGE_ROWS) -> set:
+    """未出力部分の category_scores 列だけを全ページ読み、現れるカテゴリ列（score_<カテゴリ>）を集める"""
+    header = read_header(backend, title)
+    if "category_scores" not in header:
+        return set()
+    col = header.index("category_scores") + 1
+    cols, row_no, step = set(), max(2, start_row), page_rows * 10   # 1列だけなので大きめのページで読む
+    while True:
+        vals = backend.read_column(title, col, row_no, row_no + step - 1)
+        for v in vals:
+            if v:
+                cols.update(SCORE_PREFIX + str(c) for c in _scores(v[0]))
+        row_no += len(vals)
+        if len(vals) < step:
+            return cols
+
+# ========= 出力 =========
+class _CsvSink:
+    def __init__(self, fp, columns):
+        self.columns = columns
+        self.w = csv.DictWriter(fp, fieldnames=columns, extrasaction="ignore")
+        self.w.writeheader()
+    def write(self, rows):
+        self.w.writerows(rows)
+    def close(self):
+        pass
+
+class _JsonlSink:
+    def __init__(self, fp, columns):
+        self.fp = fp
+    def write(self, rows):
+        for r in rows:
+            self.fp.write(json.dumps(r, ensure_ascii=False) + "\n")
+    def close(self):
+        pass
+
+class _ParquetSink:
+    def __init__(self, path, columns):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        fields = []
+        for c in columns:
+            if c.startswith(SCORE_PREFIX) or c == "total_score":
+                fields.append((c, pa.float64()))
+            elif c == "ai_comment_len" or c in TIMING_COLUMNS:
+                fields.append((c, pa.int64()))
+            else:
+                fields.append((c, pa.string()))
+        self.schema = pa.schema(fields)
+        self.writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+    def _coerce(self, c, v):
+        t = self.schema.field(c).type
+        if v in ("", None):
+            return None if t != self.pa.string() else ""
+        try:
+            if t == self.pa.float64():
+                return float(v)
+            if t == self.pa.int64():
+                return int(float(v))
+        except (TypeError, ValueError):
+            return None
+        return str(v)
+    def write(self, rows):
+        if rows:
+            cols = {c: [self._coerce(c, r.get(c)) for r in rows] for c in self.schema.names}
+            self.writer.write_table(self.pa.table(cols, schema=self.schema))
+    def close(self):
+        self.writer.close()
+
+# ========= 状態（ハイウォーターマーク） =========
+def load_state(path: str | None) -> dict:
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+def save_state(path: str, state: dict):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+# ========= 本体 =========
+def export(backend, out, fmt: str = "csv", state: dict | None = None,
+           page_rows: int = DEFAULT_PAGE_ROWS, themes: list[str] | None = None) -> dict:
+    """エクスポートを実行し、新しい状態（シートごとの最終行）と件数を返す。"""
+    state = dict(state or {})
+    titles = [t for t in backend.worksheet_titles() if t.startswith(SHEET_PREFIX)]
+    if themes:
+        titles = [t for t in titles if split_title(t)[0][len(SHEET_PREFIX):] in themes]
+
+    # 列の確定：各シートの未出力部分の category_scores 列を先に全部見てカテゴリ列を集める（元の JSON 列も残す）
+    score_cols = set()
+    for t in titles:
+        score_cols |= scan_score_columns(backend, t, state.get(t, 1) + 1, page_rows)
+    known = set(score_cols)
+    columns = COMMON_HEADER_ORDER + ["source_sheet", "source_row"] + sorted(score_cols)
+
+    if fmt == "parquet":
+        sink = _ParquetSink(out, columns)
+    elif fmt == "jsonl":
+        sink = _JsonlSink(out, columns)
+    else:
+        sink = _CsvSink(out, columns)
+
+    counts, deferred = {}, {}
+    try:
+        for t in titles:
+            n = 0
+            for _header, last_row, pairs in iter_pages(backend, t, state.get(t, 1) + 1, page_rows):
+                rows = []
+                for row_no, r in pairs:
+                    if any(k.startswith(SCORE_PREFIX) and k not in known for k in r):
+                        # 走査後に追記された行に新しいカテゴリがある：列が欠けないよう、この行から次回に回す
+                        deferred[t], last_row = row_no, row_no - 1
+                        break
+                    r["source_sheet"], r["source_row"] = t, row_no
+                    rows.append(r)
+                sink.write(rows)
+                n += len(rows)
+                state[t] = last_row   # 空行も含めて読んだ最終行（末尾の空行を毎回読み直さない）
+                if t in deferred:
+                    break
+            counts[t] = n
+    finally:
+        sink.close()
+    return {"state": state, "counts": counts, "columns": columns, "deferred": deferred}
+
+def backend_from_env(fake_dir: str | None = None):
+    if fake_dir:
+        return FakeSheetsBackend(fake_dir)
+    service_json = os.environ.get("GOOGLE_SERVICE_JSON")
+    if not service_json and os.environ.get("GOOGLE_SERVICE_JSON_BASE64"):
+        service_json = base64.b64decode(os.environ["GOOGLE_SERVICE_JSON_BASE64"]).decode("utf-8")
+    sheet_id = os.environ.get("SPREADSHEET_ID")
+    if not (service_json and sheet_id):
+        raise SystemExit("GOOGLE_SERVICE_JSON(_BASE64) と SPREADSHEET_ID を環境変数で指定するか、--fake-dir を使ってください。")
+    extra_ids = [x.strip() for x in os.environ.get("SHEET_SHARD_SPREADSHEET_IDS", "").split(",") if x.strip()]
+    return SheetsBackend(service_json, sheet_id, extra_ids)
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m engine.export", description="responses_* ワークシートの一括エクスポート")
+    ap.add_argument("--format", choices=["csv", "jsonl", "parquet"], default="csv")
+    ap.add_argument("--out", default="-", help="出力先（'-' で標準出力。parquet はファイル必須）")
+    ap.add_argument("--state", help="ハイウォーターマークの保存先（指定時は差分エクスポート）")
+    ap.add_argument("--page-rows", type=int, default=DEFAULT_PAGE_ROWS)
+    ap.add_argument("--theme", action="append", help="対象テーマ（複数指定可）")
+    ap.add_argument("--fake-dir", help="<title>.csv をワークシートとみなすローカルディレクトリ")
+    args = ap.parse_args(argv)
+
+    if args.format == "parquet" and args.out == "-":
+        ap.error("parquet は --out にファイルを指定してください")
+    backend = backend_from_env(args.fake_dir)
+    state = load_state(args.state)
+
+    if args.format == "parquet":
+        result = export(backend, args.out, "parquet", state, args.page_rows, args.theme)
+    elif args.out == "-":
+        out = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8", newline="")
+        result = export(backend, out, args.format, state, args.page_rows, args.theme)
+        out.flush()
+        out.detach()
+    else:
+        with open(args.out, "w", encoding="utf-8", newline="") as out:
+            result = export(backend, out, args.format, state, args.page_rows, args.theme)
+
+    if args.state:
+        save_state(args.state, result["state"])
+    print(json.dumps({"counts": result["counts"], "deferred": result["deferred"]}, ensure_ascii=False), file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
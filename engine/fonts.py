@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+# PDF 埋め込み用の日本語フォントのサブセット化
+# - ベースサブセット：themes/*・streamlit_app.py・engine/report.py に現れる全文字＋ASCII＋かな・全角記号＋JIS第1水準漢字
+#   （会社名の大半はこれで足りる。PDF へは ReportLab が使用グリフだけを埋め込むので、ベースが広くてもサイズは増えない）
+# - 文書ごと：会社名・AIコメントなどベースにない文字だけを追加したサブセットを作る
+# - サブセットは文字集合のハッシュで一意に決まり、ディスク（TTF）と ReportLab 登録の両方でキャッシュ
+#   ベースサブセットは全プロセス共有（SUBSET_CACHE_DIR、消さない）。文書用はプロセスごとのディレクトリ
+#   （SUBSET_CACHE_DIR/p<pid>）に置き、LRU で追い出すときに消す（他のプロセスが使っているファイルは消さない）
+# - 文書用フォントは font_for_text で取得し、PDF を作り終えたら release する（その間は追い出さない）
+# - サブセット化（fontTools）と TTF の読み込みはロックの外で行い、ロックは ReportLab への登録だけに使う
+# - 追い出しは ReportLab の内部の表（pdfmetrics._fonts など）を直接消す。バージョンアップでそれらが無くなっていたら
+#   追い出しをやめ、上限に達した以降はベースサブセットで描く（登録が増え続けないように）
+# - fontTools が無い・失敗した場合は None を返し、呼び出し側は元のフル TTF を使う
+import atexit, glob, hashlib, os, shutil, tempfile, threading
+from collections import OrderedDict
+from functools import lru_cache
+
+from reportlab.lib import fonts as rl_fonts
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfbase.pdfmetrics import registerFontFamily
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATIC_SOURCES = ("themes/*.py", "streamlit_app.py", "engine/report.py")
+SUBSET_CACHE_DIR = os.path.join(tempfile.gettempdir(), "vc_font_subsets")
+MAX_DYNAMIC_FONTS = 64   # ReportLab に登録したままにする文書用サブセットの上限（LRU）
+
+def _jis_level1() -> list[str]:
+    # JIS X 0208 第1水準（16〜47区）
+    out = []
+    for row in range(16, 48):
+        for cell in range(1, 95):
+            ch = bytes([0xA0 + row, 0xA0 + cell]).decode("euc_jp", errors="ignore")
+            if ch:
+                out.append(ch)
+    return out
+
+# ASCII・全角記号・ひらがな・カタカナ・第1水準漢字
+_ALWAYS = (
+    [chr(c) for c in range(0x20, 0x7F)]
+    + [chr(c) for c in range(0x3000, 0x3040)]
+    + [chr(c) for c in range(0x3041, 0x3097)]
+    + [chr(c) for c in range(0x30A1, 0x3100)]
+    + [chr(c) for c in range(0xFF01, 0xFF5F)]
+    + _jis_level1()
+)
+
+_lock = threading.Lock()
+_dynamic: OrderedDict = OrderedDict()   # 登録済みフォント名 -> サブセットのパス（LRU）
+_refs: dict = {}                        # フォント名 -> 使用中の PDF 生成数（0 になるまで追い出さない）
+
+# 追い出しで触る ReportLab の内部（5.0 で確認）。どれか欠けていれば追い出さない
+_CAN_UNREGISTER = all(hasattr(m, a) for m, a in (
+    (pdfmetrics, "_fonts"), (pdfmetrics, "_dynFaceNames"), (rl_fonts, "_tt2ps_map"), (rl_fonts, "_ps2tt_map")))
+if not _CAN_UNREGISTER:
+    print("font eviction disabled: unsupported ReportLab internals")
+
+@lru_cache(maxsize=1)
+def static_charset() -> frozenset:
+    chars = set(_ALWAYS)
+    for pattern in STATIC_SOURCES:
+        for path in glob.glob(os.path.join(_ROOT, pattern)):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    chars.update(ch for ch in f.read() if ord(ch) > 0x7F)
+            except OSError:
+                continue
+    return frozenset(ch for ch in chars if ch.isprintable())
+
+def _digest(font_path: str, chars) -> str:
+    h = hashlib.sha1()
+    st = os.stat(font_path)
+    h.update(f"{os.path.abspath(font_path)}|{st.st_size}|{st.st_mtime_ns}|".encode("utf-8"))
+    h.update("".join(sorted(chars)).encode("utf-8"))
+    return h.hexdigest()[:16]
+
+def dynamic_dir() -> str:
+    """このプロセスの文書用サブセットの置き場"""
+    return os.path.join(SUBSET_CACHE_DIR, f"p{os.getpid()}")
+
+def _remove_stale_dirs():
+    # 終了したプロセスの文書用サブセットを片付ける（生存確認は POSIX のみ）
+    if os.name != "posix":
+        return
+    for d in glob.glob(os.path.join(SUBSET_CACHE_DIR, "p*")):
+        try:
+            pid = int(os.path.basename(d)[1:])
+            os.kill(pid, 0)
+        except ValueError:
+            continue
+        except ProcessLookupError:
+            shutil.rmtree(d, ignore_errors=True)
+        except OSError:
+            continue
+
+def _cleanup():
+    shutil.rmtree(dynamic_dir(), ignore_errors=True)
+
+atexit.register(_cleanup)
+
+def subset_path(font_path: str, chars, cache_dir: str = SUBSET_CACHE_DIR) -> str | None:
+    """文字集合に対応するサブセット TTF のパス（無ければ作成）。失敗時は None。"""
+    out = os.path.join(cache_dir, f"{_digest(font_path, chars)}.ttf")
+    if os.path.exists(out):
+        return out
+    try:
+        from fontTools import subset
+    except ImportError:
+        return None
+    try:
+        if cache_dir != SUBSET_CACHE_DIR and not os.path.isdir(cache_dir):
+            _remove_stale_dirs()
+        os.makedirs(cache_dir, exist_ok=True)
+        opts = subset.Options()
+        opts.layout_features = []      # PDF 描画には GSUB/GPOS 不要
+        opts.hinting = False
+        opts.notdef_outline = True
+        opts.name_IDs = ["*"]
+        font = subset.load_font(font_path, opts)
+        sub = subset.Subsetter(opts)
+        sub.populate(unicodes=[ord(c) for c in chars])
+        sub.subset(font)
+        # ReportLab は PostScript 名が同じ TTF を同一書体として使い回すため、サブセットごとに一意にする
+        ps_name = f"VCJP-{os.path.basename(out)[:-4]}"
+        for rec in font["name"].names:
+            if rec.nameID in (4, 6):
+                rec.string = ps_name
+        tmp = f"{out}.{os.getpid()}.{threading.get_ident()}.tmp"
+        subset.save_font(font, tmp, opts)
+        font.close()
+        os.replace(tmp, out)
+        return out
+    except Exception as e:
+        print("font subset error:", e)
+        return None
+
+def _register(name: str, font):
+    pdfmetrics.registerFont(font)
+    registerFontFamily(name, normal=name, bold=name, italic=name, boldItalic=name)
+
+def _unregister(name: str, path: str):
+    # ReportLab 側の登録（フォント・書体・ファミリーの対応表）と、このプロセスが作ったサブセットを片付ける
+    try:
+        font = pdfmetrics._fonts.pop(name, None)
+        if font is not None:
+            pdfmetrics._dynFaceNames.pop(font.face.name, None)
+        for bold in (0, 1):
+            for italic in (0, 1):
+                rl_fonts._tt2ps_map.pop((name.lower(), bold, italic), None)
+        rl_fonts._ps2tt_map.pop(name.lower(), None)
+    except Exception as e:
+        print("font unregister error:", e)
+    if os.path.dirname(path) != dynamic_dir():   # fork 前の親プロセスのファイルなどは消さない
+        return
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def base_subset_path(font_path: str) -> str | None:
+    return subset_path(font_path, static_charset())
+
+def font_for_text(font_path: str, base_name: str, *texts) -> str:
+    """texts を描画できる ReportLab フォント名を返す（使い終わったら release(名前)）。
+    ベースに含まれる文字だけなら base_name（ベースサブセット）、足りなければ文書用サブセットを登録して返す。
+    サブセットが作れない・登録に失敗したときは base_name（足りない文字は豆腐になるが PDF は作れる）。"""
+    base = static_charset()
+    extra = {ch for t in texts if t for ch in str(t) if ch not in base and ch.isprintable()}
+    if not extra:
+        return base_name
+    name = f"{base_name}_{hashlib.sha1(''.join(sorted(extra)).encode('utf-8')).hexdigest()[:12]}"
+    with _lock:
+        if _acquire(name):
+            return name
+        if not _CAN_UNREGISTER and len(_dynamic) >= MAX_DYNAMIC_FONTS:
+            return base_name
+    # サブセット化と読み込みは重いのでロックの外で（同じ文字集合なら同じファイルになる）
+    path = subset_path(font_path, base | extra, dynamic_dir())
+    if not path:
+        return base_name
+    try:
+        font = TTFont(name, path)
+    except Exception as e:
+        print("font register error:", e)
+        return base_name
+    with _lock:
+        if _acquire(name):   # 待っている間に別のスレッドが登録した
+            return name
+        try:
+            _register(name, font)
+        except Exception as e:
+            print("font register error:", e)
+            return base_name
+        _dynamic[name] = path
+        _refs[name] = 1
+        _evict()
+    return name
+
+def _acquire(name: str) -> bool:
+    """登録済みなら使用中として数えて True。_lock の中で呼ぶ"""
+    if name not in _dynamic:
+        return False
+    _dynamic.move_to_end(name)
+    _refs[name] = _refs.get(name, 0) + 1
+    return True
+
+def _evict():
+    """上限を超えた分を古い順に追い出す（使用中のものは飛ばす）。_lock の中で呼ぶ"""
+    if not _CAN_UNREGISTER:
+        return
+    over = len(_dynamic) - MAX_DYNAMIC_FONTS
+    for old in [n for n in _dynamic if not _refs.get(n)][:max(0, over)]:
+        _unregister(old, _dynamic.pop(old))
+
+def release(name: str):
+    """font_for_text で受け取ったフォントを使い終えた（base_name なら何もしない）"""
+    with _lock:
+        n = _refs.get(name)
+        if n is None:
+            return
+        if n <= 1:
+            del _refs[name]
+            _evict()
+        else:
+            _refs[name] = n - 1
+
+def cached_fonts() -> int:
+    return len(_dynamic)
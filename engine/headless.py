@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# Streamlit なしでテーマの採点ロジックを実行する
+# - テーマの render_questions(st) に Streamlit 代替（ScriptedUI）を渡し、回答を外から与える
+# - 回答の指定: ウィジェット key（例 "factory_q1"）・設問文・出現順 "q1".. のいずれか
+#   値は選択肢の文字列または 0 始まりの番号。未指定の設問は既定値（rng 指定時はランダム）
+# - ソークテスト・バッチ診断・採点 API など、UI を通さない処理から共通利用
+import importlib, importlib.util
+from functools import lru_cache
+
+from engine.portal import DIAG_MENU
+
+class ScriptedUI:
+    """render_questions(st) が使う範囲（radio / text_input / 表示系）だけを持つ Streamlit 代替。"""
+    def __init__(self, answers: dict | None = None, company: str = "", email: str = "", rng=None):
+        self.answers = answers or {}
+        self.rng = rng
+        self.session_state = {"company": company, "email": email}
+        self.asked: list[str] = []
+        self.questions: list[dict] = []   # 設問カタログ用（key / label / options / default）
+        self._n_radio = 0
+
+    def radio(self, label, options, index=0, key=None, **kwargs):
+        self._n_radio += 1
+        options = list(options)
+        qid = key or f"q{self._n_radio}"
+        self.asked.append(qid)
+        self.questions.append({"id": f"q{self._n_radio}", "key": key, "label": label,
+                               "options": options, "default": index or 0})
+        for k in (key, label, f"q{self._n_radio}"):
+            if k and k in self.answers:
+                v = self.answers[k]
+                if isinstance(v, int) and 0 <= v < len(options):
+                    return options[v]
+                if str(v) in options:
+                    return str(v)
+                raise ValueError(f"{qid}: 選択肢にない回答です: {v!r}")
+        if self.rng is not None:
+            return self.rng.choice(options)
+        return options[index or 0]
+
+    def text_input(self, label, value="", **kwargs):
+        return value
+
+    def _noop(self, *args, **kwargs):
+        return None
+
+    subheader = markdown = caption = write = _noop
+
+def theme_keys() -> list[str]:
+    """実装済み（themes/<key>.py がある）テーマのキー"""
+    return [m["key"] for m in DIAG_MENU if importlib.util.find_spec(f"themes.{m['key']}") is not None]
+
+def run_theme(theme_key: str, answers: dict | None = None, company: str = "", email: str = "", rng=None) -> dict:
+    """採点とタイプ判定まで（AIコメント・PDF・保存はしない）。"""
+    mod = importlib.import_module(f"themes.{theme_key}")
+    ui = ScriptedUI(answers, company, email, rng)
+    company, email, df = mod.render_questions(ui)
+    overall_avg, signal, main_type = mod.evaluate(df)
+    return {
+        "theme": theme_key, "module": mod, "company": company, "email": email,
+        "df": df, "overall_avg": float(overall_avg), "signal": signal, "main_type": main_type,
+        "asked": ui.asked,
+    }
+
+@lru_cache(maxsize=None)
+def catalog(theme_key: str) -> dict:
+    """テーマの設問一覧（既定値で1回 render_questions を通して記録）。呼び出し側で変更しないこと。"""
+    mod = importlib.import_module(f"themes.{theme_key}")
+    ui = ScriptedUI()
+    mod.render_questions(ui)
+    return {"theme": theme_key, "title": mod.THEME_META["title"], "lead": mod.THEME_META["lead"],
+            "types": list(mod.TYPE_TEXT), "questions": ui.questions}
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+# 外部 HTTP 接続のプロセス共有（OpenAI / Google Sheets / ロゴ等のアセット取得）
+# - requests 系は HTTPAdapter（keep-alive、ホストごとの接続数上限、接続エラーのみ再試行）を共有
+# - Sheets は サービスアカウント JSON ごとに認証済みクライアントを使い回す（トークンも期限まで再利用）
+#   スプレッドシートのハンドルも SHEET_HANDLE_TTL_SEC だけ再利用（open_by_key の往復を省く）
+# - OpenAI は API キーごとにクライアントを1つだけ作る（内部の httpx 接続プールを再利用）
+# - 既定のタイムアウト: 接続 CONNECT_TIMEOUT_SEC / 読み取り READ_TIMEOUT_SEC（呼び出し側の指定が優先）
+# - 統計: ホストごとの要求数・エラー数・平均/最大時間・新規接続数（= 再利用されなかった分）
+import hashlib, json, threading, time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from engine import metrics
+
+CONNECT_TIMEOUT_SEC = 5
+READ_TIMEOUT_SEC = 30
+POOL_HOSTS = 8              # 保持するホスト別プール数
+POOL_MAXSIZE_PER_HOST = 8   # ホストごとの同時接続数の上限（超えたら空くまで待つ）
+OPENAI_MAX_CONNECTIONS = 8
+SHEET_HANDLE_TTL_SEC = 600
+SHEETS_SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+
+metrics.describe("http_client_requests_total", "外部 HTTP 呼び出し数（host, outcome 別）")
+metrics.describe("http_client_seconds", "外部 HTTP 呼び出しの所要時間")
+
+# ========= 統計 =========
+_stats_lock = threading.Lock()
+_stats: dict = {}          # host -> {"requests", "errors", "ms_total", "max_ms"}
+_adapters: list = []       # 新規接続数の集計対象（requests 系）
+_httpx_clients: list = []  # 同（OpenAI）
+
+def record(host: str, elapsed_sec: float, ok: bool):
+    ms = elapsed_sec * 1000.0
+    with _stats_lock:
+        s = _stats.setdefault(host, {"requests": 0, "errors": 0, "ms_total": 0.0, "max_ms": 0.0})
+        s["requests"] += 1
+        s["errors"] += 0 if ok else 1
+        s["ms_total"] += ms
+        s["max_ms"] = max(s["max_ms"], ms)
+    metrics.inc("http_client_requests_total", {"host": host, "outcome": "ok" if ok else "error"})
+    metrics.observe("http_client_seconds", elapsed_sec, {"host": host})
+
+def _new_connections() -> dict:
+    """host -> 作成した接続数（urllib3 / httpx のプールから集計）"""
+    out: dict = {}
+    for adapter in list(_adapters):
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                out[pool.host] = out.get(pool.host, 0) + pool.num_connections
+    for client, host in list(_httpx_clients):
+        try:
+            # httpx の公開 API には作成数がないため、現在プールにある接続数で代用
+            out[host] = out.get(host, 0) + len(client._transport._pool.connections)
+        except Exception:
+            pass
+    return out
+
+def pool_stats() -> list[dict]:
+    conns = _new_connections()
+    with _stats_lock:
+        snap = {h: dict(s) for h, s in _stats.items()}
+    rows = []
+    for host in sorted(set(snap) | set(conns)):
+        s = snap.get(host, {"requests": 0, "errors": 0, "ms_total": 0.0, "max_ms": 0.0})
+        n, c = s["requests"], conns.get(host, 0)
+        n_ok = n - s["errors"]
+        rows.append({"host": host, "requests": n, "errors": s["errors"],
+                     "avg_ms": round(s["ms_total"] / n, 1) if n else None, "max_ms": round(s["max_ms"], 1),
+                     "connections": c, "reuse_rate": round(1 - min(c, n_ok) / n_ok, 3) if n_ok else None})
+    return rows
+
+# ========= requests 系（Sheets・アセット） =========
+def _adapter() -> HTTPAdapter:
+    retry = Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.3)
+    a = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_MAXSIZE_PER_HOST, pool_block=True, max_retries=retry)
+    _adapters.append(a)
+    return a
+
+class _Instrumented:
+    """requests.Session 系に既定タイムアウトと統計を足す"""
+    def request(self, method, url, *args, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = (CONNECT_TIMEOUT_SEC, READ_TIMEOUT_SEC)
+        host = urlsplit(url).hostname or "-"
+        t0 = time.perf_counter()
+        try:
+            resp = super().request(method, url, *args, **kwargs)
+        except Exception:
+            record(host, time.perf_counter() - t0, False)
+            raise
+        record(host, time.perf_counter() - t0, resp.status_code < 500)
+        return resp
+
+class PooledSession(_Instrumented, requests.Session):
+    pass
+
+def _mount(session: requests.Session) -> requests.Session:
+    a = _adapter()
+    session.mount("https://", a)
+    session.mount("http://", a)
+    return session
+
+_session: PooledSession | None = None
+_lock = threading.Lock()
+
+def session() -> requests.Session:
+    """認証不要の取得（ロゴ等）に使う共有セッション"""
+    global _session
+    with _lock:
+        if _session is None:
+            _session = _mount(PooledSession())
+        return _session
+
+def get(url: str, **kwargs) -> requests.Response:
+    return session().get(url, **kwargs)
+
+# ========= Google Sheets =========
+_sheets_clients: dict = {}   # sha1(service json) -> gspread.Client
+_sheet_handles: dict = {}    # (client key, spreadsheet id) -> (Spreadsheet, 取得時刻)
+
+def _json_key(service_json_str: str) -> str:
+    return hashlib.sha1(service_json_str.encode("utf-8")).hexdigest()
+
+def sheets_client(service_json_str: str):
+    key = _json_key(service_json_str)
+    with _lock:
+        gc = _sheets_clients.get(key)
+        if gc is None:
+            import gspread
+            from google.auth.transport.requests import AuthorizedSession
+            from google.oauth2.service_account import Credentials
+
+            class PooledAuthorizedSession(_Instrumented, AuthorizedSession):
+                pass
+
+            creds = Credentials.from_service_account_info(json.loads(service_json_str), scopes=SHEETS_SCOPES)
+            gc = gspread.authorize(creds, session=_mount(PooledAuthorizedSession(creds)))
+            if hasattr(gc, "set_timeout"):
+                gc.set_timeout((CONNECT_TIMEOUT_SEC, READ_TIMEOUT_SEC))
+            _sheets_clients[key] = gc
+        return gc
+
+def open_spreadsheet(service_json_str: str, spreadsheet_id: str):
+    key = (_json_key(service_json_str), spreadsheet_id)
+    now = time.time()
+    with _lock:
+        hit = _sheet_handles.get(key)
+    if hit and now - hit[1] < SHEET_HANDLE_TTL_SEC:
+        return hit[0]
+    sh = sheets_client(service_json_str).open_by_key(spreadsheet_id)
+    with _lock:
+        _sheet_handles[key] = (sh, now)
+    return sh
+
+def forget_spreadsheet(service_json_str: str, spreadsheet_id: str):
+    """権限変更・削除などでハンドルが使えなくなったときに呼ぶ"""
+    with _lock:
+        _sheet_handles.pop((_json_key(service_json_str), spreadsheet_id), None)
+
+# ========= OpenAI =========
+_openai_clients: dict = {}
+
+def _httpx_event_hooks(host: str) -> dict:
+    def on_request(request):
+        request.extensions["vc_t0"] = time.perf_counter()
+
+    def on_response(response):
+        t0 = response.request.extensions.get("vc_t0")
+        if t0 is not None:
+            record(host, time.perf_counter() - t0, response.status_code < 500)
+    return {"request": [on_request], "response": [on_response]}
+
+def openai_client(api_key: str):
+    """openai>=1.0 のクライアント（API キーごとに1つ）。旧 API しかない環境では ImportError"""
+    from openai import OpenAI
+    key = hashlib.sha1(api_key.encode("utf-8")).hexdigest()
+    with _lock:
+        client = _openai_clients.get(key)
+        if client is not None:
+            return client
+        http_client = None
+        try:
+            from openai import DefaultHttpxClient
+            httpx_mod = __import__(DefaultHttpxClient.__mro__[1].__module__.split(".")[0])
+            http_client = DefaultHttpxClient(
+                limits=httpx_mod.Limits(max_connections=OPENAI_MAX_CONNECTIONS,
+                                        max_keepalive_connections=OPENAI_MAX_CONNECTIONS),
+                timeout=httpx_mod.Timeout(READ_TIMEOUT_SEC * 2, connect=CONNECT_TIMEOUT_SEC),
+                event_hooks=_httpx_event_hooks("api.openai.com"),
+            )
+            _httpx_clients.append((http_client, "api.openai.com"))
+        except Exception as e:
+            print("openai http client setup error:", e)
+        client = OpenAI(api_key=api_key, http_client=http_client) if http_client else OpenAI(api_key=api_key)
+        _openai_clients[key] = client
+        return client
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+# 待ち時間レポート（保存行の ttr_ms / ready_ms / ai_ms / pdf_ms / save_ms から p50・p95 を集計）
+# - あわせて AIコメントの取得元の割合と、待ち時間の予算超過で縮退した行の割合（degraded 列、engine/slo.py）
+# - 集計の単位: theme / report_date（日）/ utm_source の任意の組み合わせ
+# - 入力: Sheets（分割シートを含む responses_*）/ CSV（responses.csv）/ アーカイブ（Parquet）/ --fake-dir
+# - 列がない古い行・未計測の値は、その指標の件数に含めない
+#
+# 使い方:
+#   python -m engine.latency_report --by theme,report_date --since 2026-10-01         # Sheets（環境変数）
+#   python -m engine.latency_report --csv responses.csv --by utm_source --format csv
+#   python -m engine.latency_report --archive archive --by theme
+import argparse, csv, io, json, math, sys
+from collections import Counter
+
+from engine.schema import TIMING_COLUMNS
+
+GROUP_KEYS = ("theme", "report_date", "utm_source")
+PERCENTILES = (50, 95)
+
+def _percentile(sorted_vals: list, p: float) -> float:
+    # nearest-rank（engine/perf.py と同じ）
+    if not sorted_vals:
+        return 0.0
+    idx = max(0, min(len(sorted_vals) - 1, math.ceil(p / 100.0 * len(sorted_vals)) - 1))
+    return sorted_vals[idx]
+
+def _ms(v) -> float | None:
+    if v in ("", None):
+        return None
+    try:
+        f = float(v)
+    except (TypeError, ValueError):
+        return None
+    return f if f >= 0 and not math.isnan(f) else None
+
+def summarize(rows, by=("theme",), since: str | None = None, until: str | None = None) -> list[dict]:
+    """グループごとの件数・各指標の p50/p95・AIコメントの取得元の割合・縮退した割合"""
+    by = tuple(by)
+    groups: dict = {}
+    for r in rows:
+        day = str(r.get("report_date") or "")[:10]
+        if (since and day < since) or (until and day > until):
+            continue
+        key = tuple(str(r.get(k) or ("(none)" if k == "utm_source" else "")) for k in by)
+        g = groups.setdefault(key, {"count": 0, "vals": {m: [] for m in TIMING_COLUMNS}, "source": Counter(),
+                                    "degraded": [0, 0]})   # degraded: [縮退した行, 列がある行]
+        g["count"] += 1
+        for m in TIMING_COLUMNS:
+            v = _ms(r.get(m))
+            if v is not None:
+                g["vals"][m].append(v)
+        if r.get("ai_source"):
+            g["source"][r["ai_source"]] += 1
+            if "degraded" in r:   # 列がある行だけ（縮退の記録より前の行は数えない）
+                g["degraded"][0] += 1 if r["degraded"] else 0
+                g["degraded"][1] += 1
+    out = []
+    for key, g in sorted(groups.items()):
+        row = dict(zip(by, key))
+        row["count"] = g["count"]
+        for m in TIMING_COLUMNS:
+            vals = sorted(g["vals"][m])
+            for p in PERCENTILES:
+                row[f"{m}_p{p}"] = round(_percentile(vals, p)) if vals else None
+        n_src = sum(g["source"].values())
+        for src in ("cache", "static", "timeout", "shed"):
+            row[f"ai_{src}_rate"] = round(g["source"][src] / n_src, 3) if n_src else None
+        n_deg, n_rows = g["degraded"]
+        row["degraded_rate"] = round(n_deg / n_rows, 3) if n_rows else None
+        out.append(row)
+    return out
+
+def columns(by) -> list[str]:
+    return (list(by) + ["count"] + [f"{m}_p{p}" for m in TIMING_COLUMNS for p in PERCENTILES]
+            + ["ai_cache_rate", "ai_static_rate", "ai_timeout_rate", "ai_shed_rate", "degraded_rate"])
+
+# ========= 入力 =========
+def rows_from_backend(backend, since: str | None = None):
+    """export のバックエンド（Sheets / fake-dir）から responses_* の全行。since より前の四半期のシャードは読まない"""
+    from datetime import date
+    from engine import export
+    from engine.sheet_shards import period_of, split_title
+    min_period = period_of(date.fromisoformat(since)) if since else None
+    for title in backend.worksheet_titles():
+        if not title.startswith(export.SHEET_PREFIX):
+            continue
+        period = split_title(title)[1]
+        if min_period and period and period < min_period:
+            continue
+        for _header, _last, pairs in export.iter_pages(backend, title):
+            yield from (r for _n, r in pairs)
+
+def rows_from_csv(path: str):
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        yield from csv.DictReader(f)
+
+def rows_from_archive(base_dir: str, since: str | None = None, until: str | None = None):
+    from engine import archive
+    cols = ["theme", "report_date", "utm_source", "ai_source", "degraded"] + TIMING_COLUMNS
+    table = archive.read(base_dir, since=since, until=until)
+    present = [c for c in cols if c in table.column_names]
+    yield from table.select(present).to_pylist()
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m engine.latency_report", description="保存データから待ち時間の p50/p95 を集計")
+    ap.add_argument("--by", default="theme", help=f"集計単位（カンマ区切り: {', '.join(GROUP_KEYS)}）")
+    ap.add_argument("--since", help="YYYY-MM-DD（report_date）")
+    ap.add_argument("--until", help="YYYY-MM-DD（report_date）")
+    ap.add_argument("--csv", help="responses.csv を読む")
+    ap.add_argument("--archive", help="Parquet アーカイブのディレクトリを読む")
+    ap.add_argument("--fake-dir", help="<title>.csv をワークシートとみなすローカルディレクトリ")
+    ap.add_argument("--format", choices=["table", "csv", "json"], default="table")
+    args = ap.parse_args(argv)
+
+    by = [b.strip() for b in args.by.split(",") if b.strip()]
+    bad = [b for b in by if b not in GROUP_KEYS]
+    if bad:
+        ap.error(f"--by に使えない列です: {', '.join(bad)}")
+    if args.csv:
+        rows = rows_from_csv(args.csv)
+    elif args.archive:
+        rows = rows_from_archive(args.archive, args.since, args.until)
+    else:
+        from engine import export
+        rows = rows_from_backend(export.backend_from_env(args.fake_dir), args.since)
+    result = summarize(rows, by, args.since, args.until)
+
+    cols = columns(by)
+    if args.format == "json":
+        print(json.dumps(result, ensure_ascii=False))
+    elif args.format == "csv":
+        out = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8", newline="")
+        w = csv.DictWriter(out, fieldnames=cols)
+        w.writeheader()
+        w.writerows(result)
+        out.flush()
+        out.detach()
+    else:
+        widths = {c: max(len(c), *(len(str(r.get(c) if r.get(c) is not None else "-")) for r in result)) if result
+                  else len(c) for c in cols}
+        print("  ".join(c.ljust(widths[c]) for c in cols))
+        for r in result:
+            print("  ".join(str(r.get(c) if r.get(c) is not None else "-").ljust(widths[c]) for c in cols))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+# メトリクス（Prometheus テキスト形式）
+# - カウンタ/ヒストグラム/ゲージをプロセス内に保持（Streamlit 再実行をまたいで集計）
+# - サイドカーHTTP（Secrets: METRICS_PORT）で /metrics を公開、
+#   またはファイル（Secrets: METRICS_FILE）へ定期書き出し（node_exporter textfile collector 等）
+# - 依存ライブラリなし（標準ライブラリのみ）
+import os, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PREFIX = "vc_engine_"
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+_counters: dict = {}    # name -> {labels_tuple: value}
+_hists: dict = {}       # name -> {labels_tuple: [bucket_counts..., sum, count]}
+_hist_buckets: dict = {}
+_gauge_fns: dict = {}   # name -> callable() -> float | dict[labels_tuple, float]
+_help: dict = {}
+
+def _key(labels: dict | None) -> tuple:
+    return tuple(sorted((labels or {}).items()))
+
+def describe(name: str, text: str):
+    _help[PREFIX + name] = text
+
+def inc(name: str, labels: dict | None = None, value: float = 1.0):
+    full = PREFIX + name
+    k = _key(labels)
+    with _lock:
+        series = _counters.setdefault(full, {})
+        series[k] = series.get(k, 0.0) + value
+
+def observe(name: str, seconds: float, labels: dict | None = None, buckets=DEFAULT_BUCKETS):
+    full = PREFIX + name
+    k = _key(labels)
+    with _lock:
+        _hist_buckets.setdefault(full, tuple(buckets))
+        bks = _hist_buckets[full]
+        series = _hists.setdefault(full, {})
+        st = series.get(k)
+        if st is None:
+            st = series[k] = [0] * len(bks) + [0.0, 0]
+        for i, b in enumerate(bks):
+            if seconds <= b:
+                st[i] += 1
+        st[-2] += seconds
+        st[-1] += 1
+
+def register_gauge(name: str, fn):
+    """fn() は数値、または {labels_dict のタプル: 数値} を返す。スクレイプ時に評価。"""
+    with _lock:
+        _gauge_fns[PREFIX + name] = fn
+
+class timer:
+    """with metrics.timer("pdf_build_seconds", {"theme": "factory"}): ..."""
+    def __init__(self, name: str, labels: dict | None = None):
+        self.name, self.labels = name, labels
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.t0, self.labels)
+        return False
+
+# ========= テキスト形式 =========
+def _esc(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _fmt_labels(k: tuple, extra: tuple = ()) -> str:
+    items = list(k) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{n}="{_esc(v)}"' for n, v in items) + "}"
+
+def _fmt_num(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) and not float(v).is_integer() else str(int(v))
+
+def render_text() -> str:
+    lines = []
+    with _lock:
+        counters = {n: dict(s) for n, s in _counters.items()}
+        hists = {n: {k: list(v) for k, v in s.items()} for n, s in _hists.items()}
+        buckets = dict(_hist_buckets)
+        gauges = dict(_gauge_fns)
+
+    for name in sorted(counters):
+        if name in _help:
+            lines.append(f"# HELP {name} {_help[name]}")
+        lines.append(f"# TYPE {name} counter")
+        for k, v in sorted(counters[name].items()):
+            lines.append(f"{name}{_fmt_labels(k)} {_fmt_num(v)}")
+
+    for name in sorted(hists):
+        if name in _help:
+            lines.append(f"# HELP {name} {_help[name]}")
+        lines.append(f"# TYPE {name} histogram")
+        bks = buckets[name]
+        for k, st in sorted(hists[name].items()):
+            for i, b in enumerate(bks):
+                lines.append(f"{name}_bucket{_fmt_labels(k, (('le', _fmt_num(b)),))} {st[i]}")
+            lines.append(f"{name}_bucket{_fmt_labels(k, (('le', '+Inf'),))} {st[-1]}")
+            lines.append(f"{name}_sum{_fmt_labels(k)} {_fmt_num(st[-2])}")
+            lines.append(f"{name}_count{_fmt_labels(k)} {st[-1]}")
+
+    for name in sorted(gauges):
+        try:
+            val = gauges[name]()
+        except Exception:
+            continue
+        if name in _help:
+            lines.append(f"# HELP {name} {_help[name]}")
+        lines.append(f"# TYPE {name} gauge")
+        if isinstance(val, dict):
+            for k, v in sorted(val.items()):
+                lines.append(f"{name}{_fmt_labels(tuple(k))} {_fmt_num(v)}")
+        else:
+            lines.append(f"{name} {_fmt_num(val)}")
+    return "\n".join(lines) + "\n"
+
+# ========= 公開（サイドカーHTTP / ファイル） =========
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = render_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+_server = None
+_writer = None
+
+def start_http_server(port: int, addr: str = "0.0.0.0"):
+    """サイドカーHTTPを1プロセス1回だけ起動（2回目以降は何もしない）。"""
+    global _server
+    with _lock:
+        if _server is not None:
+            return _server
+        _server = ThreadingHTTPServer((addr, int(port)), _Handler)
+    threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+    return _server
+
+def write_textfile(path: str):
+    # 一時ファイル→rename で原子的に置換（読み手が途中の内容を見ない）
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(render_text())
+    os.replace(tmp, path)
+
+def start_file_writer(path: str, interval_sec: float = 15.0):
+    global _writer
+    with _lock:
+        if _writer is not None:
+            return _writer
+        def _loop():
+            while True:
+                try:
+                    write_textfile(path)
+                except Exception as e:
+                    print("metrics textfile write error:", e)
+                time.sleep(interval_sec)
+        _writer = threading.Thread(target=_loop, name="metrics-file", daemon=True)
+    _writer.start()
+    return _writer
+
+def ensure_exporter(port=None, path=None):
+    """Secrets 由来の設定で公開手段を起動。失敗してもアプリは止めない。"""
+    try:
+        if port:
+            start_http_server(int(port))
+    except Exception as e:
+        print("metrics http start error:", e)
+    try:
+        if path:
+            start_file_writer(str(path))
+    except Exception as e:
+        print("metrics file writer start error:", e)
+
+# ========= 既定のメトリクス説明 =========
+describe("submissions_total", "診断の送信数（theme・signal・type 別）")
+describe("ai_comments_total", "AIコメントの結果（outcome=success / fallback / shed）")
+describe("saves_total", "回答の保存数（backend=sheets / csv）")
+describe("events_total", "記録したイベント数（level 別）")
+describe("ai_latency_seconds", "AIコメント生成（OpenAI）の所要時間")
+describe("pdf_build_seconds", "PDF レポートの生成時間")
+describe("save_latency_seconds", "回答の保存にかかった時間（Sheets、失敗時は CSV）")
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# ステージ計測（軽量スパン/タイマー）
+# - with span("make_pdf_bytes", theme="factory"): ... で所要時間を記録
+# - ステージ×テーマごとに直近 WINDOW 件を保持し、p50/p95/max を算出
+# - 無効時は共有の nullcontext を返すだけ（オーバーヘッドほぼゼロ）
+# - Streamlit の再実行でも消えないよう、集計はこのモジュール（プロセス内メモリ）に保持
+import math, threading, time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+WINDOW = 500  # ステージ×テーマごとに保持する直近サンプル数
+
+_lock = threading.Lock()
+_samples: dict = {}  # (stage, theme) -> deque[ms]
+_enabled = False
+_NULL = nullcontext()
+
+def enable(flag: bool = True):
+    global _enabled
+    _enabled = bool(flag)
+
+def is_enabled() -> bool:
+    return _enabled
+
+def record(stage: str, theme: str | None, elapsed_ms: float):
+    if not _enabled:
+        return
+    key = (stage, theme or "-")
+    with _lock:
+        buf = _samples.get(key)
+        if buf is None:
+            buf = _samples[key] = deque(maxlen=WINDOW)
+        buf.append(elapsed_ms)
+
+@contextmanager
+def _timed(stage: str, theme: str | None):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, theme, (time.perf_counter() - t0) * 1000.0)
+
+def span(stage: str, theme: str | None = None):
+    """計測が無効なら何もしないコンテキストを返す。"""
+    if not _enabled:
+        return _NULL
+    return _timed(stage, theme)
+
+def _percentile(sorted_vals: list, p: float) -> float:
+    # nearest-rank
+    if not sorted_vals:
+        return 0.0
+    idx = max(0, min(len(sorted_vals) - 1, math.ceil(p / 100.0 * len(sorted_vals)) - 1))
+    return sorted_vals[idx]
+
+def summary() -> list[dict]:
+    with _lock:
+        snap = {k: list(v) for k, v in _samples.items()}
+    rows = []
+    for (stage, theme), vals in sorted(snap.items()):
+        vals.sort()
+        rows.append({
+            "stage": stage,
+            "theme": theme,
+            "count": len(vals),
+            "p50_ms": round(_percentile(vals, 50), 1),
+            "p95_ms": round(_percentile(vals, 95), 1),
+            "max_ms": round(vals[-1], 1) if vals else 0.0,
+        })
+    return rows
+
+def sample_count() -> int:
+    with _lock:
+        return sum(len(v) for v in _samples.values())
+
+def reset():
+    with _lock:
+        _samples.clear()
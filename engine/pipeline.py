@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+# 送信後パイプライン（AIコメント・PDF・保存などのステージを依存関係つきで並行実行）
+# - Stage(name, fn, deps=..., after=..., timeout=..., deadline=...)
+#     deps : 成功が必要な前段（失敗・タイムアウトなら skipped）
+#     after: 終わるのを待つだけの前段（結果に関係なく実行。例: 保存は AI の成否を問わずコメント確定後）
+#     deadline: time.perf_counter() の絶対時刻。開始時の残りが timeout より短ければ残りで打ち切る（残りがなければ開始しない）
+#     fn(results, cancel) … results は前段の戻り値（成功分のみ）、cancel は threading.Event（協調キャンセル）
+# - タイムアウトは「待つのをやめる」。実行中のスレッドは止められないため結果は破棄し、後段はそのまま進める
+# - 前段の完了はコールバックで後段に伝えるため、呼び出し側（Streamlit の再実行）が中断されても最後まで進む
+# - キー（送信ごとの dedup_key）単位でプロセス内に登録し、再実行時は同じパイプラインに再接続する（二重保存しない）
+import threading, time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_WORKERS = 64          # 重い処理の同時実行数は engine/admission.py で抑える（ここはゲートで待つスレッドの分も含む）
+MAX_TRACKED = 256          # 登録しておくパイプライン数（完了済みから古い順に破棄）
+SETTLED = ("ok", "error", "timeout", "skipped", "cancelled")
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="post-submit")
+
+class Stage:
+    def __init__(self, name: str, fn, deps=(), after=(), timeout: float | None = None, deadline: float | None = None):
+        self.name, self.fn = name, fn
+        self.deps, self.after = tuple(deps), tuple(after)
+        self.timeout = timeout
+        self.deadline = deadline
+
+    def timeout_from(self, now: float) -> float | None:
+        if self.deadline is None:
+            return self.timeout
+        left = self.deadline - now
+        return left if self.timeout is None else min(self.timeout, left)
+
+class Pipeline:
+    def __init__(self, stages: list[Stage], executor: ThreadPoolExecutor | None = None, on_finish=None):
+        self.stages = OrderedDict((s.name, s) for s in stages)
+        for s in stages:
+            for d in s.deps + s.after:
+                if d not in self.stages:
+                    raise ValueError(f"{s.name}: 未定義の前段です: {d}")
+        self.status = {name: "pending" for name in self.stages}
+        self.results: dict = {}
+        self.errors: dict = {}
+        self.timings: dict = {}       # name -> ms（開始から確定まで）
+        self.order: list[str] = []    # 確定した順
+        self.cancel_event = threading.Event()
+        self._executor = executor or _executor
+        self._cond = threading.Condition(threading.RLock())
+        self._started: dict = {}
+        self._timers: dict = {}
+        self._limits: dict = {}       # name -> 実際に使ったタイムアウト（秒）
+        self.t0 = time.perf_counter()
+        self.elapsed_ms: float | None = None
+        self._on_finish = on_finish   # 全ステージ確定時に1回だけ on_finish(pipeline)（計測・メトリクス用）
+
+    # ========= 実行制御 =========
+    def start(self) -> "Pipeline":
+        with self._cond:
+            self._schedule()
+        return self
+
+    def _settle(self, name: str, status: str, error: str | None = None):
+        self.status[name] = status
+        if error:
+            self.errors[name] = error
+        if name in self._started:
+            self.timings[name] = (time.perf_counter() - self._started[name]) * 1000.0
+        timer = self._timers.pop(name, None)
+        if timer:
+            timer.cancel()
+        self.order.append(name)
+        if self.finished and self.elapsed_ms is None:
+            self.elapsed_ms = (time.perf_counter() - self.t0) * 1000.0
+            if self._on_finish:
+                try:
+                    self._on_finish(self)
+                except Exception as e:
+                    print("pipeline on_finish error:", e)
+        self._cond.notify_all()
+
+    def _schedule(self):
+        """前段が確定したステージを開始（または skipped に）。ロック内で呼ぶ。"""
+        changed = True
+        while changed:
+            changed = False
+            for name, s in self.stages.items():
+                if self.status[name] != "pending":
+                    continue
+                if any(self.status[d] not in SETTLED for d in s.deps + s.after):
+                    continue
+                changed = True
+                if self.cancel_event.is_set():
+                    self._settle(name, "cancelled")
+                    continue
+                failed = [d for d in s.deps if self.status[d] != "ok"]
+                if failed:
+                    self._settle(name, "skipped", f"前段が未完了: {', '.join(failed)}")
+                    continue
+                now = time.perf_counter()
+                timeout = s.timeout_from(now)
+                if timeout is not None and timeout <= 0:
+                    self._settle(name, "timeout", "期限を過ぎたため開始せず")
+                    continue
+                self.status[name] = "running"
+                self._started[name] = now
+                inputs = dict(self.results)
+                if timeout:
+                    self._limits[name] = timeout
+                    timer = threading.Timer(timeout, self._expire, args=(name,))
+                    timer.daemon = True
+                    self._timers[name] = timer
+                    timer.start()
+                fut = self._executor.submit(s.fn, inputs, self.cancel_event)
+                fut.add_done_callback(lambda f, n=name: self._done(n, f))
+
+    def _done(self, name: str, fut):
+        with self._cond:
+            if self.status[name] != "running":
+                return   # タイムアウト・キャンセル済み（結果は破棄）
+            try:
+                self.results[name] = fut.result()
+                self._settle(name, "ok")
+            except Exception as e:
+                self._settle(name, "error", str(e))
+            self._schedule()
+
+    def _expire(self, name: str):
+        with self._cond:
+            if self.status[name] != "running":
+                return
+            self._settle(name, "timeout", f"{self._limits[name]:.2f}s を超過")
+            self._schedule()
+
+    def cancel(self):
+        """未開始のステージを取り消し、実行中のステージは待たずに打ち切る（fn には cancel で通知）"""
+        self.cancel_event.set()
+        with self._cond:
+            for name, st in self.status.items():
+                if st in ("pending", "running"):
+                    self._settle(name, "cancelled")
+
+    # ========= 参照 =========
+    @property
+    def finished(self) -> bool:
+        return all(st in SETTLED for st in self.status.values())
+
+    def ok(self, name: str) -> bool:
+        return self.status.get(name) == "ok"
+
+    def wait(self, timeout: float | None = None) -> bool:
+        with self._cond:
+            return self._cond.wait_for(lambda: self.finished, timeout)
+
+    def settled_stream(self, timeout: float | None = None, tick: float | None = None):
+        """ステージ名を確定した順に返す（すでに確定済みの分から）。timeout で打ち切り。
+        tick を指定すると、その間に確定がなければ None を返す（待ち状況の表示を更新するため）"""
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        i = 0
+        while True:
+            with self._cond:
+                remaining = None if deadline is None else max(0.0, deadline - time.perf_counter())
+                wait = tick if remaining is None else (remaining if tick is None else min(tick, remaining))
+                self._cond.wait_for(lambda: len(self.order) > i or self.finished, wait)
+                batch = self.order[i:]
+                done = self.finished
+            if tick is not None and not batch and not done:
+                yield None
+            for name in batch:
+                yield name
+            i += len(batch)
+            if (done and i >= len(self.order)) or (deadline is not None and time.perf_counter() >= deadline):
+                return
+
+    def summary(self) -> dict:
+        with self._cond:
+            return {name: {"status": self.status[name], "ms": round(self.timings.get(name, 0.0), 1),
+                           "error": self.errors.get(name, "")} for name in self.stages}
+
+# ========= プロセス内の登録（送信ごと） =========
+_registry: OrderedDict = OrderedDict()
+_reg_lock = threading.Lock()
+
+def start(key: str, stages_factory, on_finish=None) -> tuple[Pipeline, bool]:
+    """key のパイプラインを返す。未登録なら stages_factory() で作って開始。戻り値: (pipeline, 新規か)"""
+    with _reg_lock:
+        pl = _registry.get(key)
+        if pl is not None:
+            _registry.move_to_end(key)
+            return pl, False
+        pl = Pipeline(stages_factory(), on_finish=on_finish)
+        _registry[key] = pl
+        for k in [k for k, p in _registry.items() if p.finished][: max(0, len(_registry) - MAX_TRACKED)]:
+            del _registry[k]
+    return pl.start(), True
+
+def get(key: str) -> Pipeline | None:
+    with _reg_lock:
+        return _registry.get(key)
+
+def running_count() -> int:
+    with _reg_lock:
+        return sum(1 for p in _registry.values() if not p.finished)
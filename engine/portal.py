@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+# ポータル（ブランドページ）の設定と描画部品
+# - カード定義・文言・共通CSSをここで一元管理（Streamlit 版と静的版で共用）
+# - CSS はプロセスにつき1回だけ最小化し、以降は同じ文字列を使い回す
+# - カードグリッドの HTML は UTM パラメータの組ごとに有限サイズでキャッシュ
+import re
+from functools import lru_cache
+from html import escape
+from urllib.parse import quote
+
+BRAND_BG = "#f0f7f7"
+
+# ========= ポータル（ブランドページ）設定 =========
+PORTAL_TITLE = "3分診断ポータル｜Victor Consulting"
+PORTAL_HERO  = "会社の “ボトルネック” を、3分で見える化"
+PORTAL_LEAD  = "機密数値は不要。Yes/Noや2〜3段階の簡易回答だけで、“次の一手”まで示します。"
+
+# タイトル（1行目）・強調サブタイトル
+PORTAL_HERO_HTML = "<div class='portal-hero'><h1 style='line-height:1.25'>3分診断ポータル<br/> Victor Consulting</h1></div>"
+PORTAL_SUBTITLE_HTML = """
+<div class="portal-subtitle">
+    会社の <span>“ボトルネック”</span> を、3分で見える化
+</div>
+"""
+
+# 追加説明（Streamlit では expander 内に Markdown として表示）
+PORTAL_ABOUT_TITLE = "Victor Consultingについて / なぜ“3分診断”なのか？"
+PORTAL_ABOUT_MD = """
+**Victor Consulting** は、中小企業の“現場・人・お金”の流れを可視化し、  
+成果につながる **ボトルネックの特定** を得意とする経営コンサルティング事務所です。
+
+私たちのアプローチの核にあるのが **瞬間経営管理®**。  
+複雑な分析をすべて裏側で処理し、  
+「いま、どこを直せば最短で成果につながるのか」を **3分で示す** 独自メソッドです。
+
+- 数値入力は不要。Yes/No・2〜3段階の回答で診断が完了  
+- 現場・資金・組織・人材・営業・オフィスなど、会社全体の流れを横断して評価  
+- 結果は **PDF＋AIコメント** で即時出力。社内共有と改善アクションがスムーズ  
+- 初回相談は **90分スポット診断** から。継続支援や研修メニューも提供しています。
+
+"""
+
+# カード定義（順番＝表示順）
+DIAG_MENU = [
+    {
+        "key": "factory",
+        "emoji": "🏭",
+        "title": "現場のムダ・停滞ポイント診断",
+        "lead": "工程・段取り・仕掛・在庫の“ボトルネック”を明確化し、流れを良くする改善点を特定します",
+        "available": True,
+    },
+    {
+        "key": "cashflow",
+        "emoji": "💴",
+        "title": "資金繰りのボトルネック診断",
+        "lead": "入金・在庫・回収・支払など、お金の動きを止める“資金ボトルネック”を3分で抽出します",
+        "available": True,
+    },
+    {
+        "key": "succession",
+        "emoji": "🧭",
+        "title": "事業承継リスク診断",
+        "lead":  "後継者・資本・ガバナンス・関係者・ライフ設計の視点から“承継のリスク要因”を見える化します",
+        "available": True,
+    },
+    {
+        "key": "retention",
+        "emoji": "👥",
+        "title": "人材定着リスク診断",
+        "lead":  "採用・評価・育成・働き方・職場風土から、“離職につながる要因”を早期に発見します",
+        "available": True,
+    },
+    {
+        "key": "productivity_office",
+        "emoji": "🗂️",
+        "title": "オフィス生産性の停滞ポイント診断",
+        "lead":  "会議・情報共有・IT活用・時間配分の乱れから、“生産性を下げる要因”を見える化します",
+        "available": True,
+    },
+    {
+        "key": "sales",
+        "emoji": "📈",
+        "title": "営業活動のボトルネック診断",
+        "lead":  "見込み客づくり・商談・受注・リピートの流れを整理し、営業活動の“停滞ポイント”を特定します",
+        "available": True,
+    },
+]
+
+# テーマURLに引き継ぐクエリ
+UTM_KEYS = ("utm_source", "utm_medium", "utm_campaign")
+CARDS_CACHE_SIZE = 256
+
+def utm_key(params: dict, keep=UTM_KEYS) -> tuple:
+    """クエリから引き継ぐ UTM を正規化（空は除外・前後空白除去・順序固定）。キャッシュキーに使う。"""
+    return tuple((k, str(params[k]).strip()) for k in keep if params.get(k) and str(params[k]).strip())
+
+def theme_href(theme_key: str, utm: tuple = ()) -> str:
+    base = [("theme", theme_key)] + list(utm)
+    return "?" + "&".join(f"{k}={quote(str(v), safe='')}" for k, v in base)
+
+# ========= 共通CSS（ポータル＋診断結果） =========
+def css_source(brand_bg: str) -> str:
+    return f"""
+.stApp {{ background: {brand_bg}; }}
+.block-container {{ padding-top: 2.8rem; }}
+h1 {{ margin-top: .6rem; }}
+
+/* 診断結果カード（既存） */
+.result-card {{
+  background: white; border-radius: 14px; padding: 1.0rem 1.0rem;
+  box-shadow: 0 6px 20px rgba(0,0,0,.06); border: 1px solid rgba(0,0,0,.06);
+}}
+.badge {{
+  display:inline-block; padding:.25rem .6rem; border-radius:999px; font-size:.9rem;
+  font-weight:700; letter-spacing:.02em; margin-left:.5rem;
+}}
+.badge-blue  {{ background:#e6f0ff; color:#0b5fff; border:1px solid #cfe3ff; }}
+.badge-yellow{{ background:#fff6d8; color:#8a6d00; border:1px solid #ffecb3; }}
+.badge-red   {{ background:#ffe6e6; color:#a80000; border:1px solid #ffc7c7; }}
+.small-note {{ color:#666; font-size:.9rem; }}
+hr {{ border:none; border-top:1px dotted #c9d7d7; margin:1.0rem 0; }}
+
+/* ポータル：ヒーロー */
+.portal-hero {{
+  text-align:center; padding: 1.2rem 0 0.6rem 0;
+}}
+
+/* ポータルサブタイトル */
+.portal-subtitle {{
+  font-size:1.5rem;
+  font-weight:700;
+  color:#111;
+  text-align:center;
+  margin-top:0.2rem;
+  margin-bottom:1rem;
+}}
+.portal-subtitle span {{
+  color:#005bbb;
+}}
+
+/* ポータル：グリッド ＋ カード全体リンク */
+.portal-grid {{
+  display:grid;
+  grid-template-columns: repeat(auto-fit, minmax(260px, 1fr));
+  gap: 18px;
+  margin-top: 18px;
+}}
+.portal-card-link {{
+  text-decoration:none;
+  color:inherit;
+  display:block;
+  height:100%;
+}}
+
+/* ポータル：カード本体（3Dボタン風） */
+.portal-card {{
+  position:relative;
+  display:flex;
+  flex-direction:column;
+  justify-content:flex-start;
+  height:100%;
+  min-height:240px;
+  padding:16px 18px;
+  border-radius:18px;
+  background:#ffffff;
+  box-shadow:0 10px 24px rgba(15,23,42,.06);
+  border:1px solid rgba(15,23,42,.06);
+  transition: transform .12s ease, box-shadow .12s ease, border-color .12s ease;
+}}
+.portal-card:hover {{
+  transform: translateY(-4px);
+  box-shadow:0 18px 36px rgba(15,23,42,.10);
+  border-color:#2563eb;
+}}
+
+/* 1行目：アイコン */
+.portal-icon {{
+  font-size:1.8rem;
+  margin-bottom:.3rem;
+}}
+
+/* 2〜3行目：タイトル */
+.portal-title {{
+  font-weight:800;
+  font-size:1.1rem;
+  margin:0 0 .35rem 0;
+  line-height:1.4;
+}}
+
+/* 本文（リード） */
+.portal-lead {{
+  margin:.25rem 0 .9rem;
+  line-height:1.6;
+  color:#374151;
+  font-size:.95rem;
+  flex:1;
+}}
+
+/* フッター（「この診断を開く →」表示） */
+.card-footer {{
+  display:flex;
+  justify-content:flex-end;
+  margin-top:auto;
+}}
+.portal-cta {{
+  font-size:.9rem;
+  font-weight:700;
+  color:#0b5fff;
+}}
+
+/* 準備中バッジ */
+.badge-soon {{
+  display:inline-block; padding:.2rem .6rem; border-radius:999px;
+  background:#fff6d8; color:#8a6d00; border:1px solid #ffecb3; font-weight:700;
+}}
+"""
+
+def minify_css(css: str) -> str:
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{}:;,>])\s*", r"\1", css)
+    return css.replace(";}", "}").strip()
+
+@lru_cache(maxsize=8)
+def style_tag(brand_bg: str) -> str:
+    return "<style>" + minify_css(css_source(brand_bg)) + "</style>"
+
+# ========= カードグリッド =========
+def _card_html(item: dict, utm: tuple) -> str:
+    if item["available"]:
+        safe_href = escape(theme_href(item["key"], utm), quote=True)
+        return f"""
+<a class="portal-card-link" href="{safe_href}">
+  <div class="portal-card">
+    <div class="portal-icon">{item['emoji']}</div>
+    <h3 class="portal-title">{item['title']}</h3>
+    <div class="portal-lead">{item['lead']}</div>
+    <div class="card-footer">
+      <span class="portal-cta">この診断を開く →</span>
+    </div>
+  </div>
+</a>
+"""
+    return f"""
+<div class="portal-card">
+  <div class="portal-icon">{item['emoji']}</div>
+  <h3 class="portal-title">{item['title']}</h3>
+  <div class="portal-lead">{item['lead']}</div>
+  <div class="card-footer">
+    <span class="badge-soon">準備中</span>
+  </div>
+</div>
+"""
+
+@lru_cache(maxsize=CARDS_CACHE_SIZE)
+def cards_grid_html(utm: tuple = ()) -> str:
+    """DIAG_MENU と UTM の組だけで決まる純関数。utm は utm_key() の戻り値を渡す。"""
+    return "<div class='portal-grid'>" + "\n".join(_card_html(item, utm) for item in DIAG_MENU) + "</div>"
+
+def cache_entries() -> int:
+    return cards_grid_html.cache_info().currsize
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+# 管理者向けプロファイラ（?admin=1&profile=1 / profile=sample / profile=cprofile）
+# - cprofile : 決定論的プロファイラ。Streamlit のセッションスレッドだけを計測（他ユーザーに影響なし）
+#              ※スレッド単位なのは Python 3.11 まで。3.12 以降の cProfile は sys.monitoring を使い、有効な間は
+#                プロセス全体（他ユーザーのスレッドも）を計測し、同時に1つしか有効にできない（2つ目は sample で代替）
+#                そのため 3.12 以降の既定は sample（profile=cprofile と明示したときだけ cprofile）
+# - sample   : サンプリングプロファイラ。対象スレッドのスタックを一定間隔で採取（長時間向け・低オーバーヘッド）
+# - 上位関数（累積時間順）と生データ（.prof / folded stacks）を返す
+# - 計測は start() を呼んだフレーム（Streamlit のスクリプト本体）の実行中だけ。例外・再実行（RerunException）で
+#   stop() まで届かなくても、採取スレッドはそのフレームが抜けた時点で止まり（上限 MAX_DURATION_SEC）、
+#   止め忘れた cprofile は次に start() したときに片付ける
+import cProfile, marshal, pstats, sys, threading, time
+from collections import Counter
+
+MAX_DURATION_SEC = 120.0
+DEFAULT_MODE = "sample" if sys.version_info >= (3, 12) else "cprofile"
+
+_live_lock = threading.Lock()
+_live: list = []   # stop() されていないプロファイラ
+
+def _on_stack(frame, target_ident: int) -> bool:
+    """frame が対象スレッドの実行中のスタックにあるか（スクリプトの実行が続いているか）"""
+    f = sys._current_frames().get(target_ident)
+    while f is not None:
+        if f is frame:
+            return True
+        f = f.f_back
+    return False
+
+def _reap():
+    """計測中のスクリプトが（例外・再実行で）抜けたのに止まっていないプロファイラを止める"""
+    with _live_lock:
+        live = list(_live)
+    for p in live:
+        if not _on_stack(p._frame, p._target):
+            p.stop()
+
+class SessionProfiler:
+    def __init__(self, mode: str | None = None, interval_sec: float = 0.005):
+        mode = mode or DEFAULT_MODE
+        self.mode = "sample" if mode == "sample" else "cprofile"
+        self.interval_sec = interval_sec
+        self.elapsed_sec = 0.0
+        self._prof = None
+        self._stats = None
+        self._stacks: Counter = Counter()
+        self._samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._t0 = 0.0
+        self._target = None
+        self._frame = None   # start() を呼んだフレーム。ここを抜けたら計測終了
+        self._stopped = False
+
+    # ========= 開始/終了 =========
+    def start(self):
+        _reap()
+        self._t0 = time.perf_counter()
+        self._target = threading.get_ident()
+        self._frame = sys._getframe(1)
+        if self.mode == "cprofile":
+            self._prof = cProfile.Profile()
+            try:
+                self._prof.enable()  # 呼び出したスレッドのみ対象（3.11 まで）
+            except ValueError:       # 3.12 以降: 他のプロファイラが有効
+                self._prof, self.mode = None, "sample"
+        if self.mode == "sample":
+            self._thread = threading.Thread(
+                target=self._sample_loop, args=(self._target, self._frame), name="session-sampler", daemon=True
+            )
+            self._thread.start()
+        with _live_lock:
+            _live.append(self)
+        return self
+
+    def stop(self):
+        """何度呼んでもよい（2回目以降は何もしない）"""
+        with _live_lock:
+            if self._stopped:
+                return self
+            self._stopped = True
+            if self in _live:
+                _live.remove(self)
+        if self.mode == "cprofile" and self._prof is not None:
+            self._prof.disable()
+            self._stats = pstats.Stats(self._prof)
+        elif self._thread is not None:
+            self._stop.set()
+            if self._thread is not threading.current_thread():
+                self._thread.join(timeout=1.0)
+        self._frame = None
+        self.elapsed_sec = time.perf_counter() - self._t0
+        return self
+
+    def _sample_loop(self, target_ident: int, start_frame):
+        deadline = time.perf_counter() + MAX_DURATION_SEC
+        while not self._stop.wait(self.interval_sec):
+            if not _on_stack(start_frame, target_ident) or time.perf_counter() > deadline:
+                self.stop()   # スクリプトの実行が（stop() されずに）終わったか上限時間
+                break
+            frame = sys._current_frames().get(target_ident)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_filename}:{code.co_name}:{code.co_firstlineno}")
+                frame = frame.f_back
+            self._stacks[";".join(reversed(stack))] += 1
+            self._samples += 1
+
+    # ========= 結果 =========
+    def top_functions(self, limit: int = 30) -> list[dict]:
+        if self.mode == "cprofile":
+            if self._stats is None:
+                return []
+            rows = []
+            for (fname, lineno, func), (cc, nc, tt, ct, _callers) in self._stats.stats.items():
+                rows.append({
+                    "function": f"{func} ({fname}:{lineno})",
+                    "calls": nc,
+                    "tottime_ms": round(tt * 1000, 2),
+                    "cumtime_ms": round(ct * 1000, 2),
+                })
+            rows.sort(key=lambda r: r["cumtime_ms"], reverse=True)
+            return rows[:limit]
+
+        # sample: 関数がスタックに現れたサンプル数＝累積、先頭フレーム＝自己時間
+        cum, own = Counter(), Counter()
+        for stack, n in self._stacks.items():
+            frames = stack.split(";")
+            for f in set(frames):
+                cum[f] += n
+            own[frames[-1]] += n
+        rows = [{
+            "function": f,
+            "samples": n,
+            "self_samples": own.get(f, 0),
+            "cumtime_ms": round(n * self.interval_sec * 1000, 1),
+        } for f, n in cum.most_common(limit)]
+        return rows
+
+    def raw_bytes(self) -> bytes:
+        """cprofile: pstats 互換（snakeviz / flameprof 等）、sample: folded stacks（flamegraph.pl 等）。"""
+        if self.mode == "cprofile":
+            return marshal.dumps(self._stats.stats) if self._stats is not None else b""
+        return "\n".join(f"{s} {n}" for s, n in self._stacks.items()).encode("utf-8")
+
+    def raw_filename(self, prefix: str = "engine") -> str:
+        stamp = time.strftime("%Y%m%d_%H%M%S")
+        return f"{prefix}_{stamp}.prof" if self.mode == "cprofile" else f"{prefix}_{stamp}.folded"
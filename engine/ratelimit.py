@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# トークンバケット（スレッドセーフ）
+# - rate: 1秒あたりの補充量、burst: バケット容量
+# - acquire() は必要なら待ってからトークンを消費する。timeout 付きで待ち切れなければ False
+import threading, time
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float | None = None):
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def per_minute(cls, n: float, burst: float | None = None) -> "TokenBucket":
+        return cls(n / 60.0, burst if burst is not None else max(1.0, n / 60.0))
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def try_acquire(self, n: float = 1.0) -> bool:
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= n:
+                self._tokens -= n
+                return True
+            return False
+
+    def wait_time(self, n: float = 1.0) -> float:
+        with self._lock:
+            self._refill(time.monotonic())
+            return 0.0 if self._tokens >= n else (n - self._tokens) / self.rate
+
+    def acquire(self, n: float = 1.0, timeout: float | None = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if self.try_acquire(n):
+                return True
+            wait = self.wait_time(n)
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(max(wait, 0.001))
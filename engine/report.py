@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+# レポート描画（PDF 1ページ・棒グラフ・QR・ロゴ・日本語フォント）
+# - Streamlit に依存しない（アプリ本体・ウォームアップ・バッチ処理から共通利用）
+# - 日本語TTFの登録はプロセスにつき1回だけ行い、以降は結果を使い回す
+# - PDF にはフル TTF ではなくサブセット（engine/fonts.py）を埋め込む
+# - lite=True は軽量版（棒グラフなし・ロゴは取得済みのときだけ）。結果画面の待ち時間の予算を超えたときに使う（engine/slo.py）
+import os, io, tempfile, threading, time
+from functools import lru_cache
+import pandas as pd
+
+# PDF
+from reportlab.lib.pagesizes import A4
+from reportlab.lib import colors
+from reportlab.platypus import (
+    SimpleDocTemplate, Paragraph, Spacer, Image, Table, TableStyle
+)
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfbase.pdfmetrics import registerFontFamily
+
+# Images
+from PIL import Image as PILImage
+import qrcode
+
+from engine.portal import BRAND_BG
+from engine import fonts, charts, shared_cache, http_pool
+
+LOGO_LOCAL = "assets/CImark.png"
+LOGO_URL   = "https://victorconsulting.jp/wp-content/uploads/2025/10/CImark.png"
+CTA_URL    = "https://victorconsulting.jp/spot-diagnosis/"
+
+# ========= 日本語TTF 登録 =========
+FONT_PATH_IN_USE = None
+_font_checked = False
+_font_lock = threading.Lock()
+
+def _register_japanese_font():
+    candidates = [
+        "NotoSansJP-Regular.ttf",
+        "/mnt/data/NotoSansJP-Regular.ttf",
+        "/content/NotoSansJP-Regular.ttf",
+    ]
+    font_path = next((p for p in candidates if os.path.exists(p)), None)
+    if not font_path:
+        return None
+    try:
+        # "JP" = 静的テキスト分のサブセット（fontTools 未導入時はフル TTF）
+        pdfmetrics.registerFont(TTFont("JP", fonts.base_subset_path(font_path) or font_path))
+        registerFontFamily("JP", normal="JP", bold="JP", italic="JP", boldItalic="JP")
+    except Exception as e:
+        print("ReportLab font register error:", e)
+    # matplotlib 側はグローバル設定（rcParams）を変えず、engine/charts.py が描画ごとにフォントを指定
+    return font_path
+
+def setup_japanese_font():
+    """初回のみ登録し、以降は登録済みのフォントパス（なければ None）を返す。"""
+    global FONT_PATH_IN_USE, _font_checked
+    with _font_lock:
+        if not _font_checked:
+            FONT_PATH_IN_USE = _register_japanese_font()
+            _font_checked = True
+    return FONT_PATH_IN_USE
+
+# ========= ロゴ取得 =========
+# ダウンロードはプロセス（ホスト）につき1回。固定パスに保存して使い回し、失敗時はしばらく再試行しない
+LOGO_CACHE = os.path.join(tempfile.gettempdir(), "vc_CImark.png")
+LOGO_RETRY_SEC = 300
+_logo_lock = threading.Lock()
+_logo_failed_at = 0.0
+
+def path_or_download_logo(download: bool = True) -> str | None:
+    global _logo_failed_at
+    if os.path.exists(LOGO_LOCAL):
+        return LOGO_LOCAL
+    if os.path.exists(LOGO_CACHE):
+        return LOGO_CACHE
+    if not download:
+        return None
+    with _logo_lock:
+        if os.path.exists(LOGO_CACHE):
+            return LOGO_CACHE
+        if time.time() - _logo_failed_at < LOGO_RETRY_SEC:
+            return None
+        try:
+            r = http_pool.get(LOGO_URL, timeout=8)
+            if r.ok:
+                tmp = f"{LOGO_CACHE}.{os.getpid()}.tmp"
+                with open(tmp, "wb") as f:
+                    f.write(r.content)
+                os.replace(tmp, LOGO_CACHE)
+                return LOGO_CACHE
+        except Exception:
+            pass
+        _logo_failed_at = time.time()
+    return None
+
+def clamp_comment(text: str, max_chars: int = 520) -> str:
+    if not text:
+        return ""
+    t = " ".join(text.strip().split())
+    return t if len(t) <= max_chars else (t[:max_chars - 1] + "…")
+
+# ========= 図・QRユーティリティ =========
+def build_bar_png(df: pd.DataFrame) -> bytes:
+    return charts.bar_png(df, FONT_PATH_IN_USE)
+
+def image_with_max_width(path: str, max_w: int):
+    with PILImage.open(path) as im:
+        w, h = im.size
+    if w <= max_w:
+        return Image(path, width=w, height=h)
+    new_h = h * (max_w / w)
+    return Image(path, width=max_w, height=new_h)
+
+@lru_cache(maxsize=8)
+def build_qr_png(data_url: str) -> bytes:
+    # プロセス内（lru_cache）→ ワーカー間の共有キャッシュ（設定時）→ 生成 の順
+    cache = shared_cache.get_default()
+    key = shared_cache.make_key("qr", data_url)
+    if cache:
+        cached = cache.get("asset", key)
+        if cached is not None:
+            return cached
+    img = qrcode.make(data_url)
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    png = buf.getvalue()
+    if cache:
+        cache.set("asset", key, png)
+    return png
+
+# ========= PDF生成 =========
+def make_pdf_bytes(result: dict, df_scores: pd.DataFrame, brand_hex=BRAND_BG, lite: bool = False) -> bytes:
+    setup_japanese_font()
+    logo_path = path_or_download_logo(download=not lite)
+    bar_png = None if lite else build_bar_png(df_scores)   # 描画（matplotlib）が生成時間の半分強
+    qr_png  = build_qr_png(CTA_URL)
+
+    buf = io.BytesIO()
+    doc = SimpleDocTemplate(
+        buf, pagesize=A4,
+        rightMargin=32, leftMargin=32, topMargin=28, bottomMargin=28
+    )
+
+    meta = (
+        f"会社名：{result['company'] or '（未入力）'}　/　"
+        f"実施日時：{result['dt']}　/　"
+        f"信号：{result['signal']}　/　"
+        f"タイプ：{result['main_type']}"
+    )
+    comment = clamp_comment(result["comment"], 520)
+    jp = "JP"
+    if FONT_PATH_IN_USE:
+        # 会社名・AIコメントなどベースサブセットに無い文字があれば文書用サブセットに切り替え
+        # （生成が終わるまで他のスレッドの LRU 追い出しから守る。終わったら release）
+        jp = fonts.font_for_text(FONT_PATH_IN_USE, "JP", meta, comment, *df_scores["カテゴリ"])
+
+    try:
+        styles = getSampleStyleSheet()
+        title = styles["Title"]; normal = styles["BodyText"]; h3 = styles["Heading3"]
+        if FONT_PATH_IN_USE:
+            title.fontName = normal.fontName = h3.fontName = jp
+        normal.fontSize = 10
+        normal.leading = 14
+        h3.spaceBefore = 6
+        h3.spaceAfter = 4
+
+        elems = []
+        if logo_path:
+            elems.append(image_with_max_width(logo_path, max_w=120))
+            elems.append(Spacer(1, 6))
+
+        elems.append(Paragraph("3分無料診断レポート", title))
+        elems.append(Spacer(1, 4))
+        elems.append(Paragraph(meta, normal))
+        elems.append(Spacer(1, 6))
+
+        elems.append(Paragraph("診断コメント", h3))
+        elems.append(Paragraph(comment, normal))
+        elems.append(Spacer(1, 6))
+
+        table_data = [["カテゴリ", "平均スコア（0-5）"]] + [
+            [r["カテゴリ"], f"{r['平均スコア']:.2f}"] for _, r in df_scores.iterrows()
+        ]
+        tbl = Table(table_data, colWidths=[220, 140])
+        style_list = [
+            ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor(brand_hex)),
+            ("TEXTCOLOR",  (0, 0), (-1, 0), colors.black),
+            ("GRID",       (0, 0), (-1, -1), 0.3, colors.grey),
+            ("ALIGN",      (1, 1), (-1, -1), "CENTER"),
+            ("ROWBACKGROUNDS", (0, 1), (-1, -1), [colors.whitesmoke, colors.white]),
+        ]
+        if FONT_PATH_IN_USE:
+            style_list.append(("FONTNAME", (0, 0), (-1, -1), jp))
+        tbl.setStyle(TableStyle(style_list))
+        elems.append(tbl)
+        elems.append(Spacer(1, 6))
+
+        # 画像はメモリ上のまま渡す（一時ファイルを作らない）
+        if bar_png:
+            elems.append(Paragraph("カテゴリ別スコア（棒グラフ）", h3))
+            elems.append(Image(io.BytesIO(bar_png), width=390, height=180))
+            elems.append(Spacer(1, 6))
+
+        # 次の一手（QR右寄せ）
+        elems.append(Paragraph("次の一手（90分スポット診断のご案内）", h3))
+        url_par = Paragraph(f"詳細・お申込み：<u>{CTA_URL}</u>", normal)
+        qr_img = Image(io.BytesIO(qr_png), width=52, height=52)
+        next_table = Table([[url_par, qr_img]], colWidths=[430, 70])
+        nt_style = [("VALIGN", (0, 0), (-1, -1), "MIDDLE"), ("ALIGN", (1, 0), (1, 0), "RIGHT")]
+        if FONT_PATH_IN_USE:
+            nt_style.append(("FONTNAME", (0, 0), (-1, -1), jp))
+        next_table.setStyle(TableStyle(nt_style))
+        elems.append(next_table)
+
+        doc.build(elems)
+        buf.seek(0)
+        return buf.read()
+    finally:
+        fonts.release(jp)
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# 結果画面の部品（スコアベクトル単位のキャッシュ）
+# - 同じ（カテゴリ, 平均スコア）の組に対する Altair の Vega-Lite 仕様と表データはプロセス内で1回だけ作る
+# - 再実行のたびに alt.Chart の構築・to_dict()・Styler の計算をしない
+# - Streamlit に依存しない（描画は streamlit_app.py 側で st.vega_lite_chart / st.dataframe）
+import copy
+from functools import lru_cache
+
+import altair as alt
+import pandas as pd
+
+MAX_ENTRIES = 512
+
+def score_key(df: pd.DataFrame) -> tuple:
+    """キャッシュキー：((カテゴリ, 平均スコア), ...)"""
+    return tuple((str(c), round(float(v), 4)) for c, v in zip(df["カテゴリ"], df["平均スコア"]))
+
+def frame(key: tuple) -> pd.DataFrame:
+    """キーから DataFrame を作り直す（セッションにはキーだけを保持する）"""
+    return pd.DataFrame({"カテゴリ": [c for c, _ in key], "平均スコア": [v for _, v in key]})
+
+@lru_cache(maxsize=MAX_ENTRIES)
+def _chart_spec(key: tuple) -> dict:
+    chart = (
+        alt.Chart(frame(key))
+        .mark_bar()
+        .encode(
+            x=alt.X("平均スコア:Q", scale=alt.Scale(domain=[0, 5])),
+            y=alt.Y("カテゴリ:N", sort="-x"),
+            tooltip=["カテゴリ", "平均スコア"]
+        ).properties(height=210)
+    )
+    return chart.to_dict()
+
+def chart_spec(key: tuple) -> dict:
+    # st.vega_lite_chart は渡した dict からデータを取り出す（破壊的）ためコピーを返す
+    return copy.deepcopy(_chart_spec(key))
+
+@lru_cache(maxsize=MAX_ENTRIES)
+def table_frame(key: tuple) -> pd.DataFrame:
+    """表示用の表（書式は st.dataframe の column_config で指定。Styler は使わない）"""
+    return frame(key)
+
+def cache_entries() -> int:
+    return _chart_spec.cache_info().currsize + table_frame.cache_info().currsize
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+# 集計ロールアップ（管理者ダッシュボード用）
+# - 保存のたびに 日×テーマ 単位の集計を1件ずつ加算（生データは再走査しない）
+# - 保持する内容：件数 / 信号 / タイプ / リスク / 平均点の合計 / UTMキャンペーン別の閲覧→送信ファネル
+# - 日ごとの JSON ファイル（{ROLLUP_PATH の拡張子抜き}.d/YYYY-MM-DD.json）に原子的に書き出し
+#   （Secrets: ROLLUP_PATH、既定 rollups.json。以前の1ファイル形式は初回に日ごとへ分割して移行）
+# - 複数ワーカー（engine/serve.py）で同じファイルを共有できるよう、プロセス内では加算分（差分）だけを持ち、
+#   書き出すときにファイルロック（{path}.lock）の中で該当日のファイルだけ読み直して足し込む
+#   送信はその場で、閲覧は VIEW_FLUSH_SEC ごと（と正常終了時・ダッシュボード表示時）にまとめて書き出す
+# - ダッシュボードは直近N日分のファイルだけを読む（保存もダッシュボードも履歴の長さに依存しない）
+# - 既存の Sheets/CSV からの一括再構築（バックフィル）に対応
+import atexit, json, os, threading, time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+try:
+    import fcntl
+except ImportError:   # Windows など（プロセス内の排他だけになる）
+    fcntl = None
+
+DEFAULT_PATH = "rollups.json"
+NO_CAMPAIGN = "(none)"
+UNKNOWN_SIGNAL = "不明"
+VIEW_FLUSH_SEC = 5.0   # 閲覧数の書き出し間隔（閲覧のたびにファイルを書き直さない）
+
+_lock = threading.Lock()
+_state: dict = {}     # 日ごとのファイル -> (mtime_ns, {theme: bucket})  読み込んだ内容
+_pending: dict = {}   # path -> まだ書き出していない加算分（{"days": {day: {theme: bucket}}}）
+_flushed_at: dict = {}
+
+def _empty_bucket() -> dict:
+    return {"views": 0, "submissions": 0, "score_sum": 0.0,
+            "signal": {}, "type": {}, "risk": {}, "campaign": {}}
+
+def _new() -> dict:
+    return {"version": 1, "days": {}}
+
+def _day_dir(path: str) -> str:
+    return os.path.splitext(path)[0] + ".d"
+
+def _day_file(path: str, day: str) -> str:
+    return os.path.join(_day_dir(path), f"{day}.json")
+
+def _load_day(path: str, day: str) -> dict:
+    """その日のファイルの内容（前回から更新されていなければ読み直さない）。_lock の中で呼ぶ"""
+    fp = _day_file(path, day)
+    try:
+        mtime = os.stat(fp).st_mtime_ns
+    except OSError:
+        return {}
+    cached = _state.get(fp)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    themes = {}
+    try:
+        with open(fp, "r", encoding="utf-8") as f:
+            themes = json.load(f).get("themes", {})
+    except Exception as e:
+        print("rollup load error:", e)
+    _state[fp] = (mtime, themes)
+    return themes
+
+def _days(path: str) -> list[str]:
+    try:
+        return sorted(f[:-5] for f in os.listdir(_day_dir(path)) if f.endswith(".json"))
+    except OSError:
+        return []
+
+@contextmanager
+def _file_lock(path: str):
+    """プロセス間の排他（読み直し→加算→書き出しの間）"""
+    if fcntl is None:
+        yield
+        return
+    with open(f"{path}.lock", "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def _write_day(path: str, day: str, themes: dict):
+    fp = _day_file(path, day)
+    os.makedirs(os.path.dirname(fp), exist_ok=True)
+    tmp = f"{fp}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "themes": themes}, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, fp)
+    _state[fp] = (os.stat(fp).st_mtime_ns, themes)
+
+def _migrate(path: str):
+    """以前の1ファイル形式（{"days": {...}}）を日ごとのファイルへ分割する。_file_lock の中で呼ぶ"""
+    if not os.path.isfile(path):
+        return
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            legacy = json.load(f)
+    except Exception as e:
+        print("rollup migrate error:", e)
+        return
+    for day, themes in legacy.get("days", {}).items():
+        data = {"days": {day: json.loads(json.dumps(_load_day(path, day)))}}
+        _merge(data, {"days": {day: themes}})
+        _write_day(path, day, data["days"][day])
+    os.replace(path, f"{path}.migrated")
+
+def _merge(dst: dict, delta: dict):
+    """delta の加算分を dst に足し込む"""
+    for day, themes in delta["days"].items():
+        for theme, d in themes.items():
+            b = _bucket(dst, day, theme)
+            b["views"] = b.get("views", 0) + d.get("views", 0)
+            b["submissions"] = b.get("submissions", 0) + d.get("submissions", 0)
+            b["score_sum"] = round(b.get("score_sum", 0.0) + d.get("score_sum", 0.0), 4)
+            for k in ("signal", "type", "risk"):
+                for key, n in d.get(k, {}).items():
+                    _bump(b.setdefault(k, {}), key, n)
+            for camp, c in d.get("campaign", {}).items():
+                bc = b.setdefault("campaign", {}).setdefault(camp, {"views": 0, "submissions": 0})
+                bc["views"] += c.get("views", 0)
+                bc["submissions"] += c.get("submissions", 0)
+
+def _flush(path: str):
+    """たまった加算分を該当日のファイルへ（他プロセスの書き込みを読み直してから足す）。_lock の中で呼ぶ"""
+    delta = _pending.pop(path, None)
+    _flushed_at[path] = time.monotonic()
+    if not delta:
+        return
+    with _file_lock(path):
+        _migrate(path)
+        for day, themes in delta["days"].items():
+            data = {"days": {day: json.loads(json.dumps(_load_day(path, day)))}}   # キャッシュを直接書き換えない
+            _merge(data, {"days": {day: themes}})
+            _write_day(path, day, data["days"][day])
+
+def _delta(path: str) -> dict:
+    return _pending.setdefault(path, _new())
+
+def _bucket(data: dict, day: str, theme: str) -> dict:
+    return data["days"].setdefault(day, {}).setdefault(theme or "-", _empty_bucket())
+
+def _bump(d: dict, key: str, n: int = 1):
+    d[key] = d.get(key, 0) + n
+
+def signal_from_total(total: float) -> str:
+    # テーマ側 evaluate() と同じ閾値（total は丸める前の全体平均）
+    return "青信号" if total >= 4.0 else ("黄信号" if total >= 2.6 else "赤信号")
+
+def _overall_avg(row: dict) -> float | None:
+    """category_scores（カテゴリ別平均）から evaluate() と同じ全体平均を求める。読めなければ None"""
+    raw = row.get("category_scores")
+    try:
+        scores = raw if isinstance(raw, dict) else json.loads(raw or "{}")
+        values = [float(v) for v in scores.values()]
+    except (TypeError, ValueError, AttributeError):
+        return None
+    return sum(values) / len(values) if values else None
+
+def _apply_submission(data: dict, row: dict, signal: str | None):
+    day = str(row.get("report_date") or "")[:10] or date.today().isoformat()
+    b = _bucket(data, day, str(row.get("theme") or ""))
+    try:
+        total = float(row.get("total_score") or 0)
+    except (TypeError, ValueError):
+        total = 0.0
+    if not signal:
+        # total_score は小数2桁に丸めた文字列（3.996 → "4.00"）なので信号の判定には使わない
+        avg = _overall_avg(row)
+        signal = signal_from_total(avg) if avg is not None else UNKNOWN_SIGNAL
+    b["submissions"] += 1
+    b["score_sum"] = round(b["score_sum"] + total, 4)
+    _bump(b["signal"], signal)
+    _bump(b["type"], str(row.get("type_label") or "-"))
+    _bump(b["risk"], str(row.get("risk_level") or "-"))
+    camp = b["campaign"].setdefault(str(row.get("utm_campaign") or NO_CAMPAIGN), {"views": 0, "submissions": 0})
+    camp["submissions"] += 1
+
+# ========= 更新（保存時/閲覧時に呼ぶ） =========
+def record_submission(row: dict, signal: str | None = None, path: str = DEFAULT_PATH):
+    with _lock:
+        _apply_submission(_delta(path), row, signal)
+        _flush(path)
+
+def record_view(theme: str, utm_campaign: str = "", day: str | None = None, path: str = DEFAULT_PATH):
+    """テーマページの初回表示（セッションにつき1回）を数える。"""
+    day = day or date.today().isoformat()
+    with _lock:
+        b = _bucket(_delta(path), day, theme)
+        b["views"] += 1
+        camp = b["campaign"].setdefault(utm_campaign or NO_CAMPAIGN, {"views": 0, "submissions": 0})
+        camp["views"] += 1
+        if time.monotonic() - _flushed_at.get(path, 0.0) >= VIEW_FLUSH_SEC:
+            _flush(path)
+
+def flush_all():
+    """書き出していない閲覧数をすべて書き出す（終了時）"""
+    with _lock:
+        for path in list(_pending):
+            try:
+                _flush(path)
+            except Exception as e:
+                print("rollup flush error:", e)
+
+atexit.register(flush_all)
+
+def backfill(rows, path: str = DEFAULT_PATH) -> int:
+    """既存の保存行（dict の iterable）から送信系の集計を作り直す。閲覧数は保持。
+    信号は category_scores から求め直し、読めない行は「不明」として数える"""
+    fresh = _new()
+    n = 0
+    for row in rows:
+        _apply_submission(fresh, row, None)
+        n += 1
+    with _lock:
+        _flush(path)
+        with _file_lock(path):
+            _migrate(path)
+            for day in _days(path):
+                for theme, b in _load_day(path, day).items():
+                    nb = _bucket(fresh, day, theme)
+                    nb["views"] = b.get("views", 0)
+                    for camp, c in b.get("campaign", {}).items():
+                        nb["campaign"].setdefault(camp, {"views": 0, "submissions": 0})["views"] = c.get("views", 0)
+            for day, themes in fresh["days"].items():
+                _write_day(path, day, themes)
+    return n
+
+# ========= 読み出し（ダッシュボード） =========
+def summarize(days: int = 30, today: date | None = None, path: str = DEFAULT_PATH) -> dict:
+    today = today or date.today()
+    since = (today - timedelta(days=days - 1)).isoformat()
+    with _lock:
+        _flush(path)   # このプロセスの閲覧数も反映してから読む
+        if os.path.isfile(path):
+            with _file_lock(path):
+                _migrate(path)
+        picked = {}
+        for i in range(days):   # 直近N日分のファイルだけ（更新のない日はキャッシュのまま）
+            day = (today - timedelta(days=i)).isoformat()
+            themes = _load_day(path, day)
+            if themes:
+                picked[day] = themes
+        picked = json.loads(json.dumps(picked))  # ロック外で扱うためのコピー
+
+    per_theme, per_day = {}, Counter()
+    signal, type_label, risk = Counter(), Counter(), Counter()
+    funnel: dict = {}
+    for day, themes in picked.items():
+        for theme, b in themes.items():
+            t = per_theme.setdefault(theme, {"theme": theme, "views": 0, "submissions": 0, "score_sum": 0.0})
+            t["views"] += b.get("views", 0)
+            t["submissions"] += b.get("submissions", 0)
+            t["score_sum"] += b.get("score_sum", 0.0)
+            per_day[day] += b.get("submissions", 0)
+            signal.update(b.get("signal", {}))
+            type_label.update(b.get("type", {}))
+            risk.update(b.get("risk", {}))
+            for camp, c in b.get("campaign", {}).items():
+                f = funnel.setdefault(camp, {"utm_campaign": camp, "views": 0, "submissions": 0})
+                f["views"] += c.get("views", 0)
+                f["submissions"] += c.get("submissions", 0)
+
+    themes_rows = []
+    for t in per_theme.values():
+        n = t["submissions"]
+        themes_rows.append({
+            "theme": t["theme"], "views": t["views"], "submissions": n,
+            "avg_score": round(t["score_sum"] / n, 2) if n else None,
+        })
+    funnel_rows = []
+    for f in funnel.values():
+        f["conversion"] = round(f["submissions"] / f["views"], 3) if f["views"] else None
+        funnel_rows.append(f)
+    return {
+        "since": since,
+        "themes": sorted(themes_rows, key=lambda r: -r["submissions"]),
+        "daily": [{"report_date": d, "submissions": n} for d, n in sorted(per_day.items())],
+        "signal": [{"signal": k, "count": v} for k, v in signal.most_common()],
+        "type_label": [{"type_label": k, "count": v} for k, v in type_label.most_common()],
+        "risk_level": [{"risk_level": k, "count": v} for k, v in risk.most_common()],
+        "campaigns": sorted(funnel_rows, key=lambda r: -r["submissions"]),
+    }
+
+def reload(path: str = DEFAULT_PATH):
+    with _lock:
+        d = _day_dir(path) + os.sep
+        for fp in [k for k in _state if k.startswith(d)]:
+            _state.pop(fp, None)
+        _pending.pop(path, None)
+        _flushed_at.pop(path, None)
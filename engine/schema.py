@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# 保存スキーマ（Sheets/CSV/アーカイブ/エクスポートで共通）
+
+# 共通ヘッダー（列の追加は末尾へ。既存シートの列位置を変えない）
+COMMON_HEADER_ORDER = [
+    "timestamp","company","email","category_scores","total_score","type_label","ai_comment",
+    "utm_source","utm_campaign","pdf_url","app_version","status","ai_comment_len",
+    "risk_level","entry_check","report_date","theme",
+    # 送信ごとの待ち時間（ms、送信ボタンを押したスクリプト実行の開始が起点）
+    "ttr_ms","ready_ms","ai_ms","ai_source","pdf_ms","save_ms",
+    # 待ち時間の予算を超えて取った縮退（engine/slo.py の ACTIONS を ";" 区切り。なければ空欄）
+    "degraded",
+]
+
+# 待ち時間の列（整数 ms。未計測は空欄）
+#   ttr_ms   : 結果カードが表示されるまで
+#   ready_ms : AIコメントと最終版 PDF が揃うまで（利用者が待つ時間の合計）
+#   ai_ms    : AIコメント生成（キャッシュ命中なら数 ms）。ai_source = ai / cache / static / timeout
+#   pdf_ms   : 配布した PDF の生成（キャッシュ命中なら数 ms）
+#   save_ms  : 保存ステージ開始から Sheets（または CSV）へ送り出すまで（クォータ待ち・待ち行列を含む。
+#              シートの準備は AI を待つ間に済ませるため、準備に失敗したときだけその時間も入る）
+TIMING_COLUMNS = ["ttr_ms", "ready_ms", "ai_ms", "pdf_ms", "save_ms"]
+
+# category_scores（JSON文字列）を展開した列の接頭辞
+SCORE_PREFIX = "score_"
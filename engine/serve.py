@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# サーバ起動ランチャー：ウォームアップ完了後に Streamlit を同一プロセスで起動
+# - ウォームアップ済みの import / フォント / ReportLab の状態をそのまま最初の訪問者が使える
+# - Streamlit のヘルスチェック（/_stcore/health）はサーバ起動後にしか応答しないため、
+#   ウォームアップが終わるまで ready にならない
+#
+# 使い方:
+#   python -m engine.serve [streamlit run のオプション...]
+#   例) python -m engine.serve --server.port 8501 --server.headless true
+#   Secrets/環境変数 WARMUP_SHEETS="1" で Sheets の事前認証も行う
+#   SHARED_CACHE_PATH 設定時はウォームアップの成果物（QR 画像など）もワーカー間キャッシュに入る
+import os, sys
+
+APP_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "streamlit_app.py")
+
+def _secret(key: str, default=None):
+    # アプリ本体の read_secret と同じ優先順位（st.secrets → 環境変数）
+    try:
+        import streamlit as st
+        return st.secrets[key]
+    except Exception:
+        return os.environ.get(key, default)
+
+def main(argv=None) -> int:
+    from engine import warmup, shared_cache
+    args = sys.argv[1:] if argv is None else argv
+    shared_cache.configure(_secret("SHARED_CACHE_PATH", ""), _secret("SHARED_CACHE_MAX_MB", None))
+    result = warmup.warm_up(sheets=str(_secret("WARMUP_SHEETS", "0")) == "1", secret_getter=_secret)
+    print("warm-up done:", result, flush=True)
+
+    from streamlit.web import cli as stcli
+    sys.argv = ["streamlit", "run", APP_SCRIPT, *args]
+    return stcli.main()
+
+if __name__ == "__main__":
+    sys.exit(main())
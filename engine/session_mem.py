@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+# セッションあたりのメモリ量の上限管理と計測
+# - 結果はコンパクトな形（スコアはタプル、文字列は上限付き）で session_state に置く
+# - 再生成できる成果物（PDF バイト列）はセッションではなくプロセス共有の LRU（総バイト数上限）に置く
+# - 各セッションは実行の終わりに自分の state サイズを報告し、管理者画面で一覧・合計を確認できる
+#   計測（deep_size）は REPORT_INTERVAL_SEC に1回だけ（管理者モードは毎回）。それ以外の実行は最終時刻の更新のみ
+#   報告が SESSION_TTL_SEC 途絶えたセッションは報告のたびに一覧から外す（PRUNE_INTERVAL_SEC に1回）
+# - SESSION_BUDGET_BYTES は警告のみ（超えたセッションは一覧で over_budget、メトリクス session_over_budget_total、
+#   ログに1回出す）。state を切り詰めはしない（上の clip とプロセス共有 LRU で大きくならない形にしている）
+import hashlib, sys, threading, time
+from collections import OrderedDict
+
+import pandas as pd
+
+from engine import metrics
+
+SESSION_BUDGET_BYTES = 64 * 1024         # 1セッションの state の目安上限（警告のみ）
+MAX_COMMENT_CHARS = 1200                 # AIコメント（画面表示用。PDF は 520 字に丸める）
+MAX_FIELD_CHARS = 200                    # 会社名・メール
+ARTIFACT_BUDGET_BYTES = 32 * 1024 * 1024 # PDF キャッシュ全体の上限
+SESSION_TTL_SEC = 3600                   # 報告が途絶えたセッションを一覧から外すまでの時間
+REPORT_INTERVAL_SEC = 30                 # 同じセッションの state サイズを測り直す間隔
+PRUNE_INTERVAL_SEC = 60                  # 期限切れセッションを一覧から外す間隔
+
+metrics.describe("session_over_budget_total", "state が SESSION_BUDGET_BYTES を超えたセッション数（セッションにつき1回）")
+
+def clip(text, max_chars: int) -> str:
+    t = "" if text is None else str(text)
+    return t if len(t) <= max_chars else t[:max_chars - 1] + "…"
+
+# ========= サイズ見積もり =========
+def deep_size(obj, _seen=None) -> int:
+    """おおよその保持バイト数（DataFrame は memory_usage(deep=True)）。"""
+    _seen = _seen if _seen is not None else set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True).sum())
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, _seen) + deep_size(v, _seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(v, _seen) for v in obj)
+    return size
+
+# ========= 再生成可能な成果物（PDF）のプロセス共有キャッシュ =========
+class ArtifactCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._items: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key: str):
+        with self._lock:
+            v = self._items.get(key)
+            if v is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return v
+
+    def put(self, key: str, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._items[key] = value
+            self._bytes += len(value)
+            while self._bytes > self.max_bytes:
+                _, v = self._items.popitem(last=False)
+                self._bytes -= len(v)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._items), "bytes": self._bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+artifacts = ArtifactCache(ARTIFACT_BUDGET_BYTES)
+
+def artifact_key(*parts) -> str:
+    return hashlib.sha1("\x1f".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+# ========= セッションごとの計測 =========
+_lock = threading.Lock()
+_sessions: dict = {}   # session_id -> {"bytes", "keys", "top", "updated", "measured", "warned"}
+_pruned_at = 0.0
+
+def _prune(now: float, is_alive=None):
+    """報告が途絶えた（または終了した）セッションを外す。_lock の中で呼ぶ"""
+    global _pruned_at
+    _pruned_at = now
+    for sid in list(_sessions):
+        dead = now - _sessions[sid]["updated"] > SESSION_TTL_SEC
+        if not dead and is_alive is not None:
+            try:
+                dead = not is_alive(sid)
+            except Exception:
+                pass
+        if dead:
+            del _sessions[sid]
+
+def report(session_id: str, state, top: int = 3, force: bool = False):
+    """state は dict か、dict を返す関数（測らない実行では呼ばない）。force=True で間隔に関係なく測る"""
+    now = time.time()
+    with _lock:
+        if now - _pruned_at > PRUNE_INTERVAL_SEC:
+            _prune(now)
+        info = _sessions.get(session_id)
+        if info is not None and not force and now - info["measured"] < REPORT_INTERVAL_SEC:
+            info["updated"] = now
+            return
+    state = state() if callable(state) else state
+    sizes = {str(k): deep_size(v) for k, v in state.items()}
+    biggest = sorted(sizes.items(), key=lambda kv: -kv[1])[:top]
+    total = sum(sizes.values())
+    top_keys = ", ".join(f"{k}={v}" for k, v in biggest)
+    with _lock:
+        warned = bool(info and info.get("warned"))
+        if total > SESSION_BUDGET_BYTES and not warned:
+            warned = True
+            metrics.inc("session_over_budget_total")
+            print(f"session state over budget: {session_id[:8]} {total} bytes ({top_keys})")
+        _sessions[session_id] = {"bytes": total, "keys": len(sizes), "top": top_keys,
+                                 "updated": now, "measured": now, "warned": warned}
+
+def snapshot(is_alive=None) -> dict:
+    """{"sessions": [...], "total_bytes", "over_budget", "artifacts": {...}}。終了/期限切れのセッションは除外。"""
+    now = time.time()
+    with _lock:
+        _prune(now, is_alive)
+        rows = [{"session": sid[:8], "state_bytes": v["bytes"], "keys": v["keys"],
+                 "over_budget": v["bytes"] > SESSION_BUDGET_BYTES, "largest_keys": v["top"],
+                 "idle_sec": int(now - v["updated"])} for sid, v in _sessions.items()]
+    rows.sort(key=lambda r: -r["state_bytes"])
+    return {
+        "sessions": rows,
+        "total_bytes": sum(r["state_bytes"] for r in rows),
+        "over_budget": sum(1 for r in rows if r["over_budget"]),
+        "artifacts": artifacts.stats(),
+    }
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+# ホスト内の全ワーカーで共有するディスクキャッシュ（SQLite）
+# - 複数の Streamlit プロセスを並べても PDF・AIコメント・QR 画像などを作り直さない
+# - 書き込みはトランザクション単位で原子的（WAL モード。読み手は書き込み中も待たない）
+# - 名前空間（ns）ごとに TTL を指定可能。総バイト数の上限を超えたら最終参照が古い順に削除（LRU）
+# - 統計（hit/miss/set/evict/expired）は名前空間ごとに全プロセス分を DB に集計（数秒ごとにまとめて反映）
+# - Secrets: SHARED_CACHE_PATH（未設定なら無効）/ SHARED_CACHE_MAX_MB
+import hashlib, json, os, sqlite3, threading, time
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+TOUCH_INTERVAL_SEC = 60     # 参照時刻の更新間隔（毎回書くと読み取りが直列化されるため粗くする）
+STATS_FLUSH_SEC = 5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    ns TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, size INTEGER NOT NULL,
+    created REAL NOT NULL, expires REAL, accessed REAL NOT NULL,
+    PRIMARY KEY (ns, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed);
+CREATE TABLE IF NOT EXISTS stats (
+    ns TEXT PRIMARY KEY, hits INTEGER DEFAULT 0, misses INTEGER DEFAULT 0, sets INTEGER DEFAULT 0,
+    evictions INTEGER DEFAULT 0, expired INTEGER DEFAULT 0
+);
+"""
+_STAT_FIELDS = ("hits", "misses", "sets", "evictions", "expired")
+
+def make_key(*parts) -> str:
+    return hashlib.sha1("\x1f".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+class SharedCache:
+    def __init__(self, path: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = int(max_bytes)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pending: dict = {}       # ns -> {field: n}（未反映の統計）
+        self._last_flush = time.time()
+        d = os.path.dirname(os.path.abspath(path))
+        os.makedirs(d, exist_ok=True)
+        with self._conn() as c:
+            c.executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        c = getattr(self._local, "conn", None)
+        if c is None:
+            c = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute("PRAGMA synchronous=NORMAL")
+            c.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = c
+        return c
+
+    # ========= 統計 =========
+    def _count(self, ns: str, field: str, n: int = 1):
+        with self._lock:
+            p = self._pending.setdefault(ns, dict.fromkeys(_STAT_FIELDS, 0))
+            p[field] += n
+            due = time.time() - self._last_flush >= STATS_FLUSH_SEC
+        if due:
+            self.flush_stats()
+
+    def flush_stats(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.time()
+        if not pending:
+            return
+        try:
+            c = self._conn()
+            c.execute("BEGIN IMMEDIATE")
+            for ns, p in pending.items():
+                c.execute("INSERT OR IGNORE INTO stats(ns) VALUES (?)", (ns,))
+                c.execute("UPDATE stats SET hits=hits+?, misses=misses+?, sets=sets+?, evictions=evictions+?,"
+                          " expired=expired+? WHERE ns=?", (*[p[f] for f in _STAT_FIELDS], ns))
+            c.execute("COMMIT")
+        except sqlite3.Error as e:
+            print("shared cache stats error:", e)
+            try:
+                self._conn().execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+
+    # ========= 読み書き =========
+    def get(self, ns: str, key: str) -> bytes | None:
+        now = time.time()
+        try:
+            c = self._conn()
+            row = c.execute("SELECT value, expires, accessed FROM entries WHERE ns=? AND key=?", (ns, key)).fetchone()
+            if row is None:
+                self._count(ns, "misses")
+                return None
+            value, expires, accessed = row
+            if expires is not None and expires < now:
+                c.execute("DELETE FROM entries WHERE ns=? AND key=? AND expires=?", (ns, key, expires))
+                self._count(ns, "expired")
+                self._count(ns, "misses")
+                return None
+            if now - accessed > TOUCH_INTERVAL_SEC:
+                c.execute("UPDATE entries SET accessed=? WHERE ns=? AND key=?", (now, ns, key))
+            self._count(ns, "hits")
+            return bytes(value)
+        except sqlite3.Error as e:
+            print("shared cache get error:", e)
+            return None
+
+    def set(self, ns: str, key: str, value: bytes, ttl: float | None = None):
+        if len(value) > self.max_bytes:
+            return
+        now = time.time()
+        expires = now + ttl if ttl else None
+        try:
+            c = self._conn()
+            c.execute("BEGIN IMMEDIATE")
+            c.execute("INSERT OR REPLACE INTO entries(ns, key, value, size, created, expires, accessed)"
+                      " VALUES (?, ?, ?, ?, ?, ?, ?)", (ns, key, sqlite3.Binary(value), len(value), now, expires, now))
+            evicted = self._evict(c, now)
+            c.execute("COMMIT")
+        except sqlite3.Error as e:
+            print("shared cache set error:", e)
+            try:
+                self._conn().execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+            return
+        self._count(ns, "sets")
+        for ev_ns, n in evicted.items():
+            self._count(ev_ns, "evictions", n)
+
+    def _evict(self, c: sqlite3.Connection, now: float) -> dict:
+        """期限切れを削除し、上限超過分を LRU で削除。戻り値: ns -> 削除件数"""
+        evicted: dict = {}
+        for ns, n in c.execute("SELECT ns, COUNT(*) FROM entries WHERE expires IS NOT NULL AND expires < ?"
+                               " GROUP BY ns", (now,)).fetchall():
+            evicted[ns] = evicted.get(ns, 0) + n
+        c.execute("DELETE FROM entries WHERE expires IS NOT NULL AND expires < ?", (now,))
+        total = c.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return evicted
+        victims = []
+        for ns, key, size in c.execute("SELECT ns, key, size FROM entries ORDER BY accessed"):
+            if total <= self.max_bytes:
+                break
+            victims.append((ns, key))
+            total -= size
+            evicted[ns] = evicted.get(ns, 0) + 1
+        c.executemany("DELETE FROM entries WHERE ns=? AND key=?", victims)
+        return evicted
+
+    def get_json(self, ns: str, key: str):
+        raw = self.get(ns, key)
+        return None if raw is None else json.loads(raw.decode("utf-8"))
+
+    def set_json(self, ns: str, key: str, value, ttl: float | None = None):
+        self.set(ns, key, json.dumps(value, ensure_ascii=False).encode("utf-8"), ttl)
+
+    def namespace(self, ns: str, ttl: float | None = None) -> "Namespace":
+        return Namespace(self, ns, ttl)
+
+    def stats(self) -> list[dict]:
+        """名前空間ごとの件数・バイト数と全プロセス累計の hit/miss 等"""
+        self.flush_stats()
+        c = self._conn()
+        rows = {ns: {"ns": ns, "entries": n, "bytes": b}
+                for ns, n, b in c.execute("SELECT ns, COUNT(*), COALESCE(SUM(size), 0) FROM entries GROUP BY ns")}
+        for ns, *vals in c.execute("SELECT ns, hits, misses, sets, evictions, expired FROM stats"):
+            r = rows.setdefault(ns, {"ns": ns, "entries": 0, "bytes": 0})
+            r.update(dict(zip(_STAT_FIELDS, vals)))
+        out = []
+        for r in rows.values():
+            for f in _STAT_FIELDS:
+                r.setdefault(f, 0)
+            looked = r["hits"] + r["misses"]
+            r["hit_rate"] = round(r["hits"] / looked, 3) if looked else None
+            out.append(r)
+        return sorted(out, key=lambda r: r["ns"])
+
+    def total_bytes(self) -> int:
+        return self._conn().execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+class Namespace:
+    """ns と TTL を固定したビュー（session_mem.ArtifactCache と同じ get/put）"""
+    def __init__(self, cache: SharedCache, ns: str, ttl: float | None = None):
+        self.cache, self.ns, self.ttl = cache, ns, ttl
+
+    def get(self, key: str):
+        return self.cache.get(self.ns, key)
+
+    def put(self, key: str, value: bytes):
+        self.cache.set(self.ns, key, value, self.ttl)
+
+# ========= プロセス既定のキャッシュ =========
+_default: SharedCache | None = None
+
+def configure(path: str | None, max_mb: float | None = None) -> SharedCache | None:
+    """path が空なら無効。同じ設定での再呼び出しは既存インスタンスを返す。"""
+    global _default
+    if not path:
+        return None
+    max_bytes = int(float(max_mb) * 1024 * 1024) if max_mb else DEFAULT_MAX_BYTES
+    if _default is None or _default.path != path:
+        try:
+            _default = SharedCache(path, max_bytes)
+        except (sqlite3.Error, OSError) as e:
+            print("shared cache init error:", e)
+            return None
+    _default.max_bytes = max_bytes
+    return _default
+
+def get_default() -> SharedCache | None:
+    return _default
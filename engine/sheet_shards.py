@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+# ワークシートの分割（シャード）とロールオーバー
+# - 書き込み先は「<base>_<年>Q<四半期>」（例: responses_factory_2026Q4）。四半期が変わると新しいシートへ
+# - 1シートの行数が SHEET_SHARD_MAX_ROWS に達したら「<base>_<期>_<連番>」へ（例: responses_factory_2026Q4_2）
+# - 行数は追記 API の応答（updates.updatedRange の末尾行）で把握する（数えるための読み取りはしない）
+# - 新しいシャードを作るときだけスプレッドシートのセル数（シートメタデータ）を確認し、
+#   SHEET_SHARD_CELL_BUDGET を超える見込みなら SHEET_SHARD_SPREADSHEET_IDS（事前に作成・共有したもの）の次へ
+#   まだ伸びるシャード（今期の各 base の最新）は、いまの行数ではなく上限（SHEET_SHARD_MAX_ROWS 行）まで見込む
+# - シャードの一覧は主スプレッドシートの "_shards" シートに1行ずつ記録（保存・管理画面・エクスポートが参照）
+#   分割前のシート（responses_factory / events）も一覧の先頭に含める
+# - API 呼び出しはすべて engine/sheets_scheduler.py 経由。イベントログは append_async で呼び出し元を待たせない
+import hashlib, re, threading, time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from engine import metrics, sheets_scheduler
+
+JST = timezone(timedelta(hours=9))
+INDEX_TITLE = "_shards"
+INDEX_HEADER = ["base", "title", "spreadsheet_id", "period", "seq", "created_at"]
+MAX_ROWS_PER_SHARD = 50_000
+CELL_LIMIT = 10_000_000        # Google スプレッドシート1つあたりのセル上限
+CELL_BUDGET = 8_000_000        # 新しいシャードを置いてよい上限（残りは分割前のシート・余裕分）
+INDEX_TTL_SEC = 300            # 他プロセスが作ったシャードを読み取り側が見つけるまでの最大遅れ
+INDEX_WAIT_SEC = 20
+_TITLE_RE = re.compile(r"^(?P<base>.+?)_(?P<period>\d{4}Q[1-4])(?:_(?P<seq>\d+))?$")
+
+metrics.describe("sheet_shards_created_total", "作成したシャード（reason=period / rows）")
+metrics.describe("sheet_shards_over_budget_total", "セル予算に空きのあるスプレッドシートがなかった回数")
+
+def period_of(dt: datetime) -> str:
+    return f"{dt.year}Q{(dt.month - 1) // 3 + 1}"
+
+def shard_title(base: str, period: str, seq: int = 1) -> str:
+    return f"{base}_{period}" if seq <= 1 else f"{base}_{period}_{seq}"
+
+def split_title(title: str) -> tuple[str, str | None, int]:
+    """(base, 期 | None, 連番)。分割前のシートは (title, None, 0)"""
+    m = _TITLE_RE.match(title)
+    if not m:
+        return title, None, 0
+    return m.group("base"), m.group("period"), int(m.group("seq") or 1)
+
+def last_row_of(resp) -> int | None:
+    """append の応答の updates.updatedRange（例: "'responses_x'!A1201:R1203"）から末尾行"""
+    try:
+        m = re.search(r"(\d+)$", resp["updates"]["updatedRange"].split("!")[-1])
+        return int(m.group(1)) if m else None
+    except (KeyError, TypeError, AttributeError):
+        return None
+
+class ShardRouter:
+    def __init__(self, scheduler: sheets_scheduler.SheetsScheduler, service_json: str, primary_id: str,
+                 extra_ids=(), max_rows: int = MAX_ROWS_PER_SHARD, cell_budget: int = CELL_BUDGET):
+        self._sched = scheduler
+        self._json = service_json
+        self.primary_id = primary_id
+        self.spreadsheet_ids = [primary_id] + [s for s in extra_ids if s and s != primary_id]
+        self.max_rows = int(max_rows)
+        self.cell_budget = int(cell_budget)
+        self._lock = threading.Lock()             # _current の読み書きだけ（API を待つ間は持たない）
+        self._resolve_lock = threading.Lock()     # 書き込み先の確定を1つずつ
+        self._current: dict = {}          # base -> {"spreadsheet_id", "title", "period", "seq", "rows"}
+        self._index: list[dict] | None = None
+        self._index_at = 0.0
+        self._bg: ThreadPoolExecutor | None = None   # 書き込み先の確定（append_async 用）
+
+    # ========= 一覧（_shards） =========
+    def _index_ws(self):
+        return self._sched.ensure_worksheet(self._json, self.primary_id, INDEX_TITLE, INDEX_HEADER,
+                                            priority=sheets_scheduler.PRIORITY_RESPONSE).result(INDEX_WAIT_SEC)
+
+    def index(self, force: bool = False) -> list[dict]:
+        if not force and self._index is not None and time.time() - self._index_at < INDEX_TTL_SEC:
+            return self._index
+        ws = self._index_ws()
+        values = self._sched.run("read", ws.get_all_values, sheets_scheduler.PRIORITY_RESPONSE, INDEX_WAIT_SEC)
+        entries, seen = [], set()
+        for v in values[1:]:
+            e = dict(zip(INDEX_HEADER, list(v) + [""] * len(INDEX_HEADER)))
+            if not e["title"] or e["title"] in seen:   # 複数プロセスが同時に登録した重複は1つに
+                continue
+            seen.add(e["title"])
+            e["seq"] = int(e["seq"] or 1)
+            entries.append(e)
+        self._index, self._index_at = entries, time.time()
+        return entries
+
+    def _register(self, entry: dict):
+        fut = self._sched.append(self._json, self.primary_id, INDEX_TITLE, [[entry[k] for k in INDEX_HEADER]],
+                                 header=INDEX_HEADER, priority=sheets_scheduler.PRIORITY_RESPONSE,
+                                 value_input_option="RAW")
+        sheets_scheduler.wait_written(fut, INDEX_WAIT_SEC)
+        if self._index is not None:
+            self._index.append(entry)
+
+    def shards(self, base: str) -> list[dict]:
+        """base のシャード（古い順）。先頭は分割前のシート（存在しないこともある）"""
+        legacy = {"base": base, "title": base, "spreadsheet_id": self.primary_id, "period": "", "seq": 0,
+                  "created_at": ""}
+        own = sorted((e for e in self.index() if e["base"] == base), key=lambda e: (e["period"], e["seq"]))
+        return [legacy] + own
+
+    # ========= 書き込み先 =========
+    def _cells_used(self, spreadsheet_id: str, open_titles=(), cols: int = 1) -> int:
+        """使用セル数。open_titles（まだ伸びるシャード）は max_rows 行まで伸びる前提で数える
+        （一覧に登録済みでシートがまだ無いものは cols 列で見込む）"""
+        sh = self._sched.open(self._json, spreadsheet_id, sheets_scheduler.PRIORITY_RESPONSE).result(INDEX_WAIT_SEC)
+        meta = self._sched.run("read", sh.fetch_sheet_metadata, sheets_scheduler.PRIORITY_RESPONSE, INDEX_WAIT_SEC)
+        total, seen = 0, set()
+        for s in meta.get("sheets", []):
+            props = s.get("properties", {})
+            if "gridProperties" not in props:
+                continue
+            rows, n_cols = props["gridProperties"]["rowCount"], props["gridProperties"]["columnCount"]
+            if props.get("title") in open_titles:
+                rows = max(rows, self.max_rows)
+                seen.add(props["title"])
+            total += rows * n_cols
+        return total + len(set(open_titles) - seen) * self.max_rows * max(cols, 1)
+
+    def _open_shards(self, base: str, period: str) -> dict:
+        """spreadsheet_id -> まだ伸びるシャードのタイトル（今期の各 base の最新。作り直す base 自身は除く）"""
+        latest: dict = {}
+        for e in self.index():
+            if e["period"] == period and e["base"] != base:
+                if e["base"] not in latest or e["seq"] > latest[e["base"]]["seq"]:
+                    latest[e["base"]] = e
+        out: dict = {}
+        for e in latest.values():
+            out.setdefault(e["spreadsheet_id"], set()).add(e["title"])
+        return out
+
+    def _pick_spreadsheet(self, cols: int, base: str = "", period: str = "") -> str:
+        need = self.max_rows * max(cols, 1)
+        open_shards = self._open_shards(base, period) if period else {}
+        for sid in self.spreadsheet_ids:
+            if self._cells_used(sid, open_shards.get(sid, ()), cols) + need <= self.cell_budget:
+                return sid
+        metrics.inc("sheet_shards_over_budget_total")
+        print(f"sheet shards: セル予算に空きのあるスプレッドシートがありません（{len(self.spreadsheet_ids)}件）")
+        return self.spreadsheet_ids[-1]
+
+    def _resolve(self, base: str, period: str, cols: int, cur: dict | None) -> dict:
+        full = cur is not None and cur["period"] == period
+        same = [e for e in self.index(force=True) if e["base"] == base and e["period"] == period]
+        latest = max(same, key=lambda e: e["seq"], default=None)
+        if latest and not (full and latest["title"] == cur["title"]):
+            # 既存（または他プロセスが作った次の）シャード。行数は最初の追記の応答でわかる
+            return {"spreadsheet_id": latest["spreadsheet_id"], "title": latest["title"], "period": period,
+                    "seq": latest["seq"], "rows": 0}
+        seq = (latest["seq"] + 1) if latest else 1
+        entry = {"base": base, "title": shard_title(base, period, seq), "spreadsheet_id": self._pick_spreadsheet(cols, base, period),
+                 "period": period, "seq": seq, "created_at": datetime.now(JST).isoformat(timespec="seconds")}
+        self._register(entry)
+        metrics.inc("sheet_shards_created_total", {"base": base, "reason": "rows" if full else "period"})
+        return {"spreadsheet_id": entry["spreadsheet_id"], "title": entry["title"], "period": period,
+                "seq": seq, "rows": 0}
+
+    def _valid(self, cur: dict | None, period: str) -> bool:
+        return cur is not None and cur["period"] == period and cur["rows"] < self.max_rows
+
+    def target(self, base: str, header: list, now: datetime | None = None) -> tuple[str, str]:
+        """(spreadsheet_id, title)。期の切り替え・行数上限のときだけ API を呼ぶ"""
+        period = period_of(now or datetime.now(JST))
+        with self._lock:
+            cur = self._current.get(base)
+        if not self._valid(cur, period):
+            # 追記完了のコールバック（配送スレッド）が note_written で _lock を取るため、API を待つ間は _lock を持たない
+            with self._resolve_lock:
+                with self._lock:
+                    cur = self._current.get(base)
+                if not self._valid(cur, period):
+                    cur = self._resolve(base, period, len(header), cur)
+                    with self._lock:
+                        self._current[base] = cur
+        return cur["spreadsheet_id"], cur["title"]
+
+    def append_async(self, base: str, header: list, rows: list[list], priority: int = sheets_scheduler.PRIORITY_EVENT,
+                     value_input_option: str = "RAW") -> Future:
+        """現在のシャードへ追記（待たない）。書き込み先の確定に API が要るときもバックグラウンドで行う"""
+        out = Future()
+        out.set_running_or_notify_cancel()
+
+        def forward(sid: str, title: str):
+            def done(f):
+                try:
+                    resp = f.result()
+                except BaseException as e:
+                    out.set_exception(e)
+                    return
+                self.note_written(base, title, resp)
+                out.set_result(resp)
+            self._sched.append(self._json, sid, title, rows, header, priority, value_input_option).add_done_callback(done)
+
+        with self._lock:
+            cur = self._current.get(base)
+            ready = (cur["spreadsheet_id"], cur["title"]) if self._valid(cur, period_of(datetime.now(JST))) else None
+            if ready is None and self._bg is None:
+                self._bg = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sheet-shards")
+        if ready:
+            forward(*ready)
+            return out
+
+        def resolve():
+            try:
+                forward(*self.target(base, header))
+            except Exception as e:
+                out.set_exception(e)
+        self._bg.submit(resolve)
+        return out
+
+    def note_written(self, base: str, title: str, resp):
+        last = last_row_of(resp)
+        if last is None:
+            return
+        with self._lock:
+            cur = self._current.get(base)
+            if cur and cur["title"] == title:
+                cur["rows"] = max(cur["rows"], last)
+
+    def status(self) -> list[dict]:
+        with self._lock:
+            return [{"base": b, **c, "max_rows": self.max_rows} for b, c in sorted(self._current.items())]
+
+# ========= プロセス共有 =========
+_routers: dict = {}
+_routers_lock = threading.Lock()
+
+def router(scheduler, service_json: str, primary_id: str, extra_ids=(), max_rows=None, cell_budget=None) -> ShardRouter:
+    key = (hashlib.sha1(service_json.encode("utf-8")).hexdigest(), primary_id, tuple(extra_ids))
+    with _routers_lock:
+        r = _routers.get(key)
+        if r is None:
+            r = ShardRouter(scheduler, service_json, primary_id, extra_ids,
+                            int(max_rows or MAX_ROWS_PER_SHARD), int(cell_budget or CELL_BUDGET))
+            _routers[key] = r
+        return r
@@ -0,0 +1,493 @@
+# -*- coding: utf-8 -*-
+# Google Sheets API 呼び出しのスケジューラ（プロセス共有）
+# - クォータ区分（read / write）ごとのトークンバケット。既定は毎分 50 回＋バースト 5
+#   （どの 60 秒の窓でも 55 回以下 ＜ サービスアカウントの「毎分 60 回」。起動直後のシート準備が速く済む）
+# - 優先度: 回答の保存（PRIORITY_RESPONSE）> 管理画面・エクスポートの読み取り（PRIORITY_ADMIN）> イベントログ（PRIORITY_EVENT）
+# - 同じワークシートへの追記は、待っている間に溜まった分をまとめて 1 回の append_rows にする（書き込み 1 回分）
+# - 429 / 5xx / 通信エラーは Retry-After（なければ指数バックオフ＋ジッタ）だけその区分を止めて再試行
+# - 配送スレッドは 1 本（クォータが毎秒 1 回程度なので並列化しても速くならない。順序も保たれる）
+# - ワークシートのハンドルとヘッダー確認はプロセスで1回（保存ごとの get_all_values をやめる）
+# - Future のコールバックは配送スレッドで動く。コールバック内でスケジューラの結果を待たないこと（止まる）
+# - Secrets/環境変数: SHEETS_READ_RPM / SHEETS_WRITE_RPM
+#
+# 負荷の確認（偽のバックエンドで時間を縮めて実行）:
+#   python -m engine.sheets_scheduler simulate --load-per-min 600 --minutes 2 --speedup 20
+import argparse, hashlib, heapq, itertools, json, os, random, sys, threading, time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from engine import metrics
+from engine.ratelimit import TokenBucket
+
+PRIORITY_RESPONSE, PRIORITY_ADMIN, PRIORITY_EVENT = 0, 1, 2
+PRIORITY_NAMES = {PRIORITY_RESPONSE: "response", PRIORITY_ADMIN: "admin", PRIORITY_EVENT: "event"}
+QUOTA_PER_MIN = 60          # Sheets API の既定（ユーザー＝サービスアカウントあたり、read / write それぞれ）
+DEFAULT_RPM = 50
+BURST = 5                   # DEFAULT_RPM + BURST ≤ QUOTA_PER_MIN を保つ
+MAX_QUEUE = 5000
+MAX_BATCH_ROWS = 500
+MAX_ATTEMPTS = 6
+BACKOFF_BASE_SEC = 1.0
+BACKOFF_MAX_SEC = 64.0
+RETRY_STATUS = (429, 500, 502, 503, 504)
+READ_METHODS = {"get", "get_all_values", "get_all_records", "get_values", "row_values", "col_values", "batch_get",
+                "acell", "cell", "worksheets", "worksheet", "find", "findall"}
+
+metrics.describe("sheets_api_calls_total", "Sheets API 呼び出し（quota, outcome 別。outcome=throttled は 429）")
+metrics.describe("sheets_throttle_wait_seconds", "クォータ待ち（トークン・Retry-After）の時間")
+metrics.describe("sheets_queue_wait_seconds", "待ち行列に入ってから実行されるまでの時間")
+metrics.describe("sheets_rows_coalesced_total", "他の追記とまとめて書き込んだ行数")
+
+class QueueFull(Exception):
+    pass
+
+class _Op:
+    __slots__ = ("kind", "quota", "priority", "fn", "target", "rows", "header", "value_input_option",
+                 "future", "enqueued")
+
+    def __init__(self, kind, quota, priority, fn=None, target=None, rows=None, header=None, value_input_option=None):
+        self.kind, self.quota, self.priority = kind, quota, priority
+        self.fn, self.target, self.rows, self.header = fn, target, rows or [], header
+        self.value_input_option = value_input_option
+        self.future = Future()
+        self.enqueued = time.perf_counter()
+
+def _status_of(exc) -> int | None:
+    resp = getattr(exc, "response", None)
+    return getattr(resp, "status_code", None)
+
+def _retry_after(exc) -> float | None:
+    resp = getattr(exc, "response", None)
+    try:
+        v = resp.headers.get("Retry-After") if resp is not None else None
+        return float(v) if v is not None else None
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+def _retryable(exc) -> bool:
+    status = _status_of(exc)
+    if status is not None:
+        return status in RETRY_STATUS
+    # 応答のない通信エラー（接続断・タイムアウト）
+    return isinstance(exc, (ConnectionError, TimeoutError, OSError)) or type(exc).__name__ in (
+        "TransportError", "ConnectionError", "Timeout", "ReadTimeout", "ConnectTimeout")
+
+def _json_key(service_json_str: str) -> str:
+    return hashlib.sha1(service_json_str.encode("utf-8")).hexdigest()
+
+class SheetsScheduler:
+    def __init__(self, read_rpm: float = DEFAULT_RPM, write_rpm: float = DEFAULT_RPM, opener=None, sleep=time.sleep):
+        self.buckets = {"read": TokenBucket.per_minute(read_rpm, BURST),
+                        "write": TokenBucket.per_minute(write_rpm, BURST)}
+        self._opener = opener          # (service_json, spreadsheet_id) -> Spreadsheet。既定は http_pool.open_spreadsheet
+        self._sleep = sleep
+        self._heap: list = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._blocked_until = {"read": 0.0, "write": 0.0}
+        self._ws: dict = {}            # (json key, sheet id, title) -> Worksheet
+        self._thread = None
+        self.counts = {"calls": 0, "throttled": 0, "retries": 0, "errors": 0, "batches": 0,
+                       "rows": 0, "coalesced_rows": 0, "dropped": 0}
+
+    # ========= 受付 =========
+    def _push(self, op: _Op) -> Future:
+        with self._cond:
+            if len(self._heap) >= MAX_QUEUE:
+                self.counts["dropped"] += 1
+                op.future.set_exception(QueueFull(f"Sheets 待ち行列が上限（{MAX_QUEUE}件）です"))
+                return op.future
+            heapq.heappush(self._heap, (op.priority, next(self._seq), op))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="sheets-scheduler", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return op.future
+
+    def call(self, quota: str, fn, priority: int = PRIORITY_ADMIN) -> Future:
+        """API を1回呼ぶ処理 fn() を区分 quota（read / write）で実行"""
+        return self._push(_Op("call", quota, priority, fn=fn))
+
+    def run(self, quota: str, fn, priority: int = PRIORITY_ADMIN, timeout: float | None = None):
+        return self.call(quota, fn, priority).result(timeout)
+
+    def open(self, service_json: str, spreadsheet_id: str, priority: int = PRIORITY_ADMIN) -> Future:
+        """スプレッドシートのハンドル（read 1回分）"""
+        return self.call("read", lambda: self._open(service_json, spreadsheet_id), priority)
+
+    def append(self, service_json: str, spreadsheet_id: str, title: str, rows: list[list], header: list | None = None,
+               priority: int = PRIORITY_RESPONSE, value_input_option: str = "USER_ENTERED") -> Future:
+        """行の追記。シートがなければ作成し、空ならヘッダーを先頭に入れる。結果は append の API 応答。
+        セルに引数なしの関数を置くと、送り出す直前の戻り値を書き込む"""
+        target = (service_json, spreadsheet_id, title)
+        return self._push(_Op("append", "write", priority, target=target, rows=[list(r) for r in rows],
+                              header=header, value_input_option=value_input_option))
+
+    def ensure_worksheet(self, service_json: str, spreadsheet_id: str, title: str, header: list | None = None,
+                         priority: int = PRIORITY_RESPONSE) -> Future:
+        """ワークシートのハンドル取得とヘッダー確認だけ先に済ませる（初回のみ API を呼ぶ）"""
+        target = (service_json, spreadsheet_id, title)
+        return self._push(_Op("ensure", "read", priority, target=target, header=header))
+
+    def throttled(self, ws, priority: int = PRIORITY_ADMIN) -> "ThrottledWorksheet":
+        return ThrottledWorksheet(self, ws, priority)
+
+    # ========= 配送 =========
+    def _spend(self, quota: str):
+        t0 = time.perf_counter()
+        while True:
+            wait = self._blocked_until[quota] - time.time()
+            if wait <= 0:
+                break
+            self._sleep(min(wait, 1.0))
+        self.buckets[quota].acquire()
+        metrics.observe("sheets_throttle_wait_seconds", time.perf_counter() - t0, {"quota": quota},
+                        buckets=(0.01, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+
+    def _api(self, quota: str, fn, prepaid: bool = False):
+        """1回の API 呼び出し（トークン消費・429 などの再試行つき）"""
+        for attempt in range(MAX_ATTEMPTS):
+            if not prepaid or attempt:
+                self._spend(quota)
+            try:
+                result = fn()
+                self.counts["calls"] += 1
+                metrics.inc("sheets_api_calls_total", {"quota": quota, "outcome": "ok"})
+                return result
+            except Exception as e:
+                status = _status_of(e)
+                if status == 429:
+                    self.counts["throttled"] += 1
+                    metrics.inc("sheets_api_calls_total", {"quota": quota, "outcome": "throttled"})
+                if type(e).__name__ == "WorksheetNotFound":
+                    raise   # 作成へ進む通常の流れ（エラーに数えない）
+                if not _retryable(e) or attempt == MAX_ATTEMPTS - 1:
+                    self.counts["errors"] += 1
+                    metrics.inc("sheets_api_calls_total", {"quota": quota, "outcome": "error"})
+                    raise
+                delay = _retry_after(e)
+                if delay is None:
+                    delay = min(BACKOFF_MAX_SEC, BACKOFF_BASE_SEC * 2 ** attempt) * (0.5 + random.random() / 2)
+                self.counts["retries"] += 1
+                self._blocked_until[quota] = max(self._blocked_until[quota], time.time() + delay)
+
+    def _open(self, service_json: str, spreadsheet_id: str):
+        if self._opener is not None:
+            return self._opener(service_json, spreadsheet_id)
+        from engine import http_pool
+        return http_pool.open_spreadsheet(service_json, spreadsheet_id)
+
+    def _worksheet(self, target: tuple, header: list | None, prepaid: bool = False):
+        service_json, spreadsheet_id, title = target
+        key = (_json_key(service_json), spreadsheet_id, title)
+        ws = self._ws.get(key)
+        if ws is not None:
+            return ws, prepaid
+        import gspread
+        sh = self._api("read", lambda: self._open(service_json, spreadsheet_id), prepaid)
+        try:
+            ws = self._api("read", lambda: sh.worksheet(title))
+            first = self._api("read", lambda: ws.row_values(1)) if header else []
+        except gspread.WorksheetNotFound:
+            cols = max(len(header or []), 6)
+            ws = self._api("write", lambda: sh.add_worksheet(title=title, rows=1000, cols=cols))
+            first = []
+        if header and not first:
+            self._api("write", lambda: ws.append_row(list(header)))
+        elif header and len(first) < len(header) and list(header[:len(first)]) == first:
+            # 列が増えた（スキーマ変更）: 1行目を新しいヘッダーに揃え、列数も広げる（CSV の書き直しと同じ。ワークシートごとに1回）
+            if ws.col_count < len(header):
+                self._api("write", lambda: ws.add_cols(len(header) - ws.col_count))
+            self._api("write", lambda: ws.update(values=[list(header)], range_name="A1"))
+        self._ws[key] = ws
+        return ws, False
+
+    def _forget(self, target: tuple):
+        service_json, spreadsheet_id, title = target
+        self._ws.pop((_json_key(service_json), spreadsheet_id, title), None)
+        if self._opener is None:
+            from engine import http_pool
+            http_pool.forget_spreadsheet(service_json, spreadsheet_id)
+
+    def _next_batch(self, quota: str) -> list[_Op]:
+        """区分 quota の中で最優先の操作を取り出し、同じシートへの追記を合流させる。ロック内で呼ぶ。"""
+        best = min((item for item in self._heap if item[2].quota == quota), default=None)
+        if best is None:
+            return []
+        self._heap.remove(best)
+        op = best[2]
+        batch = [op]
+        if op.kind == "append":
+            n, rest = len(op.rows), []
+            for item in sorted(self._heap):
+                o = item[2]
+                if (o.kind == "append" and o.target == op.target and o.value_input_option == op.value_input_option
+                        and n + len(o.rows) <= MAX_BATCH_ROWS):
+                    batch.append(o)
+                    n += len(o.rows)
+                else:
+                    rest.append(item)
+            if len(batch) > 1:
+                self._heap = rest
+        heapq.heapify(self._heap)
+        return [o for o in batch if o.future.set_running_or_notify_cancel()]
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                quota = self._heap[0][2].quota
+            self._spend(quota)            # 待っている間に届いた追記も次の1回にまとめられる
+            with self._cond:
+                batch = self._next_batch(quota)
+            if batch:
+                try:
+                    self._execute(batch)
+                except Exception as e:
+                    print("sheets scheduler error:", e)
+
+    def _execute(self, batch: list[_Op]):
+        now = time.perf_counter()
+        for o in batch:
+            metrics.observe("sheets_queue_wait_seconds", now - o.enqueued, {"priority": PRIORITY_NAMES[o.priority]},
+                            buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0))
+        op = batch[0]
+        try:
+            if op.kind == "call":
+                op.future.set_result(self._api(op.quota, op.fn, prepaid=True))
+                return
+            ws, prepaid = self._worksheet(op.target, op.header, prepaid=True)
+            if op.kind == "ensure":
+                op.future.set_result(ws)
+                return
+            # 呼び出し可能なセルは送り出す直前に評価（例: 保存までの待ち時間 save_ms）
+            rows = [[v() if callable(v) else v for v in r] for o in batch for r in o.rows]
+            resp = self._api("write", lambda: ws.append_rows(rows, value_input_option=op.value_input_option), prepaid)
+            self.counts["batches"] += 1
+            self.counts["rows"] += len(rows)
+            if len(batch) > 1:
+                self.counts["coalesced_rows"] += len(rows) - len(op.rows)
+                metrics.inc("sheets_rows_coalesced_total", {"priority": PRIORITY_NAMES[op.priority]},
+                            len(rows) - len(op.rows))
+            for o in batch:
+                o.future.set_result(resp)   # 応答（updates.updatedRange で末尾行がわかる）
+        except Exception as e:
+            if op.target and _status_of(e) in (400, 404):
+                self._forget(op.target)   # シート削除・権限変更など。次回は開き直す
+            for o in batch:
+                if not o.future.done():
+                    o.future.set_exception(e)
+
+    # ========= 参照 =========
+    def queue_depth(self) -> dict:
+        with self._cond:
+            depth = dict.fromkeys(PRIORITY_NAMES.values(), 0)
+            for prio, _, _ in self._heap:
+                depth[PRIORITY_NAMES[prio]] += 1
+            return depth
+
+    def stats(self) -> dict:
+        now = time.time()
+        return {**self.counts, "queue": self.queue_depth(),
+                "blocked_sec": {q: round(max(0.0, t - now), 1) for q, t in self._blocked_until.items()},
+                "rpm": {q: round(b.rate * 60, 1) for q, b in self.buckets.items()}}
+
+class ThrottledWorksheet:
+    """Worksheet の代理。メソッド呼び出しをスケジューラ経由（読み取りは read、それ以外は write）で実行"""
+    def __init__(self, scheduler: SheetsScheduler, ws, priority: int = PRIORITY_ADMIN):
+        self._sched, self._ws, self._priority = scheduler, ws, priority
+
+    def __getattr__(self, name):
+        attr = getattr(self._ws, name)
+        if not callable(attr):
+            return attr
+        quota = "read" if name in READ_METHODS else "write"
+
+        def call(*args, **kwargs):
+            return self._sched.run(quota, lambda: attr(*args, **kwargs), self._priority)
+        return call
+
+# ========= プロセス既定 =========
+_default: SheetsScheduler | None = None
+_default_lock = threading.Lock()
+
+def get() -> SheetsScheduler:
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = SheetsScheduler(float(os.environ.get("SHEETS_READ_RPM") or DEFAULT_RPM),
+                                       float(os.environ.get("SHEETS_WRITE_RPM") or DEFAULT_RPM))
+            metrics.register_gauge("sheets_queue_depth",
+                                   lambda: {(("priority", p),): n for p, n in _default.queue_depth().items()})
+        return _default
+
+def configure(read_rpm=None, write_rpm=None) -> SheetsScheduler:
+    sched = get()
+    if read_rpm:
+        sched.buckets["read"].rate = float(read_rpm) / 60.0
+    if write_rpm:
+        sched.buckets["write"].rate = float(write_rpm) / 60.0
+    return sched
+
+def wait_written(fut: Future, timeout: float):
+    """追記の完了を待つ。待ち行列にいる間に timeout なら取り消して例外（呼び出し側で CSV へ）、
+    すでに実行中なら二重保存を避けるため結果が出るまで待つ"""
+    try:
+        return fut.result(timeout)
+    except FutureTimeout:
+        if fut.cancel():
+            raise
+        return fut.result()
+
+# ========= 負荷シミュレーション（偽のバックエンド） =========
+class _FakeResponse:
+    def __init__(self, status_code: int, retry_after: float | None = None):
+        self.status_code = status_code
+        self.headers = {"Retry-After": f"{retry_after:.3f}"} if retry_after is not None else {}
+
+class _FakeQuotaError(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__("429 RESOURCE_EXHAUSTED")
+        self.response = _FakeResponse(429, retry_after)
+
+class _FakeQuota:
+    """区分ごとに window 秒あたり limit 回まで（超えたら 429）"""
+    def __init__(self, limit: int, window: float):
+        self.limit, self.window = limit, window
+        self.calls = {"read": [], "write": []}
+        self.rejected = {"read": 0, "write": 0}
+        self.lock = threading.Lock()
+
+    def hit(self, quota: str):
+        now = time.monotonic()
+        with self.lock:
+            calls = [t for t in self.calls[quota] if now - t < self.window]
+            if len(calls) >= self.limit:
+                self.calls[quota] = calls
+                self.rejected[quota] += 1
+                raise _FakeQuotaError(self.window - (now - calls[0]))
+            calls.append(now)
+            self.calls[quota] = calls
+
+class _FakeWorksheet:
+    def __init__(self, quota: _FakeQuota, title: str = "", cols: int = 6):
+        self.quota, self.rows, self.title, self.col_count = quota, [], title, cols
+
+    def get_all_values(self):
+        self.quota.hit("read")
+        return [list(r) for r in self.rows]
+
+    def row_values(self, i):
+        self.quota.hit("read")
+        return self.rows[i - 1] if len(self.rows) >= i else []
+
+    @property
+    def row_count(self):
+        return max(1000, len(self.rows))
+
+    def get(self, range_name):
+        # "A{a}:{列}{b}" の行範囲だけを模す（末尾の空行は返さない）
+        self.quota.hit("read")
+        a, b = (int("".join(ch for ch in part if ch.isdigit())) for part in range_name.split(":"))
+        vals = [list(r) for r in self.rows[a - 1:b]]
+        while vals and not any(vals[-1]):
+            vals.pop()
+        return vals
+
+    def append_row(self, row, **kwargs):
+        self.quota.hit("write")
+        self.rows.append(list(row))
+
+    def add_cols(self, n):
+        self.quota.hit("write")
+        self.col_count += n
+
+    def update(self, values, range_name="A1", **kwargs):
+        self.quota.hit("write")
+        self.rows[0] = list(values[0])   # 1行目の書き換えだけを模す
+
+    def append_rows(self, rows, **kwargs):
+        self.quota.hit("write")
+        first = len(self.rows) + 1
+        self.rows.extend(list(r) for r in rows)
+        return {"updates": {"updatedRange": f"'{self.title}'!A{first}:C{len(self.rows)}", "updatedRows": len(rows)}}
+
+class _FakeSpreadsheet:
+    def __init__(self, quota: _FakeQuota):
+        self.quota, self.sheets = quota, {}
+
+    def worksheet(self, title):
+        import gspread
+        self.quota.hit("read")
+        if title not in self.sheets:
+            raise gspread.WorksheetNotFound(title)
+        return self.sheets[title]
+
+    def add_worksheet(self, title, rows, cols):
+        self.quota.hit("write")
+        return self.sheets.setdefault(title, _FakeWorksheet(self.quota, title, cols))
+
+    def fetch_sheet_metadata(self):
+        self.quota.hit("read")
+        return {"sheets": [{"properties": {"title": t, "gridProperties": {
+            "rowCount": max(1000, len(ws.rows)), "columnCount": ws.col_count}}} for t, ws in self.sheets.items()]}
+
+def simulate(load_per_min: float, minutes: float, speedup: float = 20.0, events_per_submit: float = 1.0,
+             scheduled: bool = True, seed: int = 0) -> dict:
+    """load_per_min 件/分の回答（＋イベント）を minutes 分間流し、429 の数と待ち時間を数える。
+    時間は speedup 倍に縮める（クォータの窓も同じ比率で縮めるので結果は実時間と同じ）"""
+    window = 60.0 / speedup
+    quota = _FakeQuota(QUOTA_PER_MIN, window)
+    sh = _FakeSpreadsheet(quota)
+    rng = random.Random(seed)
+    header = ["timestamp", "company", "theme"]
+    sched = SheetsScheduler(DEFAULT_RPM * speedup, DEFAULT_RPM * speedup, opener=lambda *_: sh)
+    futures, direct_errors = [], 0
+    interval = 60.0 / load_per_min / speedup
+    n = int(load_per_min * minutes)
+    t0 = time.perf_counter()
+    for i in range(n):
+        row = [f"t{i}", f"company{i}", "factory"]
+        if scheduled:
+            futures.append(sched.append("{}", "sim", "responses_factory", [row], header, PRIORITY_RESPONSE))
+            if rng.random() < events_per_submit:
+                futures.append(sched.append("{}", "sim", "events", [[f"t{i}", "WARN", "sim"]], None, PRIORITY_EVENT))
+        else:
+            # スケジューラなし: 1件ごとに worksheet + ヘッダー確認 + append_row（429 は CSV 行き）
+            try:
+                ws = sh.sheets.get("responses_factory") or sh.add_worksheet("responses_factory", 1000, 6)
+                ws.row_values(1)
+                ws.append_row(row)
+            except _FakeQuotaError:
+                direct_errors += 1
+        delay = t0 + (i + 1) * interval - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    for f in futures:
+        f.result(timeout=600)
+    drain_sec = (time.perf_counter() - t0) * speedup - minutes * 60
+    written = len(sh.sheets["responses_factory"].rows) if "responses_factory" in sh.sheets else 0
+    result = {"mode": "scheduled" if scheduled else "direct", "load_per_min": load_per_min, "minutes": minutes,
+              "submitted": n, "responses_rows_written": max(0, written - (1 if scheduled else 0)),
+              "quota_errors_429": sum(quota.rejected.values()) if scheduled else direct_errors,
+              "drain_after_load_sec": round(max(0.0, drain_sec), 1)}
+    if scheduled:
+        result.update({k: sched.counts[k] for k in ("calls", "batches", "rows", "coalesced_rows", "retries")})
+    return result
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m engine.sheets_scheduler", description="Sheets スケジューラの負荷確認")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    s = sub.add_parser("simulate")
+    s.add_argument("--load-per-min", type=float, default=600, help="回答の件数/分")
+    s.add_argument("--minutes", type=float, default=2)
+    s.add_argument("--speedup", type=float, default=20)
+    s.add_argument("--events-per-submit", type=float, default=1.0)
+    s.add_argument("--direct", action="store_true", help="スケジューラなし（現状相当）で実行")
+    args = ap.parse_args(argv)
+    result = simulate(args.load_per_min, args.minutes, args.speedup, args.events_per_submit, not args.direct)
+    print(json.dumps(result, ensure_ascii=False))
+    return 0 if result["quota_errors_429"] == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
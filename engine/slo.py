@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+# 結果画面の待ち時間の予算（SLO）と段階的な縮退
+# - 全体の予算: 送信から「AIコメントと PDF が揃う」まで（RESULTS_SLO_SEC、既定 2.5 秒）
+# - ステージごとの予算（SLO_AI_SEC / SLO_PDF_SEC / SLO_SAVE_SEC）。実際に待つのは
+#   「ステージの予算」と「全体の期限までの残り」の短いほう（engine/pipeline.py の deadline）
+# - 予算を超えたときの縮退（保存行の degraded 列・メトリクス slo_degradations_total に記録）
+#     ai_static     : AIコメントを待たず静的コメント（TYPE_TEXT）で確定
+#     pdf_lite      : 通常版 PDF が間に合わなければ軽量版（棒グラフなし）を配布
+#     save_deferred : 保存が予算内に送り出せなければ保存待ち行列に任せ、パイプラインは先へ進む
+#     ai_shed       : 同時実行の枠（engine/admission.py）が予算内に空かない見込みで AI を呼ばずに静的コメント
+#   打ち切ったステージのスレッドは止めない（遅れて届いた AIコメントは共有キャッシュに入り、同じ内容の次回に効く）
+# - RESULTS_SLO_SEC=0 で予算なし（従来の *_STAGE_TIMEOUT_SEC だけで打ち切る。縮退の記録は同じ）
+import os, threading
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from engine import metrics
+
+DEFAULT_TOTAL_SEC = 2.5
+DEFAULT_BUDGETS = {"ai": 2.0, "pdf": 1.0, "save": 1.0}
+ACTIONS = ("ai_static", "pdf_lite", "save_deferred", "ai_shed")
+DEFERRED_WORKERS = 2     # 保存待ち行列を処理するスレッド数（Sheets の待ちは engine/sheets_scheduler.py 側で制御）
+WINDOW = 200             # 管理画面の達成率を見る直近の件数
+
+metrics.describe("slo_results_total", "送信後の結果（AIコメント・PDF）が全体の予算内に揃ったか（met=yes / no）")
+metrics.describe("slo_degradations_total", "予算超過で取った縮退（action=ai_static / pdf_lite / save_deferred / ai_shed）")
+metrics.describe("slo_deferred_saves", "保存待ち行列にある件数")
+
+class Degradations:
+    """1件の送信で取った縮退。ステージのスレッドから追加し、保存行の degraded 列で読む"""
+    def __init__(self):
+        self._actions: set = set()
+        self._lock = threading.Lock()
+
+    def add(self, action: str):
+        with self._lock:
+            self._actions.add(action)
+
+    def __contains__(self, action: str) -> bool:
+        with self._lock:
+            return action in self._actions
+
+    def items(self) -> list[str]:
+        with self._lock:
+            return [a for a in ACTIONS if a in self._actions]
+
+    def __str__(self) -> str:
+        return ";".join(self.items())
+
+class Controller:
+    def __init__(self, total_sec: float = DEFAULT_TOTAL_SEC, budgets: dict | None = None,
+                 deferred_workers: int = DEFERRED_WORKERS):
+        self.total_sec = float(total_sec)
+        self.budgets = {**DEFAULT_BUDGETS, **{k: float(v) for k, v in (budgets or {}).items()}}
+        self._deferred = ThreadPoolExecutor(max_workers=deferred_workers, thread_name_prefix="deferred-save")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._recent: deque = deque(maxlen=WINDOW)   # (ready_ms, met, 縮退のタプル)
+
+    @property
+    def enabled(self) -> bool:
+        return self.total_sec > 0
+
+    def deadline(self, t0: float | None) -> float | None:
+        """全体の期限（time.perf_counter() の絶対時刻）。予算なし・起点なしなら None"""
+        return t0 + self.total_sec if self.enabled and t0 is not None else None
+
+    def timeout(self, stage: str, fallback: float) -> float:
+        """ステージを打ち切る秒数（予算なしなら従来の値）"""
+        return min(self.budgets[stage], fallback) if self.enabled else fallback
+
+    def degrade(self, degradations: Degradations, action: str, theme: str = ""):
+        if action not in degradations:
+            degradations.add(action)
+            metrics.inc("slo_degradations_total", {"theme": theme, "action": action})
+
+    # ========= 保存待ち行列 =========
+    def defer(self, fn, *args) -> Future:
+        """fn(*args) を保存待ち行列で実行。呼び出し側は予算だけ待ち、間に合わなければそのまま任せる"""
+        with self._lock:
+            self._pending += 1
+
+        def run():
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self._pending -= 1
+        return self._deferred.submit(run)
+
+    def pending(self) -> int:
+        with self._lock:
+            return self._pending
+
+    # ========= 記録 =========
+    def record(self, theme: str, ready_ms, degradations: Degradations):
+        """送信1件の結果。ready_ms（int、未計測は ""）が全体の予算内か"""
+        met = None
+        if self.enabled and ready_ms != "":
+            met = ready_ms <= self.total_sec * 1000.0
+            metrics.inc("slo_results_total", {"theme": theme, "met": "yes" if met else "no"})
+        with self._lock:
+            self._recent.append((ready_ms, met, tuple(degradations.items())))
+
+    def status(self) -> dict:
+        with self._lock:
+            recent = list(self._recent)
+            pending = self._pending
+        judged = [m for _, m, _ in recent if m is not None]
+        actions = Counter(a for _, _, acts in recent for a in acts)
+        return {
+            "enabled": self.enabled, "total_sec": self.total_sec, "budgets": dict(self.budgets),
+            "recent": len(recent),
+            "met_rate": round(sum(judged) / len(judged), 3) if judged else None,
+            "degraded_rate": round(sum(1 for _, _, acts in recent if acts) / len(recent), 3) if recent else None,
+            "actions": {a: actions.get(a, 0) for a in ACTIONS},
+            "deferred_pending": pending,
+        }
+
+# ========= プロセス共有 =========
+_default: Controller | None = None
+_default_lock = threading.Lock()
+
+def get() -> Controller:
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = Controller(float(os.environ.get("RESULTS_SLO_SEC") or DEFAULT_TOTAL_SEC))
+            metrics.register_gauge("slo_deferred_saves", lambda: _default.pending())
+        return _default
+
+def configure(total_sec=None, ai_sec=None, pdf_sec=None, save_sec=None) -> Controller:
+    """Secrets の値で上書き（None・空欄は既定のまま。total_sec=0 で予算なし）"""
+    ctl = get()
+    if total_sec not in (None, ""):
+        ctl.total_sec = float(total_sec)
+    for stage, v in (("ai", ai_sec), ("pdf", pdf_sec), ("save", save_sec)):
+        if v not in (None, ""):
+            ctl.budgets[stage] = float(v)
+    return ctl
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+# ソークテスト（メモリ・ファイル記述子・一時ファイルのリーク検出）
+# - 採点 → グラフ仕様 → AIプロンプト → PDF 生成 → PDFキャッシュ → ロールアップ更新 を Streamlit なしで繰り返す
+#   （AIコメントは静的コメントで代用。外部API・Sheets には接続しない）
+# - 回答は --variants 通りの組を巡回（上限付きキャッシュがウォームアップ中に飽和するように）
+# - tracemalloc はウォームアップ後に開始し、一定間隔で使用量・RSS・開いている fd 数・一時ファイル数を記録
+#   一時ファイルは一時ディレクトリ直下とフォントサブセットのキャッシュを数える（他プロセスのサブディレクトリは見ない）
+# - 基準点（ウォームアップ＋1間隔。上限付きキャッシュの入れ替わりを除くため）から最後までの増加が
+#   許容値を超えたら失敗（終了コード 1）し、増加の大きい割り当て箇所（ファイル:行）と新しい一時ファイルを表示する
+#
+# 使い方:
+#   python -m engine.soak --iterations 2000
+#   python -m engine.soak --iterations 300 --interval 50 --warmup 50 --heap-tolerance-kb 512
+import argparse, gc, json, os, random, shutil, sys, tempfile, time, tracemalloc
+
+from engine import fonts, headless, report, results_view, rollups, session_mem
+
+# 第1水準外の文字を含む会社名（文書用フォントサブセットの生成・破棄も通す）
+COMPANIES = ["株式会社テスト製作所", "有限会社サンプル商事", "合同会社ABC", "株式会社鐵工", "髙橋建設株式会社", ""]
+
+def _rss_kb() -> int | None:
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def _fd_count() -> int | None:
+    for d in ("/proc/self/fd", "/dev/fd"):
+        try:
+            return len(os.listdir(d))
+        except OSError:
+            continue
+    return None
+
+def _tmp_names(exclude: str) -> set[str]:
+    names = set()
+    for d in (tempfile.gettempdir(), fonts.SUBSET_CACHE_DIR, fonts.dynamic_dir()):
+        try:
+            names.update(os.path.join(d, n) for n in os.listdir(d))
+        except OSError:
+            continue
+    names.discard(exclude)
+    return names
+
+def snapshot(i: int, scratch: str) -> tuple[dict, set[str]]:
+    gc.collect()
+    cur, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+    tmp = _tmp_names(scratch)
+    return {"iteration": i, "heap_kb": cur // 1024, "heap_peak_kb": peak // 1024,
+            "rss_kb": _rss_kb(), "fds": _fd_count(), "tmp_entries": len(tmp)}, tmp
+
+def one_diagnosis(i: int, rng: random.Random, themes: list[str], rollup_path: str):
+    theme_key = themes[i % len(themes)]
+    company = COMPANIES[i % len(COMPANIES)]
+    res = headless.run_theme(theme_key, rng=rng, company=company, email="soak@example.com")
+    mod, df = res["module"], res["df"]
+    key = results_view.score_key(df)
+    results_view.chart_spec(key)
+    mod.build_ai_prompt(res["company"], res["main_type"], df, res["overall_avg"])
+    payload = {"company": res["company"], "email": res["email"], "dt": "2000-01-01 00:00",
+               "signal": res["signal"][0], "main_type": res["main_type"],
+               "comment": mod.TYPE_TEXT[res["main_type"]]}
+    pdf = report.make_pdf_bytes(payload, df)
+    session_mem.artifacts.put(session_mem.artifact_key("soak", i), pdf)
+    rollups.record_submission({"theme": theme_key, "report_date": "2000-01-01",
+                               "total_score": f"{res['overall_avg']:.2f}", "type_label": res["main_type"]},
+                              signal=res["signal"][0], path=rollup_path)
+
+def run(iterations: int = 2000, interval: int = 250, warmup: int = 200, seed: int = 0, variants: int = 64,
+        heap_tolerance_kb: int = 1024, fd_tolerance: int = 2, tmp_tolerance: int = 0,
+        artifact_budget_mb: float = 2.0, top: int = 15, frames: int = 1, log=print) -> dict:
+    scratch = os.path.abspath(tempfile.mkdtemp(prefix="vc_soak_"))
+    rollup_path = os.path.join(scratch, "rollups.json")
+    # 上限付きキャッシュはウォームアップ中に上限まで埋まるよう小さくしておく
+    session_mem.artifacts.max_bytes = int(artifact_budget_mb * 1024 * 1024)
+    themes = headless.theme_keys()
+    report.setup_japanese_font()
+
+    samples, base, base_snap, base_tmp = [], None, None, set()
+    t0 = time.perf_counter()
+    try:
+        for i in range(1, iterations + 1):
+            one_diagnosis(i, random.Random(seed * 1_000_003 + i % variants), themes, rollup_path)
+            if i == warmup:
+                tracemalloc.start(frames)
+            if i >= warmup and ((i - warmup) % interval == 0 or i == iterations):
+                s, tmp = snapshot(i, scratch)
+                s["elapsed_sec"] = round(time.perf_counter() - t0, 1)
+                samples.append(s)
+                log(json.dumps(s))
+                if base is None and i >= warmup + interval:
+                    base, base_snap, base_tmp = s, tracemalloc.take_snapshot(), tmp
+        end_snap = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+        shutil.rmtree(scratch, ignore_errors=True)
+        rollups.reload(rollup_path)
+
+    last = samples[-1]
+    growth = {
+        "heap_kb": last["heap_kb"] - base["heap_kb"],
+        "rss_kb": (last["rss_kb"] - base["rss_kb"]) if last["rss_kb"] and base["rss_kb"] else None,
+        "fds": (last["fds"] - base["fds"]) if last["fds"] is not None and base["fds"] is not None else 0,
+        "tmp_entries": last["tmp_entries"] - base["tmp_entries"],
+    }
+    failures = []
+    if growth["heap_kb"] > heap_tolerance_kb:
+        failures.append(f"heap +{growth['heap_kb']} KB > {heap_tolerance_kb} KB")
+    if growth["fds"] > fd_tolerance:
+        failures.append(f"fds +{growth['fds']} > {fd_tolerance}")
+    if growth["tmp_entries"] > tmp_tolerance:
+        new = sorted(tmp - base_tmp)[:10]
+        failures.append(f"tmp entries +{growth['tmp_entries']} > {tmp_tolerance}: {', '.join(new)}")
+
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap>")]
+    diffs = end_snap.filter_traces(filters).compare_to(base_snap.filter_traces(filters), "lineno")
+    top_sites = [{"site": str(d.traceback), "size_diff_kb": round(d.size_diff / 1024, 1), "count_diff": d.count_diff}
+                 for d in diffs[:top]]
+    return {"ok": not failures, "failures": failures, "growth": growth,
+            "iterations": iterations, "samples": samples, "top_sites": top_sites}
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m engine.soak", description="メモリ/fd/一時ファイルのリーク検出")
+    ap.add_argument("--iterations", type=int, default=2000)
+    ap.add_argument("--interval", type=int, default=250, help="計測間隔（回）")
+    ap.add_argument("--warmup", type=int, default=200, help="基準点を取るまでの回数（キャッシュの充填）")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--variants", type=int, default=64, help="回答パターン数")
+    ap.add_argument("--heap-tolerance-kb", type=int, default=1024)
+    ap.add_argument("--fd-tolerance", type=int, default=2)
+    ap.add_argument("--tmp-tolerance", type=int, default=0)
+    ap.add_argument("--artifact-budget-mb", type=float, default=2.0)
+    ap.add_argument("--top", type=int, default=15, help="表示する割り当て箇所の数")
+    args = ap.parse_args(argv)
+    if args.iterations < args.warmup + 2 * args.interval:
+        ap.error("--iterations は --warmup + 2×--interval 以上にしてください")
+
+    result = run(args.iterations, args.interval, args.warmup, args.seed, args.variants, args.heap_tolerance_kb,
+                 args.fd_tolerance, args.tmp_tolerance, args.artifact_budget_mb, args.top)
+    print(json.dumps({"ok": result["ok"], "failures": result["failures"], "growth": result["growth"]},
+                     ensure_ascii=False))
+    print("# top allocation sites (growth since warm-up)")
+    for s in result["top_sites"]:
+        print(f"{s['size_diff_kb']:>10.1f} KB  {s['count_diff']:>+7d}  {s['site']}")
+    return 0 if result["ok"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
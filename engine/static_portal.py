@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# 静的ポータルのビルド（Streamlit ランタイム不要）
+# - ヒーロー・サブタイトル・「Victor Consulting について」・カードを engine/portal.py と同じ定義/CSSで HTML 化
+# - カードは <アプリURL>?theme=… へ直接リンク。UTM はクライアント側（JS）でリンクに引き継ぐ
+# - 出力は index.html / portal.css / ロゴ画像のみ。任意の静的ファイルサーバ・CDN で配信可能
+#
+# 使い方:
+#   python -m engine.static_portal --app-url https://<your-app>.streamlit.app/ --out dist/portal
+#   python -m http.server -d dist/portal 8080   # ローカル確認
+import argparse, os, re, shutil, sys
+from html import escape
+
+from engine import portal
+
+LOGO_FILE = "assets/CImark.png"
+
+# Streamlit の centered レイアウト相当の外枠だけを追加（見た目は portal.css_source と共通）
+_SHELL_CSS = """
+*{box-sizing:border-box}
+body{margin:0;background:%(bg)s;color:#000;
+  font-family:"Source Sans Pro","Hiragino Kaku Gothic ProN","Noto Sans JP",Meiryo,sans-serif;line-height:1.6}
+.page{max-width:736px;margin:0 auto;padding:2.8rem 1rem 3rem}
+.brand{display:flex;align-items:center;gap:.6rem}
+.brand img{width:150px;height:auto}
+.brand-notes{color:#555;font-size:.9rem;margin:.4rem 0 0;padding-left:1.1rem}
+details.about{background:#fff;border:1px solid rgba(49,51,63,.2);border-radius:.5rem;padding:.5rem 1rem;margin:1rem 0}
+details.about summary{cursor:pointer;font-weight:600}
+footer{color:#666;font-size:.85rem;text-align:center;margin-top:2rem}
+"""
+
+# UTM をカードのリンクへ引き継ぐ（サーバー処理なし）
+_UTM_JS = """
+(function(){
+  var p=new URLSearchParams(window.location.search),keep=%(keys)s;
+  document.querySelectorAll("a[data-theme]").forEach(function(a){
+    var u=new URL(a.getAttribute("href"),window.location.href);
+    keep.forEach(function(k){var v=p.get(k);if(v){u.searchParams.set(k,v);}});
+    a.setAttribute("href",u.toString());
+  });
+})();
+"""
+
+def md_to_html(md: str) -> str:
+    """PORTAL_ABOUT_MD 程度の Markdown（段落・**太字**・箇条書き・行末2スペース改行）を HTML 化。"""
+    def inline(t: str) -> str:
+        t = escape(t, quote=False)
+        return re.sub(r"\*\*(.+?)\*\*", r"<strong>\1</strong>", t)
+
+    blocks = [b for b in re.split(r"\n\s*\n", md.strip("\n")) if b.strip()]
+    out = []
+    for b in blocks:
+        lines = b.split("\n")
+        if all(l.lstrip().startswith("- ") for l in lines):
+            items = "".join(f"<li>{inline(l.lstrip()[2:].rstrip())}</li>" for l in lines)
+            out.append(f"<ul>{items}</ul>")
+        else:
+            parts = [inline(l.rstrip()) + ("<br/>" if l.endswith("  ") else "") for l in lines]
+            out.append("<p>" + "\n".join(parts) + "</p>")
+    return "\n".join(out)
+
+def _card_links(app_url: str) -> str:
+    html = portal.cards_grid_html(())
+    # テーマへのリンクをアプリURL基準の絶対URLにし、JS で UTM を付与できるよう data-theme を付ける
+    def _fix(m):
+        key = m.group(1)
+        return f'<a class="portal-card-link" data-theme="{escape(key)}" href="{escape(app_url)}?theme={escape(key)}"'
+    return re.sub(r'<a class="portal-card-link" href="\?theme=([^"&]+)"', _fix, html)
+
+def render_index(app_url: str, logo_name: str | None) -> str:
+    logo = f'<img src="{logo_name}" alt="Victor Consulting"/>' if logo_name else ""
+    keys = "[" + ",".join(f'"{k}"' for k in portal.UTM_KEYS) + "]"
+    return f"""<!doctype html>
+<html lang="ja">
+<head>
+<meta charset="utf-8"/>
+<meta name="viewport" content="width=device-width,initial-scale=1"/>
+<title>{escape(portal.PORTAL_TITLE)}</title>
+<meta name="description" content="{escape(portal.PORTAL_LEAD)}"/>
+<link rel="stylesheet" href="portal.css"/>
+</head>
+<body>
+<div class="page">
+<header class="brand">{logo}</header>
+<ul class="brand-notes"><li>3分・無料・数値非公開</li><li>PDF出力・AIコメント</li></ul>
+{portal.PORTAL_HERO_HTML}
+{portal.PORTAL_SUBTITLE_HTML}
+<details class="about">
+<summary>{escape(portal.PORTAL_ABOUT_TITLE)}</summary>
+{md_to_html(portal.PORTAL_ABOUT_MD)}
+</details>
+{_card_links(app_url)}
+<footer>© Victor Consulting</footer>
+</div>
+<script>{_UTM_JS % {"keys": keys}}</script>
+</body>
+</html>
+"""
+
+def build(out_dir: str, app_url: str, logo_path: str | None = LOGO_FILE) -> list[str]:
+    os.makedirs(out_dir, exist_ok=True)
+    written = []
+    logo_name = None
+    if logo_path and os.path.exists(logo_path):
+        logo_name = os.path.basename(logo_path)
+        shutil.copyfile(logo_path, os.path.join(out_dir, logo_name))
+        written.append(logo_name)
+
+    css = portal.minify_css(_SHELL_CSS % {"bg": portal.BRAND_BG} + portal.css_source(portal.BRAND_BG))
+    for name, body in (("portal.css", css), ("index.html", render_index(app_url, logo_name))):
+        tmp = os.path.join(out_dir, f".{name}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(body)
+        os.replace(tmp, os.path.join(out_dir, name))
+        written.append(name)
+    return written
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m engine.static_portal", description="静的ポータル（HTML/CSS）のビルド")
+    ap.add_argument("--app-url", default=os.environ.get("APP_URL", "/"),
+                    help="診断アプリ（Streamlit）のURL。カードは <app-url>?theme=… へリンク")
+    ap.add_argument("--out", default="dist/portal")
+    ap.add_argument("--logo", default=LOGO_FILE)
+    args = ap.parse_args(argv)
+    files = build(args.out, args.app_url, args.logo)
+    print(f"built {len(files)} files into {args.out}: {', '.join(files)}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
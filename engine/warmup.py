@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# プロセス起動時のウォームアップ
+# - 重いモジュールの import、日本語TTFの登録、matplotlib のフォントキャッシュ構築、
+#   ReportLab の初期化を、ダミーのレポートを1枚作ることでまとめて済ませる
+# - 任意で Google Sheets の認証（トークン取得・スプレッドシートを開く）まで先に行う
+# - engine/serve.py から Streamlit サーバ起動前に呼ぶ（ヘルスチェックが応答する前に完了）
+#
+# 使い方（単体で所要時間を確認）:
+#   python -m engine.warmup [--sheets]
+import base64, importlib, json, os, sys, time
+
+HEAVY_MODULES = (
+    "pandas", "altair", "matplotlib.backends.backend_agg", "reportlab.platypus",
+    "PIL.Image", "qrcode", "gspread", "google.oauth2.service_account", "openai",
+)
+
+_ready = False
+_timings: dict = {}
+
+def is_ready() -> bool:
+    return _ready
+
+def timings() -> dict:
+    return dict(_timings)
+
+def _env_secret(key: str, default=None):
+    return os.environ.get(key, default)
+
+def _timed(name: str, fn):
+    t0 = time.perf_counter()
+    try:
+        fn()
+        _timings[name] = round((time.perf_counter() - t0) * 1000, 1)
+    except Exception as e:
+        _timings[name] = f"error: {e}"
+
+def synthetic_scores():
+    import pandas as pd
+    return pd.DataFrame({
+        "カテゴリ": ["在庫・運搬", "人材・技能承継", "原価意識・改善文化", "生産計画・変動対応", "DX・情報共有"],
+        "平均スコア": [3.0, 2.5, 4.0, 3.5, 2.0],
+    })
+
+def _import_heavy():
+    for name in HEAVY_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass  # openai 等の任意依存
+
+def _dummy_report():
+    from engine import report
+    result = {"company": "ウォームアップ", "email": "", "dt": "2000-01-01 00:00",
+              "signal": "黄信号", "main_type": "バランス良好型", "comment": "ウォームアップ用のダミーコメントです。"}
+    report.make_pdf_bytes(result, synthetic_scores())
+
+def _sheets_auth(secret_getter):
+    service_json = secret_getter("GOOGLE_SERVICE_JSON", None)
+    if not service_json and secret_getter("GOOGLE_SERVICE_JSON_BASE64", None):
+        service_json = base64.b64decode(secret_getter("GOOGLE_SERVICE_JSON_BASE64")).decode("utf-8")
+    sheet_id = secret_getter("SPREADSHEET_ID", None)
+    if not (service_json and sheet_id):
+        return
+    # 共有クライアントで開いておく（トークン・接続・シートのハンドルがそのまま最初の保存で使われる）
+    from engine import http_pool, sheets_scheduler
+    sheets_scheduler.get().run("read", lambda: http_pool.open_spreadsheet(service_json, sheet_id))
+
+def warm_up(sheets: bool = False, secret_getter=_env_secret) -> dict:
+    """各段階の所要時間(ms)を返す。失敗した段階は 'error: …' として記録し、起動は止めない。"""
+    global _ready
+    t0 = time.perf_counter()
+    _timed("imports", _import_heavy)
+    from engine import report
+    _timed("japanese_font", report.setup_japanese_font)
+    _timed("dummy_report", _dummy_report)
+    if sheets:
+        _timed("sheets_auth", lambda: _sheets_auth(secret_getter))
+    _timings["total"] = round((time.perf_counter() - t0) * 1000, 1)
+    _ready = True
+    return timings()
+
+def main(argv=None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    print(json.dumps(warm_up(sheets="--sheets" in argv), ensure_ascii=False))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
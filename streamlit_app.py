@@ -3,98 +3,47 @@
 # - 会社名/メール必須、UTM取得、AIコメント自動生成、PDF 1ページ、JST
 # - Google Sheets 自動保存（なければ CSV）
 # - サイレント保存、二重書き込み防止（saved_once & dedup_key）
-# - 管理者モード（?admin=1 または Secrets: ADMIN_MODE="1"）でイベント確認
+# - 送信後は AIコメント・PDF・保存を依存関係つきで並行実行（engine/pipeline.py）。待ち時間の予算を超えたら縮退（engine/slo.py）
+# - AI・PDF の生成はプロセス全体で同時実行数を制限し、セッション間で公平に順番待ち（engine/admission.py）
+# - 管理者モード（?admin=1 または Secrets: ADMIN_MODE="1"）でイベント確認、&profile=1 / &profile=sample / &profile=cprofile でプロファイル取得
 # - テーマ切替 (?theme=factory など)
-# - テーマごとに保存シートは responses_{theme}
+# - テーマごとに保存シートは responses_{theme}（四半期・行数上限で responses_{theme}_2026Q4 などに分割）
+# - 計測/メトリクス（Secrets: PERF_TIMING / METRICS_PORT / METRICS_FILE、Prometheus テキスト形式）
+# - 起動は python -m engine.serve 推奨（フォント/ReportLab/重いimportをウォームアップしてから Streamlit を起動）
 
-import os, io, re, json, time, base64, tempfile, importlib, importlib.util
+import os, re, json, time, base64, importlib, importlib.util
+_T_SCRIPT0 = time.perf_counter()  # ステージ計測：スクリプト開始時刻
+from concurrent.futures import TimeoutError as FutureTimeout
 from datetime import datetime, timedelta, timezone
 from typing import Tuple
 
 import streamlit as st
+from streamlit import runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import pandas as pd
-import altair as alt
-import matplotlib.pyplot as plt
-
-# PDF
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.platypus import (
-    SimpleDocTemplate, Paragraph, Spacer, Image, Table, TableStyle
-)
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.pdfbase.pdfmetrics import registerFontFamily
-
-# Fonts/Images
-from matplotlib import font_manager
-from PIL import Image as PILImage
-import qrcode
-import requests
-
-# Google Sheets
+
+# Google Sheets（認証済みクライアントは engine/http_pool.py で共有、API 呼び出しは engine/sheets_scheduler.py 経由）
 import gspread
-from google.oauth2.service_account import Credentials
+
+# エンジン（計測・ログ・集計・スキーマ）
+from engine import perf, metrics
+from engine.profiling import SessionProfiler, DEFAULT_MODE as DEFAULT_PROFILE_MODE
+from engine import event_store, rollups, archive
+from engine.schema import COMMON_HEADER_ORDER  # 共通ヘッダー
+from engine import portal, results_view, session_mem, shared_cache, ai, pipeline, http_pool, sheets_scheduler
+from engine import sheet_shards, latency_report, slo, admission
+# レポート描画（PDF/図/QR/ロゴ/フォント）
+from engine.report import setup_japanese_font, path_or_download_logo, make_pdf_bytes
+_T_IMPORTS = time.perf_counter()
 
 # ========= ブランド & 定数 =========
-BRAND_BG   = "#f0f7f7"
-LOGO_LOCAL = "assets/CImark.png"
-LOGO_URL   = "https://victorconsulting.jp/wp-content/uploads/2025/10/CImark.png"
-CTA_URL    = "https://victorconsulting.jp/spot-diagnosis/"
-OPENAI_MODEL = "gpt-4o-mini"
+BRAND_BG   = portal.BRAND_BG
+OPENAI_MODEL = ai.OPENAI_MODEL
 APP_VERSION  = "engine-v1.0.0"
 
 # ========= ポータル（ブランドページ）設定 =========
-PORTAL_TITLE = "3分診断ポータル｜Victor Consulting"
-PORTAL_HERO  = "会社の “ボトルネック” を、3分で見える化"
-PORTAL_LEAD  = "機密数値は不要。Yes/Noや2〜3段階の簡易回答だけで、“次の一手”まで示します。"
-
-# カード定義（順番＝表示順）
-DIAG_MENU = [
-    {
-        "key": "factory",
-        "emoji": "🏭",
-        "title": "現場のムダ・停滞ポイント診断",
-        "lead": "工程・段取り・仕掛・在庫の“ボトルネック”を明確化し、流れを良くする改善点を特定します",
-        "available": True,
-    },
-    {
-        "key": "cashflow",
-        "emoji": "💴",
-        "title": "資金繰りのボトルネック診断",
-        "lead": "入金・在庫・回収・支払など、お金の動きを止める“資金ボトルネック”を3分で抽出します",
-        "available": True,
-    },
-    {
-        "key": "succession",
-        "emoji": "🧭",
-        "title": "事業承継リスク診断",
-        "lead":  "後継者・資本・ガバナンス・関係者・ライフ設計の視点から“承継のリスク要因”を見える化します",
-        "available": True,
-    },
-    {
-        "key": "retention",
-        "emoji": "👥",
-        "title": "人材定着リスク診断",
-        "lead":  "採用・評価・育成・働き方・職場風土から、“離職につながる要因”を早期に発見します",
-        "available": True,
-    },
-    {
-        "key": "productivity_office",
-        "emoji": "🗂️",
-        "title": "オフィス生産性の停滞ポイント診断",
-        "lead":  "会議・情報共有・IT活用・時間配分の乱れから、“生産性を下げる要因”を見える化します",
-        "available": True,
-    },
-    {
-        "key": "sales",
-        "emoji": "📈",
-        "title": "営業活動のボトルネック診断",
-        "lead":  "見込み客づくり・商談・受注・リピートの流れを整理し、営業活動の“停滞ポイント”を特定します",
-        "available": True,
-    },
-]
+# カード定義・文言・CSS は engine/portal.py（静的版ポータルと共用）
+from engine.portal import PORTAL_TITLE, DIAG_MENU
 
 # ========= クエリ/ルーティング系 =========
 def current_query_params() -> dict:
@@ -105,13 +54,8 @@ def current_query_params() -> dict:
         q = st.experimental_get_query_params()
         return {k: (v[0] if isinstance(v, list) else v) for k, v in q.items()}
 
-def build_theme_url(theme_key: str, keep=("utm_source","utm_medium","utm_campaign")) -> str:
-    base = {"theme": theme_key}
-    q = current_query_params()
-    for k in keep:
-        if q.get(k):
-            base[k] = q[k]
-    return "?" + "&".join(f"{k}={base[k]}" for k in base)
+def build_theme_url(theme_key: str, keep=portal.UTM_KEYS) -> str:
+    return portal.theme_href(theme_key, portal.utm_key(current_query_params(), keep))
 
 def is_truthy(x) -> bool:
     return str(x).strip() in ("1","true","True","yes","on")
@@ -119,13 +63,6 @@ def is_truthy(x) -> bool:
 # 日本時間
 JST = timezone(timedelta(hours=9))
 
-# 共通ヘッダー
-COMMON_HEADER_ORDER = [
-    "timestamp","company","email","category_scores","total_score","type_label","ai_comment",
-    "utm_source","utm_campaign","pdf_url","app_version","status","ai_comment_len",
-    "risk_level","entry_check","report_date","theme"
-]
-
 # ========= 画面設定 =========
 st.set_page_config(
     page_title="3分診断エンジン｜Victor Consulting",
@@ -148,6 +85,46 @@ except Exception:
     qp = st.experimental_get_query_params()
 ADMIN_MODE = (str(qp.get("admin", ["0"])[0]) == "1") or (str(read_secret("ADMIN_MODE", "0")) == "1")
 
+# ========= プロファイラ（管理者のみ／このセッションの再実行だけを計測） =========
+# ?admin=1&profile=1 → 既定（Python 3.11 まで cProfile、3.12 以降はサンプリング）、
+# profile=sample → サンプリング、profile=cprofile → cProfile（3.12 以降はプロセス全体を計測する）
+PROFILE_MODE = ""
+if ADMIN_MODE:
+    _profile_q = (current_query_params().get("profile", "") or "").strip().lower()
+    if _profile_q in ("sample", "cprofile"):
+        PROFILE_MODE = _profile_q
+    elif is_truthy(_profile_q):
+        PROFILE_MODE = DEFAULT_PROFILE_MODE
+_PROFILER = SessionProfiler(PROFILE_MODE).start() if PROFILE_MODE else None
+
+# 集計ロールアップの保存先
+ROLLUP_PATH = read_secret("ROLLUP_PATH", rollups.DEFAULT_PATH)
+# 列指向アーカイブ（Parquet）の保存先。未設定なら書き出さない
+ARCHIVE_DIR = read_secret("ARCHIVE_DIR", "")
+# ワーカー間共有キャッシュ（SQLite）。未設定ならプロセス内キャッシュのみ
+SHARED_CACHE = shared_cache.configure(read_secret("SHARED_CACHE_PATH", ""), read_secret("SHARED_CACHE_MAX_MB", None))
+PDF_CACHE = SHARED_CACHE.namespace("pdf", ttl=24 * 3600) if SHARED_CACHE else session_mem.artifacts
+AI_COMMENT_TTL_SEC = 7 * 24 * 3600
+# Sheets API のクォータ（回/分、read / write 別）。回答の保存 > 管理画面の読み取り > イベントログ の順に配送
+SHEETS = sheets_scheduler.configure(read_secret("SHEETS_READ_RPM", None), read_secret("SHEETS_WRITE_RPM", None))
+SHEETS_SAVE_WAIT_SEC = float(read_secret("SHEETS_SAVE_WAIT_SEC", 20))  # 待ち行列で待つ上限（超えたら CSV へ）
+# 保存先シートは四半期・行数上限ごとに分割（engine/sheet_shards.py）。予備のスプレッドシートはカンマ区切り
+SHEET_SHARD_SPREADSHEET_IDS = [x.strip() for x in str(read_secret("SHEET_SHARD_SPREADSHEET_IDS", "") or "").split(",")
+                               if x.strip()]
+
+# 結果画面の待ち時間の予算（秒）。超えたステージは縮退（静的コメント・軽量版 PDF・保存待ち行列）。RESULTS_SLO_SEC=0 で無効
+SLO = slo.configure(read_secret("RESULTS_SLO_SEC", None), read_secret("SLO_AI_SEC", None),
+                    read_secret("SLO_PDF_SEC", None), read_secret("SLO_SAVE_SEC", None))
+
+# AIコメント・PDF 生成の同時実行数（プロセス全体）。超えた分はセッションごとに巡回する待ち行列へ。
+# 予算内に順番が来ない見込みなら待たずに縮退（静的コメント・軽量版 PDF）
+AI_GATE = admission.configure("ai", read_secret("AI_CONCURRENCY", None), read_secret("ADMISSION_MAX_QUEUE", None))
+PDF_GATE = admission.configure("pdf", read_secret("PDF_CONCURRENCY", None), read_secret("ADMISSION_MAX_QUEUE", None))
+
+def shard_router(service_json_str: str, spreadsheet_id: str) -> sheet_shards.ShardRouter:
+    return sheet_shards.router(SHEETS, service_json_str, spreadsheet_id, SHEET_SHARD_SPREADSHEET_IDS,
+                               read_secret("SHEET_SHARD_MAX_ROWS", None), read_secret("SHEET_SHARD_CELL_BUDGET", None))
+
 # ========= ルーティング判定 =========
 def theme_exists(theme_key: str) -> bool:
     try:
@@ -175,169 +152,33 @@ def get_route() -> dict:
 ROUTE = get_route()
 THEME = ROUTE["theme"]  # <- 保存時にも使うグローバル定数
 
-# ========= 日本語TTF 登録 =========
-def setup_japanese_font():
-    candidates = [
-        "NotoSansJP-Regular.ttf",
-        "/mnt/data/NotoSansJP-Regular.ttf",
-        "/content/NotoSansJP-Regular.ttf",
-    ]
-    font_path = next((p for p in candidates if os.path.exists(p)), None)
-    if not font_path:
-        return None
-    try:
-        pdfmetrics.registerFont(TTFont("JP", font_path))
-        registerFontFamily("JP", normal="JP", bold="JP", italic="JP", boldItalic="JP")
-    except Exception as e:
-        print("ReportLab font register error:", e)
-    try:
-        font_manager.fontManager.addfont(font_path)
-        fp = font_manager.FontProperties(fname=font_path)
-        import matplotlib as mpl
-        mpl.rcParams["font.family"] = fp.get_name()
-        mpl.rcParams["axes.unicode_minus"] = False
-    except Exception as e:
-        print("Matplotlib font register error:", e)
-    return font_path
-FONT_PATH_IN_USE = setup_japanese_font()
+# ========= ステージ計測 =========
+# Secrets: PERF_TIMING="1" または管理者モードで有効化（一度有効になればプロセス内で継続集計）
+if ADMIN_MODE or is_truthy(read_secret("PERF_TIMING", "0")):
+    perf.enable(True)
+perf.record("imports", THEME or "portal", (_T_IMPORTS - _T_SCRIPT0) * 1000.0)
+
+# ========= メトリクス公開 =========
+# Secrets: METRICS_PORT（サイドカーHTTP /metrics）/ METRICS_FILE（textfile 定期書き出し）
+metrics.ensure_exporter(port=read_secret("METRICS_PORT", None), path=read_secret("METRICS_FILE", None))
+metrics.register_gauge("perf_samples", perf.sample_count)
+metrics.register_gauge("portal_cache_entries", portal.cache_entries)
+metrics.register_gauge("pdf_cache_bytes", lambda: session_mem.artifacts.stats()["bytes"])
+if SHARED_CACHE:
+    metrics.register_gauge("shared_cache_bytes", SHARED_CACHE.total_bytes)
+metrics.register_gauge("http_pool_connections",
+                       lambda: {(("host", r["host"]),): r["connections"] for r in http_pool.pool_stats()})
+
+# ========= 日本語TTF 登録（engine/report.py、プロセスにつき1回） =========
+with perf.span("setup_japanese_font", THEME or "portal"):
+    FONT_PATH_IN_USE = setup_japanese_font()
 
 # ========= 共通スタイル =========
 # ========= スタイル（ポータル＋診断結果） =========
-st.markdown(
-    f"""
-<style>
-.stApp {{ background: {BRAND_BG}; }}
-.block-container {{ padding-top: 2.8rem; }}
-h1 {{ margin-top: .6rem; }}
-
-/* 診断結果カード（既存） */
-.result-card {{
-  background: white; border-radius: 14px; padding: 1.0rem 1.0rem;
-  box-shadow: 0 6px 20px rgba(0,0,0,.06); border: 1px solid rgba(0,0,0,.06);
-}}
-.badge {{
-  display:inline-block; padding:.25rem .6rem; border-radius:999px; font-size:.9rem;
-  font-weight:700; letter-spacing:.02em; margin-left:.5rem;
-}}
-.badge-blue  {{ background:#e6f0ff; color:#0b5fff; border:1px solid #cfe3ff; }}
-.badge-yellow{{ background:#fff6d8; color:#8a6d00; border:1px solid #ffecb3; }}
-.badge-red   {{ background:#ffe6e6; color:#a80000; border:1px solid #ffc7c7; }}
-.small-note {{ color:#666; font-size:.9rem; }}
-hr {{ border:none; border-top:1px dotted #c9d7d7; margin:1.0rem 0; }}
-
-/* ポータル：ヒーロー */
-.portal-hero {{
-  text-align:center; padding: 1.2rem 0 0.6rem 0;
-}}
-
-/* ポータルサブタイトル */
-.portal-subtitle {{
-  font-size:1.5rem;
-  font-weight:700;
-  color:#111;
-  text-align:center;
-  margin-top:0.2rem;
-  margin-bottom:1rem;
-}}
-.portal-subtitle span {{
-  color:#005bbb;
-}}
-
-/* ポータル：グリッド ＋ カード全体リンク */
-.portal-grid {{
-  display:grid;
-  grid-template-columns: repeat(auto-fit, minmax(260px, 1fr));
-  gap: 18px;
-  margin-top: 18px;
-}}
-.portal-card-link {{
-  text-decoration:none;
-  color:inherit;
-  display:block;
-  height:100%;
-}}
-
-/* ポータル：カード本体（3Dボタン風） */
-.portal-card {{
-  position:relative;
-  display:flex;
-  flex-direction:column;
-  justify-content:flex-start;
-  height:100%;
-  min-height:240px;
-  padding:16px 18px;
-  border-radius:18px;
-  background:#ffffff;
-  box-shadow:0 10px 24px rgba(15,23,42,.06);
-  border:1px solid rgba(15,23,42,.06);
-  transition: transform .12s ease, box-shadow .12s ease, border-color .12s ease;
-}}
-.portal-card:hover {{
-  transform: translateY(-4px);
-  box-shadow:0 18px 36px rgba(15,23,42,.10);
-  border-color:#2563eb;
-}}
-
-/* 1行目：アイコン */
-.portal-icon {{
-  font-size:1.8rem;
-  margin-bottom:.3rem;
-}}
-
-/* 2〜3行目：タイトル */
-.portal-title {{
-  font-weight:800;
-  font-size:1.1rem;
-  margin:0 0 .35rem 0;
-  line-height:1.4;
-}}
-
-/* 本文（リード） */
-.portal-lead {{
-  margin:.25rem 0 .9rem;
-  line-height:1.6;
-  color:#374151;
-  font-size:.95rem;
-  flex:1;
-}}
-
-/* フッター（「この診断を開く →」表示） */
-.card-footer {{
-  display:flex;
-  justify-content:flex-end;
-  margin-top:auto;
-}}
-.portal-cta {{
-  font-size:.9rem;
-  font-weight:700;
-  color:#0b5fff;
-}}
-
-/* 準備中バッジ */
-.badge-soon {{
-  display:inline-block; padding:.2rem .6rem; border-radius:999px;
-  background:#fff6d8; color:#8a6d00; border:1px solid #ffecb3; font-weight:700;
-}}
-</style>
-""",
-    unsafe_allow_html=True,
-)
-
+# CSS はプロセスで1回だけ最小化（engine/portal.py）。再実行ごとには文字列を渡すだけ
+with perf.span("css_injection", THEME or "portal"):
+    st.markdown(portal.style_tag(BRAND_BG), unsafe_allow_html=True)
 
-# ========= ロゴ取得 =========
-def path_or_download_logo() -> str | None:
-    if os.path.exists(LOGO_LOCAL):
-        return LOGO_LOCAL
-    try:
-        r = requests.get(LOGO_URL, timeout=8)
-        if r.ok:
-            tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".png")
-            tmp.write(r.content)
-            tmp.flush()
-            return tmp.name
-    except Exception:
-        pass
-    return None
 
 # ========= ポータル描画 =========
 def render_portal():
@@ -358,78 +199,18 @@ def render_portal():
         st.caption("© Victor Consulting")
 
     # タイトル（1行目）
-    PORTAL_TITLE_HTML = "3分診断ポータル<br/> Victor Consulting"
-    st.markdown(
-        f"<div class='portal-hero'><h1 style='line-height:1.25'>{PORTAL_TITLE_HTML}</h1></div>",
-        unsafe_allow_html=True
-    )
+    st.markdown(portal.PORTAL_HERO_HTML, unsafe_allow_html=True)
 
     # ★ ここに強調サブタイトルを追加（caption/write は使わない）
-    st.markdown(
-        """
-        <div class="portal-subtitle">
-            会社の <span>“ボトルネック”</span> を、3分で見える化
-        </div>
-        """,
-        unsafe_allow_html=True,
-    )
-
-    # もし PORTAL_HERO / PORTAL_LEAD をまだ使いたければ、
-    # その下で caption / write にしてもOK
-    # st.caption(PORTAL_HERO)
-    # st.write(PORTAL_LEAD)
-
+    st.markdown(portal.PORTAL_SUBTITLE_HTML, unsafe_allow_html=True)
 
     # 追加説明（そのまま）
-    with st.expander("Victor Consultingについて / なぜ“3分診断”なのか？"):
-        st.markdown("""
-**Victor Consulting** は、中小企業の“現場・人・お金”の流れを可視化し、  
-成果につながる **ボトルネックの特定** を得意とする経営コンサルティング事務所です。
-
-私たちのアプローチの核にあるのが **瞬間経営管理®**。  
-複雑な分析をすべて裏側で処理し、  
-「いま、どこを直せば最短で成果につながるのか」を **3分で示す** 独自メソッドです。
-
-- 数値入力は不要。Yes/No・2〜3段階の回答で診断が完了  
-- 現場・資金・組織・人材・営業・オフィスなど、会社全体の流れを横断して評価  
-- 結果は **PDF＋AIコメント** で即時出力。社内共有と改善アクションがスムーズ  
-- 初回相談は **90分スポット診断** から。継続支援や研修メニューも提供しています。
-
-""")
-
-    # ▼ カードグリッド（全部 HTML で出力）
-    cards_html = []
-    for item in DIAG_MENU:
-        if item["available"]:
-            href = build_theme_url(item["key"])
-            safe_href = href.replace("&", "&amp;")
-            card_html = f"""
-<a class="portal-card-link" href="{safe_href}">
-  <div class="portal-card">
-    <div class="portal-icon">{item['emoji']}</div>
-    <h3 class="portal-title">{item['title']}</h3>
-    <div class="portal-lead">{item['lead']}</div>
-    <div class="card-footer">
-      <span class="portal-cta">この診断を開く →</span>
-    </div>
-  </div>
-</a>
-"""
-        else:
-            card_html = f"""
-<div class="portal-card">
-  <div class="portal-icon">{item['emoji']}</div>
-  <h3 class="portal-title">{item['title']}</h3>
-  <div class="portal-lead">{item['lead']}</div>
-  <div class="card-footer">
-    <span class="badge-soon">準備中</span>
-  </div>
-</div>
-"""
-        cards_html.append(card_html)
+    with st.expander(portal.PORTAL_ABOUT_TITLE):
+        st.markdown(portal.PORTAL_ABOUT_MD)
 
+    # ▼ カードグリッド（全部 HTML で出力）：UTM の組ごとにキャッシュ済みの HTML を使う
     st.markdown(
-        "<div class='portal-grid'>" + "\n".join(cards_html) + "</div>",
+        portal.cards_grid_html(portal.utm_key(current_query_params())),
         unsafe_allow_html=True,
     )
 
@@ -441,27 +222,11 @@ def _report_event(level: str, message: str, payload: dict | None = None):
         "message": message,
         "payload": json.dumps(payload, ensure_ascii=False) if payload else "",
     }
+    metrics.inc("events_total", {"level": level})
     secret_json     = read_secret("GOOGLE_SERVICE_JSON", None)
     secret_sheet_id = read_secret("SPREADSHEET_ID", None)
-    wrote = False
-    try:
-        if secret_json and secret_sheet_id:
-            scopes = ["https://www.googleapis.com/auth/spreadsheets"]
-            info = json.loads(secret_json)
-            creds = Credentials.from_service_account_info(info, scopes=scopes)
-            gc = gspread.authorize(creds)
-            sh = gc.open_by_key(secret_sheet_id)
-            try:
-                ws = sh.worksheet("events")
-            except gspread.WorksheetNotFound:
-                ws = sh.add_worksheet(title="events", rows=1000, cols=6)
-                ws.append_row(list(evt.keys()))
-            ws.append_row([evt[k] for k in evt.keys()])
-            wrote = True
-    except Exception:
-        wrote = False
 
-    if not wrote:
+    def _append_csv():
         try:
             df = pd.DataFrame([evt])
             csv_path = "events.csv"
@@ -472,38 +237,57 @@ def _report_event(level: str, message: str, payload: dict | None = None):
         except Exception:
             pass
 
-    if ADMIN_MODE:
+    try:
+        if not (secret_json and secret_sheet_id):
+            raise RuntimeError("Sheets 未設定")
+        # 待たずに戻る（最も低い優先度で、溜まった分はまとめて1回で追記）。失敗・待ち行列あふれは CSV へ
+        fut = shard_router(secret_json, secret_sheet_id).append_async(
+            "events", list(evt.keys()), [[evt[k] for k in evt.keys()]], priority=sheets_scheduler.PRIORITY_EVENT)
+        fut.add_done_callback(lambda f: f.exception() and _append_csv())
+    except Exception:
+        _append_csv()
+
+    # 送信後パイプラインのスレッドから呼ばれた場合は画面に出さない（記録のみ）
+    if ADMIN_MODE and get_script_run_ctx(suppress_warning=True):
         st.caption(f"［ADMIN］{level}: {message}")
 
 # ========= 保存系（Sheets/CSV） =========
-def try_append_to_google_sheets(row_dict: dict, spreadsheet_id: str, service_json_str: str, sheet_title: str):
-    scopes = ["https://www.googleapis.com/auth/spreadsheets"]
-    info = json.loads(service_json_str)
-    creds = Credentials.from_service_account_info(info, scopes=scopes)
-    gc = gspread.authorize(creds)
-    sh = gc.open_by_key(spreadsheet_id)
-    try:
-        ws = sh.worksheet(sheet_title)
-    except gspread.WorksheetNotFound:
-        ws = sh.add_worksheet(title=sheet_title, rows=2000, cols=30)
-        ws.append_row(COMMON_HEADER_ORDER)
-
-    values = ws.get_all_values()
-    if not values:
-        ws.append_row(COMMON_HEADER_ORDER)
+def open_theme_worksheet(spreadsheet_id: str, service_json_str: str, sheet_title: str):
+    """認証・シート取得・ヘッダー確認まで（送信後パイプラインでは AIコメントを待つ間に先に済ませる）"""
+    # sheet_title は分割前の名前。実際の書き込み先は現在のシャード（例: responses_factory_2026Q4）
+    # ハンドルとヘッダー確認はプロセスで1回（engine/sheets_scheduler.py。2回目以降は API を呼ばない）
+    sid, title = shard_router(service_json_str, spreadsheet_id).target(sheet_title, COMMON_HEADER_ORDER)
+    fut = SHEETS.ensure_worksheet(service_json_str, sid, title, COMMON_HEADER_ORDER,
+                                  priority=sheets_scheduler.PRIORITY_RESPONSE)
+    return fut.result(SHEETS_SAVE_WAIT_SEC)
 
+def try_append_to_google_sheets(row_dict: dict, spreadsheet_id: str, service_json_str: str, sheet_title: str):
     record = [row_dict.get(k, "") for k in COMMON_HEADER_ORDER]
-    ws.append_row(record, value_input_option="USER_ENTERED")
+    router = shard_router(service_json_str, spreadsheet_id)
+    sid, title = router.target(sheet_title, COMMON_HEADER_ORDER)
+    fut = SHEETS.append(service_json_str, sid, title, [record], header=COMMON_HEADER_ORDER,
+                        priority=sheets_scheduler.PRIORITY_RESPONSE)
+    router.note_written(sheet_title, title, sheets_scheduler.wait_written(fut, SHEETS_SAVE_WAIT_SEC))
 
 def fallback_append_to_csv(row_dict: dict, csv_path="responses.csv"):
-    df = pd.DataFrame([row_dict])
+    df = pd.DataFrame([_resolved(row_dict)])
     if os.path.exists(csv_path):
-        df.to_csv(csv_path, mode="a", header=False, index=False, encoding="utf-8")
+        with open(csv_path, "r", encoding="utf-8") as f:
+            header = f.readline().rstrip("\r\n").split(",")
+        if header == list(df.columns):
+            df.to_csv(csv_path, mode="a", header=False, index=False, encoding="utf-8")
+            return
+        # 列が増えた（スキーマ変更）ときは一度だけ全体を書き直してヘッダーを揃える
+        old = pd.read_csv(csv_path, dtype=str).fillna("")
+        df = pd.concat([old, df.astype(str)], ignore_index=True).fillna("")
+        tmp = csv_path + ".tmp"
+        df.to_csv(tmp, index=False, encoding="utf-8")
+        os.replace(tmp, csv_path)
     else:
         df.to_csv(csv_path, index=False, encoding="utf-8")
 
-def auto_save_row(row: dict, theme_sheet: str):
-    """ユーザーには何も表示しない。Sheets→CSVフォールバック。"""
+def sheets_credentials():
+    """(サービスアカウント JSON, スプレッドシート ID)。未設定なら None を含む"""
     secret_json     = read_secret("GOOGLE_SERVICE_JSON", None)
     if not secret_json:
         b64 = read_secret("GOOGLE_SERVICE_JSON_BASE64", None)
@@ -512,35 +296,63 @@ def auto_save_row(row: dict, theme_sheet: str):
                 secret_json = base64.b64decode(b64).decode("utf-8")
             except Exception as e:
                 _report_event("ERROR", f"Base64デコード失敗: {e}", {})
-    secret_sheet_id = read_secret("SPREADSHEET_ID", None)
+    return secret_json, read_secret("SPREADSHEET_ID", None)
+
+def auto_save_row(row: dict, theme_sheet: str):
+    """ユーザーには何も表示しない。Sheets→CSVフォールバック（待ち行列で SHEETS_SAVE_WAIT_SEC を超えたら CSV）"""
+    secret_json, secret_sheet_id = sheets_credentials()
 
     def _append_csv():
         try:
             fallback_append_to_csv(row)
+            metrics.inc("saves_total", {"backend": "csv", "theme": row.get("theme", "")})
         except Exception as e2:
             _report_event("ERROR", f"CSV保存に失敗: {e2}", {
                 "row_head": {k: row.get(k) for k in list(row)[:6]}
             })
 
-    try:
-        if secret_json and secret_sheet_id:
-            try_append_to_google_sheets(row, secret_sheet_id, secret_json, sheet_title=theme_sheet)
-        else:
+    with metrics.timer("save_latency_seconds", {"theme": row.get("theme", "")}):
+        try:
+            if secret_json and secret_sheet_id:
+                try_append_to_google_sheets(row, secret_sheet_id, secret_json, sheet_title=theme_sheet)
+                metrics.inc("saves_total", {"backend": "sheets", "theme": row.get("theme", "")})
+            else:
+                _append_csv()
+        except Exception as e:
             _append_csv()
-    except Exception as e:
-        _append_csv()
-        _report_event("WARN", f"Sheets保存に失敗しCSVへフォールバック: {e}", {"reason": str(e)})
+            _report_event("WARN", f"Sheets保存に失敗しCSVへフォールバック: {e}", {"reason": str(e)})
+
+# ========= プロファイル結果（管理者） =========
+def render_profile_capture():
+    if _PROFILER is None:
+        return
+    _PROFILER.stop()
+    with st.expander(f"ADMIN：プロファイル（{_PROFILER.mode} / {_PROFILER.elapsed_sec:.2f}s）", expanded=True):
+        rows = _PROFILER.top_functions(40)
+        if rows:
+            st.dataframe(pd.DataFrame(rows), use_container_width=True)
+        else:
+            st.info("サンプルが取得できませんでした。")
+        st.download_button(
+            "⬇️ 生データをダウンロード（オフライン解析・フレームグラフ用）",
+            data=_PROFILER.raw_bytes(),
+            file_name=_PROFILER.raw_filename(f"profile_{THEME or 'portal'}"),
+            mime="application/octet-stream",
+            key="admin_profile_download",
+        )
 
 # ========= ルーティング：ポータル or テーマ =========
 if ROUTE["mode"] == "portal":
     render_portal()
+    render_profile_capture()
     st.stop()
 
 # ========= テーマ動的ロード =========
 def load_theme_module(theme_name: str):
     return importlib.import_module(f"themes.{theme_name}")
 
-theme = load_theme_module(THEME)
+with perf.span("theme_load", THEME):
+    theme = load_theme_module(THEME)
 
 # ========= サイドバー（共通） =========
 with st.sidebar:
@@ -557,12 +369,12 @@ st.write(theme.THEME_META["lead"])
 
 # ========= セッション初期化 =========
 defaults = {
-    "result_ready": False, "df": None, "overall_avg": None, "signal": None,
+    "result_ready": False, "scores": None, "overall_avg": None, "signal": None,
     "main_type": None, "company": "", "email": "",
-    "ai_comment": None, "ai_tried": False,
+    "ai_comment": None, "ai_tried": False, "ai_fallback": "", "pdf_lite": False,
     "utm_source": "", "utm_medium": "", "utm_campaign": "",
     "saved_once": False,
-    "dedup_key": ""
+    "dedup_key": "", "submit_t0": None
 }
 for k, v in defaults.items():
     if k not in st.session_state:
@@ -577,6 +389,15 @@ st.session_state["utm_source"]   = q.get("utm_source",   [""])[0] if isinstance(
 st.session_state["utm_medium"]   = q.get("utm_medium",   [""])[0] if isinstance(q.get("utm_medium"), list) else q.get("utm_medium", "")
 st.session_state["utm_campaign"] = q.get("utm_campaign", [""])[0] if isinstance(q.get("utm_campaign"), list) else q.get("utm_campaign", "")
 
+# ========= 閲覧数（ロールアップ：セッションにつき1回） =========
+if not st.session_state.get("rollup_viewed"):
+    st.session_state["rollup_viewed"] = True
+    try:
+        rollups.record_view(THEME, st.session_state["utm_campaign"],
+                            day=datetime.now(JST).strftime("%Y-%m-%d"), path=ROLLUP_PATH)
+    except Exception as e:
+        print("rollup view error:", e)
+
 # ========= バリデーション =========
 EMAIL_RE = re.compile(r"^[A-Za-z0-9._%+\-]+@[A-Za-z0-9.\-]+\.[A-Za-z]{2,}$")
 def validate_inputs(company: str, email: str) -> Tuple[bool, str]:
@@ -590,7 +411,8 @@ def validate_inputs(company: str, email: str) -> Tuple[bool, str]:
 
 # ========= フォーム（テーマ側でUI構築 & スコア表返却） =========
 with st.form("diagnose_form"):
-    company, email, df_scores = theme.render_questions(st)
+    with perf.span("render_questions", THEME):
+        company, email, df_scores = theme.render_questions(st)
     submitted = st.form_submit_button("診断する")
 
 # ========= 信号/タイプ（テーマ側のロジック利用） =========
@@ -598,9 +420,12 @@ if submitted:
     ok, msg = validate_inputs(company, email)
     if not ok:
         st.error(msg)
+        render_profile_capture()
         st.stop()
 
-    overall_avg, signal, main_type = theme.evaluate(df_scores)
+    with perf.span("evaluate", THEME):
+        overall_avg, signal, main_type = theme.evaluate(df_scores)
+    metrics.inc("submissions_total", {"theme": THEME, "signal": signal[0], "type": main_type})
 
     # dedup_key（10秒窓の二重書き込み防止）
     now_jst = datetime.now(JST)
@@ -608,351 +433,610 @@ if submitted:
     st.session_state["dedup_key"] = dedup_key
 
     st.session_state.update({
-        "df": df_scores, "overall_avg": overall_avg, "signal": signal,
-        "main_type": main_type, "company": company, "email": email,
-        "result_ready": True, "ai_comment": None, "ai_tried": False,
-        "saved_once": False
+        # 結果はコンパクトな形で保持（DataFrame はスコアのタプル、文字列は上限付き）
+        "scores": results_view.score_key(df_scores), "overall_avg": overall_avg, "signal": signal,
+        "main_type": main_type,
+        "company": session_mem.clip(company, session_mem.MAX_FIELD_CHARS),
+        "email": session_mem.clip(email, session_mem.MAX_FIELD_CHARS),
+        "result_ready": True, "ai_comment": None, "ai_tried": False, "ai_fallback": "", "pdf_lite": False,
+        "saved_once": False,
+        # 待ち時間の起点（送信ボタンを押したこのスクリプト実行の開始。保存行の ttr_ms などに使う）
+        "submit_t0": _T_SCRIPT0,
     })
 
-# ========= AIコメント =========
-def _openai_client(api_key: str):
-    try:
-        from openai import OpenAI
-        return "new", OpenAI(api_key=api_key)
-    except Exception:
-        import openai
-        openai.api_key = api_key
-        return "old", openai
-
-def generate_ai_comment(theme_module, company: str, main_type: str, df_scores: pd.DataFrame, overall_avg: float):
+# ========= AIコメント（呼び出しは engine/ai.py） =========
+def generate_ai_comment(theme_module, company: str, main_type: str, df_scores: pd.DataFrame, overall_avg: float,
+                        meta: dict | None = None, queue_key: str = "", max_wait: float | None = None):
+    """(コメント, エラー)。meta を渡すと取得元（"cache" / "ai" / "shed"）を meta["source"] に入れる。
+    OpenAI の呼び出しは AI_GATE を通す。max_wait 秒以内に順番が来ない見込みなら呼ばずに (None, None)（shed）"""
+    meta = {} if meta is None else meta
     api_key = read_secret("OPENAI_API_KEY", None)
     if not api_key:
         return None, "OpenAIのAPIキーが未設定です。"
 
     user_prompt = theme_module.build_ai_prompt(company, main_type, df_scores, overall_avg)
-    mode, client = _openai_client(api_key)
+    # 同じプロンプトの結果はワーカー間で再利用（別ワーカーへの再接続・再実行で再課金しない）
+    cache_key = shared_cache.make_key(OPENAI_MODEL, user_prompt)
+    if SHARED_CACHE:
+        cached = SHARED_CACHE.get("ai_comment", cache_key)
+        if cached is not None:
+            meta["source"] = "cache"
+            return cached.decode("utf-8"), None
+    meta["source"] = "ai"
+    with AI_GATE.slot(queue_key, max_wait, sheddable=max_wait is not None) as admitted:
+        if not admitted:
+            meta["source"] = "shed"
+            return None, None
+        text, err = ai.complete(api_key, user_prompt, OPENAI_MODEL)
+    if err:
+        _report_event("ERROR", f"AIコメント生成エラー: {err}", {})
+        return None, f"AIコメント生成でエラー: {err}"
+    if text and SHARED_CACHE:
+        SHARED_CACHE.set("ai_comment", cache_key, text.encode("utf-8"), ttl=AI_COMMENT_TTL_SEC)
+    return text, err
+
+# ========= 保存行・PDF（送信後パイプラインのステージから呼ぶ。st.session_state には触れない） =========
+def to_risk_level(total: float) -> str:
+    if total < 2.0:
+        return "高リスク"
+    elif total < 3.5:
+        return "中リスク"
+    else:
+        return "低リスク"
+
+def submission_snapshot() -> dict:
+    """ステージ（別スレッド）に渡す送信内容。セッションはスクリプトのスレッドで読んでおく。"""
+    keys = ("scores", "overall_avg", "signal", "main_type", "company", "email", "dedup_key", "submit_t0")
+    snap = {k: st.session_state.get(k) for k in keys}
+    snap["utm_source"] = st.session_state.get("utm_source", "")
+    snap["utm_campaign"] = st.session_state.get("utm_campaign", "")
+    # AI・PDF の待ち行列はセッション単位で巡回（同じセッションの連続送信が他のセッションを待たせない）
+    ctx = get_script_run_ctx()
+    snap["queue_key"] = (ctx.session_id if ctx else "") or snap["dedup_key"] or ""
+    return snap
+
+def build_row(sub: dict, comment_text: str, timings: dict | None = None) -> dict:
+    df = results_view.frame(sub["scores"])
+    category_scores = {cat: float(score) for cat, score in zip(df["カテゴリ"], df["平均スコア"])}
+    category_scores_str = json.dumps(category_scores, ensure_ascii=False)
+    now = datetime.now(JST)
+    return {
+        "timestamp":   now.isoformat(timespec="seconds"),
+        "company":     sub["company"],
+        "email":       sub["email"],
+        "category_scores": category_scores_str,
+        "total_score": f"{sub['overall_avg']:.2f}",
+        "type_label":  sub["main_type"],
+        "ai_comment":  comment_text,
+        "utm_source":  sub["utm_source"],
+        "utm_campaign": sub["utm_campaign"],
+        "pdf_url":     "",
+        "app_version": APP_VERSION,
+        "status":      "ok",
+        "ai_comment_len": str(len(comment_text)),
+        "risk_level":  to_risk_level(sub["overall_avg"]),
+        "entry_check": "OK",
+        "report_date": now.strftime("%Y-%m-%d"),
+        "theme":       THEME,
+        # 待ち時間（ms）と縮退。save_ms・degraded は送り出す直前に評価する関数（保存後に _resolved で値へ）
+        **{k: (timings or {}).get(k, "") for k in ("ttr_ms", "ready_ms", "ai_ms", "ai_source", "pdf_ms", "save_ms",
+                                                  "degraded")},
+    }
 
-    for attempt in range(2):
+def _resolved(row: dict) -> dict:
+    return {k: (v() if callable(v) else v) for k, v in row.items()}
+
+def _pdf_key(sub: dict, comment: str, lite: bool = False) -> str:
+    return session_mem.artifact_key(THEME, sub["dedup_key"], comment, *(("lite",) if lite else ()))
+
+def pdf_for(sub: dict, comment: str, lite: bool = False, max_wait: float | None = None) -> bytes | None:
+    # 同じ結果・コメントに対しては1回だけ生成。セッションではなく LRU に保持（共有キャッシュ設定時はワーカー間で共有）
+    # lite=True は軽量版（待ち時間の予算超過時）。あとから通常版ができていればそちらを返す
+    # 生成は PDF_GATE を通す。max_wait 秒以内に順番が来ない見込みなら None（max_wait なしは断られない）
+    # 軽量版は待ち行列の先頭に入り、max_wait を過ぎたら枠の外で作る（打ち切った通常版が枠を持ったままでも配布できる）
+    pdf_key = _pdf_key(sub, comment)
+    pdf_bytes = PDF_CACHE.get(pdf_key)
+    if pdf_bytes is None and lite:
+        pdf_key = _pdf_key(sub, comment, lite=True)
+        pdf_bytes = PDF_CACHE.get(pdf_key)
+    if pdf_bytes is None:
+        result_payload = {
+            "company": sub["company"],
+            "email": sub["email"],
+            "dt": datetime.now(JST).strftime("%Y-%m-%d %H:%M"),  # JST
+            "signal": sub["signal"][0],
+            "main_type": sub["main_type"],
+            "comment": comment
+        }
+        with PDF_GATE.slot(sub.get("queue_key", ""), max_wait, sheddable=max_wait is not None and not lite) as admitted:
+            if not admitted and not lite:
+                return None
+            with perf.span("make_pdf_bytes", THEME), metrics.timer("pdf_build_seconds", {"theme": THEME}):
+                pdf_bytes = make_pdf_bytes(result_payload, results_view.frame(sub["scores"]), brand_hex=BRAND_BG,
+                                           lite=lite)
+        PDF_CACHE.put(pdf_key, pdf_bytes)
+    return pdf_bytes
+
+def prepare_save():
+    """Sheets の認証・シート取得（AIコメントを待たずに始められる部分）。CSV 保存時は None"""
+    secret_json, secret_sheet_id = sheets_credentials()
+    if not (secret_json and secret_sheet_id):
+        return None
+    return open_theme_worksheet(secret_sheet_id, secret_json, f"responses_{THEME}")
+
+def save_submission(sub: dict, comment_text: str, timings: dict | None = None) -> dict:
+    row = build_row(sub, comment_text, timings)
+    with perf.span("auto_save_row", THEME):
+        auto_save_row(row, theme_sheet=f"responses_{THEME}")
+    row = _resolved(row)
+    try:
+        rollups.record_submission(row, signal=sub["signal"][0], path=ROLLUP_PATH)
+    except Exception as e:
+        _report_event("WARN", f"ロールアップ更新に失敗: {e}", {})
+    if ARCHIVE_DIR:
         try:
-            if mode == "new":
-                resp = client.chat.completions.create(
-                    model=OPENAI_MODEL,
-                    messages=[
-                        {"role": "system", "content": "専門的かつ簡潔。日本語。実務に直結する助言を。"},
-                        {"role": "user", "content": user_prompt},
-                    ],
-                    temperature=0.4,
-                    max_tokens=420,
-                )
-                return resp.choices[0].message.content.strip(), None
-            else:
-                resp = client.ChatCompletion.create(
-                    model=OPENAI_MODEL,
-                    messages=[
-                        {"role": "system", "content": "専門的かつ簡潔。日本語。実務に直結する助言を。"},
-                        {"role": "user", "content": user_prompt},
-                    ],
-                    temperature=0.4,
-                    max_tokens=420,
-                )
-                return resp.choices[0].message["content"].strip(), None
+            archive.write_row(row, ARCHIVE_DIR)
         except Exception as e:
-            if attempt == 0:
-                time.sleep(4)
-                continue
-            _report_event("ERROR", f"AIコメント生成エラー: {e}", {})
-            return None, f"AIコメント生成でエラー: {e}"
-
-def clamp_comment(text: str, max_chars: int = 520) -> str:
-    if not text:
-        return ""
-    t = " ".join(text.strip().split())
-    return t if len(t) <= max_chars else (t[:max_chars - 1] + "…")
-
-# ========= 図・QRユーティリティ =========
-def build_bar_png(df: pd.DataFrame) -> bytes:
-    fig, ax = plt.subplots(figsize=(5.0, 2.4), dpi=220)
-    df_sorted = df.sort_values("平均スコア", ascending=True)
-    ax.barh(df_sorted["カテゴリ"], df_sorted["平均スコア"])
-    ax.set_xlim(0, 5)
-    ax.set_xlabel("平均スコア（0-5）")
-    ax.grid(axis="x", linestyle="--", alpha=0.3)
-    if FONT_PATH_IN_USE:
-        from matplotlib import font_manager as fm
-        fp = fm.FontProperties(fname=FONT_PATH_IN_USE)
-        ax.set_xlabel("平均スコア（0-5）", fontproperties=fp)
-        for label in ax.get_yticklabels():
-            label.set_fontproperties(fp)
-        for label in ax.get_xticklabels():
-            label.set_fontproperties(fp)
-    buf = io.BytesIO()
-    fig.tight_layout()
-    fig.savefig(buf, format="png")
-    plt.close(fig)
-    buf.seek(0)
-    return buf.read()
-
-def image_with_max_width(path: str, max_w: int):
-    with PILImage.open(path) as im:
-        w, h = im.size
-    if w <= max_w:
-        return Image(path, width=w, height=h)
-    new_h = h * (max_w / w)
-    return Image(path, width=max_w, height=new_h)
-
-def build_qr_png(data_url: str) -> bytes:
-    img = qrcode.make(data_url)
-    buf = io.BytesIO()
-    img.save(buf, format="PNG")
-    buf.seek(0)
-    return buf.read()
-
-# ========= PDF生成 =========
-def make_pdf_bytes(result: dict, df_scores: pd.DataFrame, brand_hex=BRAND_BG) -> bytes:
-    logo_path = path_or_download_logo()
-    bar_png = build_bar_png(df_scores)
-    qr_png  = build_qr_png(CTA_URL)
-
-    buf = io.BytesIO()
-    doc = SimpleDocTemplate(
-        buf, pagesize=A4,
-        rightMargin=32, leftMargin=32, topMargin=28, bottomMargin=28
-    )
-
-    styles = getSampleStyleSheet()
-    title = styles["Title"]; normal = styles["BodyText"]; h3 = styles["Heading3"]
-    if FONT_PATH_IN_USE:
-        title.fontName = normal.fontName = h3.fontName = "JP"
-    normal.fontSize = 10
-    normal.leading = 14
-    h3.spaceBefore = 6
-    h3.spaceAfter = 4
-
-    elems = []
-    if logo_path:
-        elems.append(image_with_max_width(logo_path, max_w=120))
-        elems.append(Spacer(1, 6))
-
-    elems.append(Paragraph("3分無料診断レポート", title))
-    elems.append(Spacer(1, 4))
-    meta = (
-        f"会社名：{result['company'] or '（未入力）'}　/　"
-        f"実施日時：{result['dt']}　/　"
-        f"信号：{result['signal']}　/　"
-        f"タイプ：{result['main_type']}"
-    )
-    elems.append(Paragraph(meta, normal))
-    elems.append(Spacer(1, 6))
-
-    elems.append(Paragraph("診断コメント", h3))
-    elems.append(Paragraph(clamp_comment(result["comment"], 520), normal))
-    elems.append(Spacer(1, 6))
-
-    table_data = [["カテゴリ", "平均スコア（0-5）"]] + [
-        [r["カテゴリ"], f"{r['平均スコア']:.2f}"] for _, r in df_scores.iterrows()
-    ]
-    tbl = Table(table_data, colWidths=[220, 140])
-    style_list = [
-        ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor(brand_hex)),
-        ("TEXTCOLOR",  (0, 0), (-1, 0), colors.black),
-        ("GRID",       (0, 0), (-1, -1), 0.3, colors.grey),
-        ("ALIGN",      (1, 1), (-1, -1), "CENTER"),
-        ("ROWBACKGROUNDS", (0, 1), (-1, -1), [colors.whitesmoke, colors.white]),
+            _report_event("WARN", f"アーカイブ書き込みに失敗: {e}", {})
+    return row
+
+# ========= 送信後パイプライン（engine/pipeline.py） =========
+# ai ─────────┬─ pdf_ai（AIコメントが取れたときだけ差し替え版を生成）
+# save_prepare ┴─ save（Sheets の認証・シート取得は先に済ませ、AI の成否・タイムアウトを問わずコメント確定後に追記）
+# pdf_static（静的コメント版を先に用意。AI が間に合わなければこれを配布）
+# pdf_lite（配布すべき通常版 PDF が予算内にできなかったときだけ軽量版を生成）
+# save は PDF も待つ（保存行に ready_ms・pdf_ms を記録するため。結果画面は save を待たない）
+# ai・pdf_* は待ち時間の予算（engine/slo.py）で打ち切り、超えた分は縮退して degraded 列に記録する。
+# AI・PDF の生成は同時実行の枠（engine/admission.py）を待ち、残りの予算内に順番が来ない見込みなら
+# 待たずに縮退する（AI は ai_shed で静的コメント、PDF は pdf_lite）。
+# 結果画面は待たずに表示し、ステージが終わった順にコメント・PDF を差し替える。
+# 再実行で中断されてもパイプラインは最後まで進み、次の再実行で同じ dedup_key に再接続する（二重保存しない）
+AI_STAGE_TIMEOUT_SEC   = float(read_secret("AI_STAGE_TIMEOUT_SEC", 25))
+PDF_STAGE_TIMEOUT_SEC  = float(read_secret("PDF_STAGE_TIMEOUT_SEC", 20))
+SAVE_STAGE_TIMEOUT_SEC = float(read_secret("SAVE_STAGE_TIMEOUT_SEC", 30))
+RESULT_STAGES = ("ai", "pdf_static", "pdf_ai", "pdf_lite")   # 結果画面が待つステージ
+
+def _ms_since(t0: float | None, t1: float | None = None):
+    return "" if t0 is None else round(((t1 or time.perf_counter()) - t0) * 1000.0)
+
+def post_submit_stages(sub: dict) -> list:
+    static_comment = theme.TYPE_TEXT[sub["main_type"]]
+    t_start = time.perf_counter()
+    deadline = SLO.deadline(sub.get("submit_t0"))
+    marks: dict = {}   # ステージ内の計測（ms と完了時刻）。保存行の待ち時間の列になる
+    degraded = slo.Degradations()
+
+    def left(stage: str, fallback: float) -> float:
+        """ステージの予算と全体の期限までの残りの短いほう（枠の順番待ちをここまでに収める）"""
+        budget = SLO.timeout(stage, fallback)
+        return budget if deadline is None else max(0.0, min(budget, deadline - time.perf_counter()))
+
+    def ai_stage(results, cancel):
+        df = results_view.frame(sub["scores"])
+        meta: dict = {}
+        t0 = time.perf_counter()
+        with perf.span("generate_ai_comment", THEME), metrics.timer("ai_latency_seconds", {"theme": THEME}):
+            text, err = generate_ai_comment(theme, sub["company"], sub["main_type"], df, sub["overall_avg"], meta,
+                                            queue_key=sub.get("queue_key", ""),
+                                            max_wait=left("ai", AI_STAGE_TIMEOUT_SEC))
+        marks["ai_done"] = time.perf_counter()
+        marks["ai_ms"] = _ms_since(t0, marks["ai_done"])
+        shed = meta.get("source") == "shed"
+        marks["ai_source"] = meta.get("source", "ai") if text or shed else "static"
+        metrics.inc("ai_comments_total", {"theme": THEME,
+                                          "outcome": "success" if text else "shed" if shed else "fallback"})
+        if shed:
+            SLO.degrade(degraded, "ai_shed", THEME)
+            return ""   # 空文字＝混雑で見送り（None は失敗・キー未設定。どちらも静的コメントで確定）
+        if not text and err:
+            _report_event("WARN", f"AIコメント未生成: {err}", {})
+        return session_mem.clip(text, session_mem.MAX_COMMENT_CHARS) if text else None
+
+    def pdf_stage(name: str, comment: str | None, lite: bool = False):
+        if not comment:
+            return None
+        t0 = time.perf_counter()
+        pdf = pdf_for(sub, comment, lite=lite, max_wait=left("pdf", PDF_STAGE_TIMEOUT_SEC))
+        marks[f"{name}_done"] = time.perf_counter()
+        marks[f"{name}_ms"] = _ms_since(t0, marks[f"{name}_done"])
+        return pdf
+
+    def pdf_lite_stage(results, cancel):
+        # 配布するのは AIコメント版（あれば）。その通常版が間に合っていれば何もしない
+        if results.get("pdf_ai") or (not results.get("ai") and results.get("pdf_static")):
+            return None
+        comment = results.get("ai") or static_comment
+        if PDF_CACHE.get(_pdf_key(sub, comment)) is None:   # 打ち切った通常版がもうできていればそれを配布
+            SLO.degrade(degraded, "pdf_lite", THEME)
+        return pdf_stage("pdf_lite", comment, lite=True)
+
+    def save_stage(results, cancel):
+        t_save = time.perf_counter()
+        if "ai" not in results:   # タイムアウト・例外（静的コメントで確定。遅れて終わった AI の計測は使わない）
+            pl = pipeline.get(sub["dedup_key"])
+            timed_out = pl is not None and pl.status["ai"] == "timeout"
+            ai_done = t_start + pl.timings["ai"] / 1000.0 if pl is not None and "ai" in pl.timings else t_save
+            marks.update(ai_source="timeout" if timed_out else "static", ai_ms=_ms_since(t_start, ai_done),
+                         ai_done=ai_done)
+            if timed_out:
+                SLO.degrade(degraded, "ai_static", THEME)
+        final_pdf = next((n for n in ("pdf_ai", "pdf_lite") if results.get(n)), "pdf_static")
+        done = [t for t in (marks.get("ai_done"), marks.get(f"{final_pdf}_done")) if t]
+        timings = {
+            "ttr_ms": sub.get("ttr_ms", ""),
+            "ready_ms": _ms_since(sub.get("submit_t0"), max(done)) if done else "",
+            "ai_ms": marks["ai_ms"], "ai_source": marks["ai_source"],
+            "pdf_ms": marks.get(f"{final_pdf}_ms", ""),
+            "save_ms": lambda: _ms_since(t_save),
+            "degraded": lambda: str(degraded),
+        }
+        # 保存は待ち行列で実行し、予算だけ待つ（間に合わなければ任せて先へ。送り出した時点の縮退が行に入る）
+        # 準備に失敗・タイムアウトしていても、追記のときにもう一度シートを開く（だめなら CSV）
+        fut = SLO.defer(save_submission, sub, results.get("ai") or "", timings)
+        try:
+            row = fut.result(SLO.timeout("save", SAVE_STAGE_TIMEOUT_SEC))
+        except FutureTimeout:
+            SLO.degrade(degraded, "save_deferred", THEME)
+            row = None
+        SLO.record(THEME, timings["ready_ms"], degraded)
+        return row
+
+    return [
+        pipeline.Stage("ai", ai_stage, timeout=SLO.timeout("ai", AI_STAGE_TIMEOUT_SEC), deadline=deadline),
+        pipeline.Stage("pdf_static", lambda results, cancel: pdf_stage("pdf_static", static_comment),
+                       timeout=SLO.timeout("pdf", PDF_STAGE_TIMEOUT_SEC), deadline=deadline),
+        pipeline.Stage("pdf_ai", lambda results, cancel: None if cancel.is_set() else pdf_stage("pdf_ai", results["ai"]),
+                       deps=("ai",), timeout=SLO.timeout("pdf", PDF_STAGE_TIMEOUT_SEC), deadline=deadline),
+        pipeline.Stage("pdf_lite", pdf_lite_stage, after=("ai", "pdf_static", "pdf_ai"), timeout=PDF_STAGE_TIMEOUT_SEC),
+        pipeline.Stage("save_prepare", lambda results, cancel: prepare_save(), timeout=SAVE_STAGE_TIMEOUT_SEC),
+        pipeline.Stage("save", save_stage, after=("ai", "save_prepare", "pdf_static", "pdf_ai", "pdf_lite"),
+                       timeout=SAVE_STAGE_TIMEOUT_SEC),
     ]
-    if FONT_PATH_IN_USE:
-        style_list.append(("FONTNAME", (0, 0), (-1, -1), "JP"))
-    tbl.setStyle(TableStyle(style_list))
-    elems.append(tbl)
-    elems.append(Spacer(1, 6))
-
-    bar_tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".png")
-    bar_tmp.write(bar_png)
-    bar_tmp.flush()
-    elems.append(Paragraph("カテゴリ別スコア（棒グラフ）", h3))
-    elems.append(Image(bar_tmp.name, width=390, height=180))
-    elems.append(Spacer(1, 6))
-
-    # 次の一手（QR右寄せ）
-    elems.append(Paragraph("次の一手（90分スポット診断のご案内）", h3))
-    url_par = Paragraph(f"詳細・お申込み：<u>{CTA_URL}</u>", normal)
-    qr_tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".png")
-    qr_tmp.write(qr_png)
-    qr_tmp.flush()
-    qr_img = Image(qr_tmp.name, width=52, height=52)
-    next_table = Table([[url_par, qr_img]], colWidths=[430, 70])
-    nt_style = [("VALIGN", (0, 0), (-1, -1), "MIDDLE"), ("ALIGN", (1, 0), (1, 0), "RIGHT")]
-    if FONT_PATH_IN_USE:
-        nt_style.append(("FONTNAME", (0, 0), (-1, -1), "JP"))
-    next_table.setStyle(TableStyle(nt_style))
-    elems.append(next_table)
-
-    doc.build(elems)
-    buf.seek(0)
-    return buf.read()
+
+def _record_post_submit(pl):
+    for name, s in pl.summary().items():
+        metrics.inc("post_submit_stages_total", {"theme": THEME, "stage": name, "status": s["status"]})
+        if s["status"] != "pending":
+            perf.record(f"post_submit.{name}", THEME, s["ms"])
+        if s["status"] in ("error", "timeout"):
+            _report_event("WARN", f"送信後ステージ {name}: {s['status']} {s['error']}", {})
+    perf.record("post_submit_total", THEME, pl.elapsed_ms or 0.0)
+
+def _pdf_filename(company: str) -> str:
+    return f"VC_診断_{company or '匿名'}_{datetime.now(JST).strftime('%Y%m%d_%H%M')}.pdf"
+
+def _ai_fallback_reason(pl) -> str:
+    """静的コメントになった理由（"timeout" / "shed" / ""）"""
+    if pl.status["ai"] == "timeout":
+        return "timeout"
+    return "shed" if pl.ok("ai") and pl.results.get("ai") == "" else ""
+
+def _static_comment_note(reason: str) -> str:
+    if reason == "timeout":
+        return "（AIコメントの生成に時間がかかっているため、PDFには静的コメントを挿入します）"
+    if reason == "shed":
+        return "（混み合っているため、今回はPDFにも静的コメントを挿入します）"
+    return "（OpenAI APIキー未設定等のため、PDFには静的コメントを挿入します）"
+
+def run_post_submit(comment_slot, pdf_slot):
+    """AIコメント・PDF を並行実行し、終わった順に画面へ反映。揃ったら結果をセッションへ戻す（保存は待たない）。"""
+    sub = submission_snapshot()
+    sub["ttr_ms"] = _ms_since(sub["submit_t0"])   # 結果カードの表示まで（この関数は表示直後に呼ばれる）
+    pl, _ = pipeline.start(sub["dedup_key"], lambda: post_submit_stages(sub), on_finish=_record_post_submit)
+    waiting = "AIコメントを生成しています…（PDFは準備でき次第ダウンロードできます）"
+    comment_slot.caption(waiting)
+    shown = waiting   # 表示中の待ち状況（変わったときだけ描き直す）
+    for name in pl.settled_stream(tick=0.3):
+        if name is None:
+            # AI の同時実行の枠を待っている間は順番を表示（PDF は待っても数百 ms のため表示しない）
+            if pl.status["ai"] in pipeline.SETTLED:
+                continue
+            ahead = AI_GATE.position(sub["queue_key"])
+            note = waiting if ahead is None else "混み合っています。まもなくAIコメントを生成します…" if ahead == 0 \
+                else f"混み合っています。順番にAIコメントを生成します…（前に {ahead} 件）"
+            if note != shown:
+                comment_slot.caption(note)
+                shown = note
+            continue
+        if name == "ai":
+            if pl.results.get("ai"):
+                comment_slot.write(pl.results["ai"])
+            else:
+                comment_slot.caption(_static_comment_note(_ai_fallback_reason(pl)))
+        elif name in ("pdf_static", "pdf_ai", "pdf_lite") and pl.results.get(name) \
+                and not (name == "pdf_static" and pl.ok("pdf_ai")):
+            # 途中経過のボタン（最終版は呼び出し側で key="pdf_download" として描画）
+            pdf_slot.download_button("📄 PDFをダウンロード", data=pl.results[name], file_name=_pdf_filename(sub["company"]),
+                                     mime="application/pdf", on_click="ignore", key=f"pdf_download_{name}")
+        if all(pl.status[s] in pipeline.SETTLED for s in RESULT_STAGES):
+            break   # 保存はパイプラインに任せる（再実行で中断されても最後まで進む）
+    st.session_state["ai_comment"] = pl.results.get("ai") or None
+    st.session_state["ai_fallback"] = _ai_fallback_reason(pl)
+    st.session_state["pdf_lite"] = bool(pl.results.get("pdf_lite"))
+    st.session_state["ai_tried"] = True
+    st.session_state["saved_once"] = True
 
 # ========= 結果画面 =========
-if st.session_state.get("result_ready"):
-    df = st.session_state["df"]
-    overall_avg = st.session_state["overall_avg"]
+@st.fragment
+def render_results_view():
+    """結果カード（タイプ判定・グラフ・表・AIコメント・PDF）。
+    カード内の操作ではこの関数だけが再実行される（CSS・テーマ読込・フォーム・保存処理は再実行しない）。
+    送信直後の1回だけ、送信後パイプラインの完了をここで待ちながら表示を差し替える。"""
+    key = st.session_state["scores"]
     signal = st.session_state["signal"]
     main_type = st.session_state["main_type"]
     company = st.session_state["company"]
-    email = st.session_state["email"]
     current_time = datetime.now(JST).strftime("%Y-%m-%d %H:%M")
 
-    # AIコメント自動生成（初回のみ）
-    if not st.session_state["ai_tried"]:
-        st.session_state["ai_tried"] = True
-        text, err = generate_ai_comment(theme, company, main_type, df, overall_avg)
-        if text:
-            st.session_state["ai_comment"] = text
-        elif err:
-            st.session_state["ai_comment"] = None
-            _report_event("WARN", f"AIコメント未生成: {err}", {})
-
-    # UI
-    st.markdown("### 診断結果")
-    st.markdown(
-        f"""
-        <div class="result-card">
-            <h3 style="margin:0 0 .3rem 0;">
-              タイプ判定：{main_type} <span class="badge {signal[1]}">{signal[0]}</span>
-            </h3>
-            <div class="small-note">
-              会社名：{company or "（未入力）"} ／ 実施日時：{current_time}
+    with perf.span("results_view", THEME):
+        st.markdown("### 診断結果")
+        st.markdown(
+            f"""
+            <div class="result-card">
+                <h3 style="margin:0 0 .3rem 0;">
+                  タイプ判定：{main_type} <span class="badge {signal[1]}">{signal[0]}</span>
+                </h3>
+                <div class="small-note">
+                  会社名：{company or "（未入力）"} ／ 実施日時：{current_time}
+                </div>
+                <hr/>
+                <p style="margin:.2rem 0 0 0;">{theme.TYPE_TEXT[main_type]}</p>
             </div>
-            <hr/>
-            <p style="margin:.2rem 0 0 0;">{theme.TYPE_TEXT[main_type]}</p>
-        </div>
-        """,
-        unsafe_allow_html=True
-    )
-
-    # 棒グラフ・表
-    chart = (
-        alt.Chart(df)
-        .mark_bar()
-        .encode(
-            x=alt.X("平均スコア:Q", scale=alt.Scale(domain=[0, 5])),
-            y=alt.Y("カテゴリ:N", sort="-x"),
-            tooltip=["カテゴリ", "平均スコア"]
-        ).properties(height=210)
-    )
-    st.altair_chart(chart, use_container_width=True)
-    st.dataframe(df.style.format({"平均スコア": "{:.2f}"}), use_container_width=True)
-
-    # 画面 AIコメント
+            """,
+            unsafe_allow_html=True
+        )
+
+        # 棒グラフ・表（スコアベクトル単位でキャッシュ）
+        st.vega_lite_chart(results_view.chart_spec(key), use_container_width=True)
+        st.dataframe(
+            results_view.table_frame(key), use_container_width=True,
+            column_config={"平均スコア": st.column_config.NumberColumn(format="%.2f")},
+        )
+
+    # 画面 AIコメント・PDF
     st.subheader("AIコメント（自動生成）")
+    comment_slot, pdf_slot = st.empty(), st.empty()
+    if not st.session_state["ai_tried"]:
+        run_post_submit(comment_slot, pdf_slot)
+
     if st.session_state["ai_comment"]:
-        st.write(st.session_state["ai_comment"])
+        comment_slot.write(st.session_state["ai_comment"])
     else:
-        st.caption("（OpenAI APIキー未設定等のため、PDFには静的コメントを挿入します）")
-
-    # PDF
+        comment_slot.caption(_static_comment_note(st.session_state["ai_fallback"]))
     comment_for_pdf = st.session_state["ai_comment"] or theme.TYPE_TEXT[main_type]
-    result_payload = {
-        "company": company,
-        "email": email,
-        "dt": current_time,  # JST
-        "signal": signal[0],
-        "main_type": main_type,
-        "comment": comment_for_pdf
-    }
-    pdf_bytes = make_pdf_bytes(result_payload, df, brand_hex=BRAND_BG)
-    fname = f"VC_診断_{company or '匿名'}_{datetime.now(JST).strftime('%Y%m%d_%H%M')}.pdf"
-    st.download_button("📄 PDFをダウンロード", data=pdf_bytes, file_name=fname, mime="application/pdf")
-
-    # ======== シート書き込み用データ ========
-    category_scores = {
-        cat: float(df.loc[df["カテゴリ"] == cat, "平均スコア"].values[0])
-        for cat in df["カテゴリ"].tolist()
-    }
-    category_scores_str = json.dumps(category_scores, ensure_ascii=False)
+    pdf_bytes = pdf_for(submission_snapshot(), comment_for_pdf, lite=st.session_state["pdf_lite"])
+    # ダウンロードはブラウザ側だけで完結（再実行しない）
+    pdf_slot.download_button("📄 PDFをダウンロード", data=pdf_bytes, file_name=_pdf_filename(company),
+                             mime="application/pdf", on_click="ignore", key="pdf_download")
 
-    def to_risk_level(total: float) -> str:
-        if total < 2.0:
-            return "高リスク"
-        elif total < 3.5:
-            return "中リスク"
-        else:
-            return "低リスク"
-
-    pdf_persist_url = ""
-    comment_text = st.session_state["ai_comment"] or ""
-    comment_len = len(comment_text)
-    entry_check = "OK"
-    report_date = datetime.now(JST).strftime("%Y-%m-%d")
-
-    row = {
-        "timestamp":   datetime.now(JST).isoformat(timespec="seconds"),
-        "company":     company,
-        "email":       email,
-        "category_scores": category_scores_str,
-        "total_score": f"{overall_avg:.2f}",
-        "type_label":  main_type,
-        "ai_comment":  comment_text,
-        "utm_source":  st.session_state.get("utm_source",""),
-        "utm_campaign":st.session_state.get("utm_campaign",""),
-        "pdf_url":     pdf_persist_url,
-        "app_version": APP_VERSION,
-        "status":      "ok",
-        "ai_comment_len": str(comment_len),
-        "risk_level":  to_risk_level(overall_avg),
-        "entry_check": entry_check,
-        "report_date": report_date,
-        "theme":       THEME,
-    }
-
-    # ▼▼ 二重書き込み防止 ▼▼
-    if st.session_state.get("ai_tried") and not st.session_state.get("saved_once"):
-        if st.session_state.get("dedup_key"):
-            auto_save_row(row, theme_sheet=f"responses_{THEME}")
-            st.session_state["saved_once"] = True
+if st.session_state.get("result_ready"):
+    render_results_view()
 else:
     st.caption("フォームに回答し、「診断する」を押してください。")
 
+perf.record("script_total", THEME, (time.perf_counter() - _T_SCRIPT0) * 1000.0)
+
+# ========= セッションメモリ計測（管理者画面で一覧） =========
+try:
+    _ctx = get_script_run_ctx()
+    if _ctx:
+        session_mem.report(_ctx.session_id, st.session_state.to_dict, force=ADMIN_MODE)
+except Exception as e:
+    print("session memory report error:", e)
+
 # ========= 管理者UI =========
 if ADMIN_MODE:
-    with st.expander("ADMIN：イベントログの確認（最新50件）"):
+    with st.expander("ADMIN：イベントログの確認（新しい順・50件/ページ）"):
         secret_json     = read_secret("GOOGLE_SERVICE_JSON", None)
         secret_sheet_id = read_secret("SPREADSHEET_ID", None)
-        shown = False
-        try:
-            if secret_json and secret_sheet_id:
-                scopes = ["https://www.googleapis.com/auth/spreadsheets"]
-                info = json.loads(secret_json)
-                creds = Credentials.from_service_account_info(info, scopes=scopes)
-                gc = gspread.authorize(creds)
-                sh = gc.open_by_key(secret_sheet_id)
-                ws = sh.worksheet("events")
-                values = ws.get_all_records()
-                if values:
-                    df_evt = pd.DataFrame(values).sort_values("timestamp", ascending=False).head(50)
-                    st.dataframe(df_evt, use_container_width=True)
-                    shown = True
-        except Exception:
-            pass
-        if not shown:
-            if os.path.exists("events.csv"):
-                df_evt = pd.read_csv("events.csv").sort_values("timestamp", ascending=False).head(50)
-                st.dataframe(df_evt, use_container_width=True)
-            else:
-                st.info("イベントログはまだありません。")
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
 
+        # イベントも四半期ごとに分割されるため、シャードを選んで表示（既定は最新）
+        evt_shards = []
+        if secret_json and secret_sheet_id:
+            try:
+                evt_shards = shard_router(secret_json, secret_sheet_id).shards("events")[::-1]
+            except Exception as e:
+                st.caption(f"シャード一覧を取得できませんでした: {e}")
+
+        c1, c2, c3, c4 = st.columns([2, 2, 1, 1])
+        evt_shard = c1.selectbox("シート", evt_shards, format_func=lambda e: e["title"], key="admin_evt_shard") \
+            if evt_shards else None
+        evt_level = c2.selectbox("level", ["ALL", "INFO", "WARN", "ERROR"], key="admin_evt_level")
+        evt_page  = c3.number_input("ページ", min_value=1, value=1, step=1, key="admin_evt_page")
+        evt_force = c4.button("再読込", key="admin_evt_reload")
+        level_filter = None if evt_level == "ALL" else evt_level
+
+        def _open_events_ws():
+            sh = SHEETS.open(secret_json, evt_shard["spreadsheet_id"]).result(SHEETS_SAVE_WAIT_SEC)
+            ws = SHEETS.run("read", lambda: sh.worksheet(evt_shard["title"]))
+            return SHEETS.throttled(ws, sheets_scheduler.PRIORITY_ADMIN)
+
+        rows, has_more, source = [], False, ""
+        if evt_shard:
+            sheet_key = f"sheets:{evt_shard['spreadsheet_id']}:{evt_shard['title']}"
+            try:
+                tail = event_store.get_tail(sheet_key, lambda: event_store.SheetEventTail(_open_events_ws))
+                rows, has_more = tail.query(int(evt_page) - 1, 50, level_filter, force=evt_force)
+                source = f"Sheets（{evt_shard['title']}）"
+            except Exception:
+                event_store.drop_tail(sheet_key)
+                rows = []
+        if not rows:
+            tail = event_store.get_tail("csv:events.csv", lambda: event_store.CsvEventTail("events.csv"))
+            rows, has_more = tail.query(int(evt_page) - 1, 50, level_filter, force=evt_force)
+            source = "CSV"
+
+        if rows:
+            st.dataframe(pd.DataFrame(rows), use_container_width=True)
+            st.caption(f"ソース：{source} ／ ページ {int(evt_page)}" + ("（次ページあり）" if has_more else ""))
+        else:
+            st.info("イベントログはまだありません。")
+
+    with st.expander("ADMIN：集計ダッシュボード（ロールアップ）"):
+        days = st.selectbox("期間（日）", [7, 30, 90, 365], index=1, key="admin_rollup_days")
+        summary = rollups.summarize(days=days, today=datetime.now(JST).date(), path=ROLLUP_PATH)
+        if summary["themes"]:
+            st.markdown("**テーマ別（閲覧→送信）**")
+            st.dataframe(pd.DataFrame(summary["themes"]), use_container_width=True)
+            if summary["daily"]:
+                st.bar_chart(pd.DataFrame(summary["daily"]).set_index("report_date"))
+            c1, c2, c3 = st.columns(3)
+            c1.dataframe(pd.DataFrame(summary["signal"]), use_container_width=True)
+            c2.dataframe(pd.DataFrame(summary["risk_level"]), use_container_width=True)
+            c3.dataframe(pd.DataFrame(summary["type_label"]), use_container_width=True)
+            st.markdown("**UTMキャンペーン別ファネル**")
+            st.dataframe(pd.DataFrame(summary["campaigns"]), use_container_width=True)
+        else:
+            st.info(f"{summary['since']} 以降の集計はまだありません。")
+
+        if st.button("既存の保存データから再構築（バックフィル）", key="admin_rollup_backfill"):
+            def _iter_saved_rows():
+                secret_json     = read_secret("GOOGLE_SERVICE_JSON", None)
+                secret_sheet_id = read_secret("SPREADSHEET_ID", None)
+                if secret_json and secret_sheet_id:
+                    router = shard_router(secret_json, secret_sheet_id)
+                    books = {}
+                    for item in DIAG_MENU:
+                        for shard in router.shards(f"responses_{item['key']}"):
+                            sid = shard["spreadsheet_id"]
+                            if sid not in books:
+                                books[sid] = SHEETS.open(secret_json, sid).result()
+                            try:
+                                ws = SHEETS.run("read", lambda: books[sid].worksheet(shard["title"]))
+                                yield from SHEETS.run("read", ws.get_all_records)
+                            except gspread.WorksheetNotFound:
+                                continue
+                if os.path.exists("responses.csv"):
+                    yield from pd.read_csv("responses.csv", dtype=str).fillna("").to_dict("records")
+            try:
+                n = rollups.backfill(_iter_saved_rows(), path=ROLLUP_PATH)
+                st.success(f"{n} 件から再構築しました。")
+            except Exception as e:
+                st.error(f"バックフィルに失敗しました: {e}")
+
+    with st.expander("ADMIN：ステージ計測（p50/p95/max, ms）"):
+        perf_rows = perf.summary()
+        if perf_rows:
+            df_perf = pd.DataFrame(perf_rows)
+            st.dataframe(df_perf, use_container_width=True)
+            st.caption(f"プロセス内の直近{perf.WINDOW}件/ステージ×テーマで集計（再起動でリセット）")
+        else:
+            st.info("計測データはまだありません。")
+
+    with st.expander("ADMIN：待ち時間レポート（保存データの p50/p95, ms）"):
+        c1, c2 = st.columns([3, 1])
+        lat_by = c1.multiselect("集計単位", list(latency_report.GROUP_KEYS), default=["theme"], key="admin_lat_by")
+        lat_days = c2.selectbox("期間（日）", [7, 30, 90], index=1, key="admin_lat_days")
+        if st.button("保存データから集計", key="admin_lat_run"):
+            since = (datetime.now(JST).date() - timedelta(days=lat_days - 1)).isoformat()
+            secret_json, secret_sheet_id = sheets_credentials()
+            try:
+                # アーカイブ（列だけ読む）> Sheets（分割シートを期間で絞って読む）> CSV の順
+                if ARCHIVE_DIR:
+                    lat_rows, lat_src = latency_report.rows_from_archive(ARCHIVE_DIR, since), "アーカイブ"
+                elif secret_json and secret_sheet_id:
+                    from engine import export
+                    backend = export.SheetsBackend(secret_json, secret_sheet_id, SHEET_SHARD_SPREADSHEET_IDS)
+                    lat_rows, lat_src = latency_report.rows_from_backend(backend, since), "Sheets"
+                else:
+                    lat_rows = latency_report.rows_from_csv("responses.csv") if os.path.exists("responses.csv") else []
+                    lat_src = "CSV"
+                st.session_state["admin_lat_result"] = (
+                    latency_report.summarize(lat_rows, lat_by or ["theme"], since), lat_src, since)
+            except Exception as e:
+                st.error(f"集計に失敗しました: {e}")
+        lat_result = st.session_state.get("admin_lat_result")
+        if lat_result and lat_result[0]:
+            st.dataframe(pd.DataFrame(lat_result[0]), use_container_width=True)
+            st.caption(f"ソース：{lat_result[1]} ／ {lat_result[2]} 以降 ／ ttr=結果表示まで、ready=AIコメントとPDFが揃うまで"
+                       "（送信ボタンを押してから）。列がない古い行は件数のみ")
+        elif lat_result:
+            st.info("対象期間の保存データがありません。")
+
+    with st.expander("ADMIN：セッションメモリ（state サイズ）"):
+        def _session_alive(session_id: str) -> bool:
+            return runtime.get_instance().is_active_session(session_id) if runtime.exists() else True
+
+        mem = session_mem.snapshot(_session_alive)
+        art = mem["artifacts"]
+        c1, c2, c3 = st.columns(3)
+        c1.metric("セッション数", len(mem["sessions"]))
+        c2.metric("state 合計", f"{mem['total_bytes'] / 1024:.1f} KB")
+        c3.metric("PDFキャッシュ", f"{art['bytes'] / 1048576:.1f} / {art['max_bytes'] / 1048576:.0f} MB")
+        if mem["sessions"]:
+            st.dataframe(pd.DataFrame(mem["sessions"]), use_container_width=True)
+        st.caption(
+            f"目安上限 {session_mem.SESSION_BUDGET_BYTES // 1024} KB/セッション（超過 {mem['over_budget']} 件）／"
+            f"PDFキャッシュ {art['entries']} 件・hit {art['hits']}・miss {art['misses']}・evict {art['evictions']}"
+        )
+
+    with st.expander("ADMIN：共有キャッシュ（ワーカー間・SQLite）"):
+        if SHARED_CACHE:
+            cache_rows = SHARED_CACHE.stats()
+            if cache_rows:
+                st.dataframe(pd.DataFrame(cache_rows), use_container_width=True)
+            st.caption(f"{SHARED_CACHE.path} ／ {SHARED_CACHE.total_bytes() / 1048576:.1f} / "
+                       f"{SHARED_CACHE.max_bytes / 1048576:.0f} MB（hit/miss 等は全ワーカーの累計）")
+        else:
+            st.info("SHARED_CACHE_PATH が未設定のため、キャッシュは各プロセス内のみです。")
+
+    with st.expander("ADMIN：外部HTTP接続プール（OpenAI・Sheets・アセット）"):
+        pool_rows = http_pool.pool_stats()
+        if pool_rows:
+            st.dataframe(pd.DataFrame(pool_rows), use_container_width=True)
+            st.caption("connections はプロセス起動後に張った接続数（OpenAI は現在プール中の数）。"
+                       "reuse_rate = 1 − connections / requests")
+        else:
+            st.info("まだ外部呼び出しはありません。")
 
+    with st.expander("ADMIN：保存シートの分割（シャード一覧）"):
+        secret_json, secret_sheet_id = sheets_credentials()
+        if secret_json and secret_sheet_id:
+            router = shard_router(secret_json, secret_sheet_id)
+            try:
+                shard_rows = router.index(force=st.button("一覧を再読込", key="admin_shards_reload"))
+            except Exception as e:
+                shard_rows = []
+                st.warning(f"シャード一覧を取得できませんでした: {e}")
+            if shard_rows:
+                st.dataframe(pd.DataFrame(shard_rows), use_container_width=True)
+            if router.status():
+                st.dataframe(pd.DataFrame(router.status()), use_container_width=True)
+            st.caption(f"上限 {router.max_rows:,} 行/シート・{router.cell_budget:,} セル/スプレッドシート"
+                       f"（スプレッドシート {len(router.spreadsheet_ids)} 件）。rows はこのプロセスで最後に書いた行番号")
+        else:
+            st.info("Sheets 未設定のため、保存は CSV のみです。")
+
+    with st.expander("ADMIN：Sheets API スケジューラ（クォータ・待ち行列）"):
+        sched = SHEETS.stats()
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("API 呼び出し", sched["calls"])
+        c2.metric("429（クォータ超過）", sched["throttled"])
+        c3.metric("まとめた行", sched["coalesced_rows"])
+        c4.metric("待ち行列", sum(sched["queue"].values()))
+        st.caption(
+            f"上限 read {sched['rpm']['read']} / write {sched['rpm']['write']} 回/分 ／ "
+            f"待ち行列 {sched['queue']} ／ 停止中 {sched['blocked_sec']} 秒 ／ "
+            f"追記 {sched['batches']} 回・{sched['rows']} 行 ／ 再試行 {sched['retries']}・"
+            f"エラー {sched['errors']}・あふれ {sched['dropped']}"
+        )
+
+    with st.expander("ADMIN：結果画面の待ち時間予算（SLO・縮退）"):
+        slo_st = SLO.status()
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("全体の予算", f"{slo_st['total_sec']:.1f} s" if slo_st["enabled"] else "なし")
+        c2.metric("予算内の割合", "-" if slo_st["met_rate"] is None else f"{slo_st['met_rate'] * 100:.1f}%")
+        c3.metric("縮退した割合", "-" if slo_st["degraded_rate"] is None else f"{slo_st['degraded_rate'] * 100:.1f}%")
+        c4.metric("保存待ち行列", slo_st["deferred_pending"])
+        st.caption(
+            f"直近 {slo_st['recent']} 件（このプロセス）／ ステージの予算 "
+            + "・".join(f"{k} {v:.1f}s" for k, v in slo_st["budgets"].items())
+            + " ／ 縮退 " + "・".join(f"{k} {n}" for k, n in slo_st["actions"].items())
+        )
+
+    with st.expander("ADMIN：同時実行の制御（AI・PDF の待ち行列）"):
+        st.dataframe(pd.DataFrame(admission.stats()), use_container_width=True)
+        st.caption("slots は同時実行数（Secrets: AI_CONCURRENCY / PDF_CONCURRENCY）、max_queue は待ち行列の上限"
+                   "（ADMISSION_MAX_QUEUE）。shed は予算内に順番が来ない見込みで縮退した件数（このプロセス）")
+
+    render_profile_capture()